@@ -1,138 +1,558 @@
 import argparse
+import json
 import logging
-from collections import deque
+from contextlib import ExitStack
+from functools import partial
 from threading import Thread, Event
-from time import sleep, time
+from time import time
 
+import zmq
 from bsread import source, PULL
+from bsread.handlers import compact
 from bsread.sender import sender, PUSH
 
-from sf_bsread_writer.buffer_analyzer import analyze_message
+from sf_bsread_writer.buffer_analyzer import StreamAnalyzer
+from sf_bsread_writer.buffer_request import START_PULSE_ID_KEY, OUTPUT_PORT_KEY, FIRST_PULSE_ID_KEY
+from sf_bsread_writer.buffer_rest import start_rest_api
+from sf_bsread_writer.buffer_storage import MmapRingBuffer
+from sf_bsread_writer.channel_filter import ChannelFilter, verify_channel_patterns
+from sf_bsread_writer.metrics import Histogram
+from sf_bsread_writer.raw_message import receive_raw_message, send_raw_message, get_message_pulse_id, \
+    get_message_size, measure_message
+from sf_bsread_writer.ring_buffer import RingBuffer
 
 _logger = logging.getLogger(__name__)
 
+DEFAULT_BUFFER_LENGTH = 100
+DEFAULT_SEGMENT_SIZE = 256 * 1024 ** 2
+
+
+def log_buffer_status(message_buffer):
+    _logger.info("Buffer occupancy: %d messages, %d bytes (%d messages evicted).",
+                 len(message_buffer), message_buffer.n_bytes, message_buffer.n_evicted)
+
+    for cursor in message_buffer.cursors:
+        _logger.info("Consumer '%s': %d messages sent, %d messages dropped, %d messages behind.",
+                     cursor.name, cursor.n_read, cursor.n_dropped,
+                     message_buffer.next_sequence - max(cursor.sequence, message_buffer.first_sequence))
+
+
+class StreamBuffer(object):
+    def __init__(self, stream_address, message_buffer, output_ports, raw_forwarding=False, analyzer=None,
+                 channels_include=None, channels_exclude=None):
+        self.stream_address = stream_address
+        self.message_buffer = message_buffer
+        self.output_ports = output_ports
+        self.raw_forwarding = raw_forwarding
+        self.analyzer = analyzer
+
+        # Channels sent to the output ports - the whole stream is buffered.
+        self.channels_include = channels_include
+        self.channels_exclude = channels_exclude
+
+        # Time between receiving and sending the message, per output port.
+        self.latency_histograms = {port: Histogram() for port in output_ports}
+
+    def get_channel_filter(self):
+
+        if not self.channels_include and not self.channels_exclude:
+            return None
+
+        return ChannelFilter(self.channels_include, self.channels_exclude)
+
+
+def connect_to_stream(stream_address, mode=PULL, receive_timeout=1000):
+
+    source_host, source_port = stream_address.rsplit(":", maxsplit=1)
+
+    source_host = source_host.split("//")[1]
+    source_port = int(source_port)
+
+    _logger.info("Input stream host '%s' and port '%s'.", source_host, source_port)
+
+    return source(host=source_host, port=source_port, mode=mode, receive_timeout=receive_timeout)
+
+
+def get_receive_function(stream, raw_forwarding):
+
+    # In raw forwarding mode the frames are kept as received, only the main header is decoded.
+    if raw_forwarding:
+        return partial(stream.receive, handler=receive_raw_message)
+
+    # The message size is taken from the received frames.
+    handler = partial(measure_message, handler=compact.Handler().receive)
+    return partial(stream.receive, handler=handler)
+
+
+def buffer_received_message(message, message_buffer, raw_forwarding=False):
+    message_timestamp = time()
+
+    if raw_forwarding:
+        message = message.data
+        pulse_id = get_message_pulse_id(message)
+        n_bytes = get_message_size(message)
+    else:
+        message.data, n_bytes = message.data
+        pulse_id = message.data.pulse_id
+
+    message_buffer.append(pulse_id, (pulse_id, message, message_timestamp), n_bytes)
+
+    _logger.debug('Message with pulse_id %d, size %d bytes and timestamp %s added to the buffer.',
+                  pulse_id, n_bytes, message_timestamp)
+
 
 def buffer_bsread_messages(stream_address, message_buffer, running_event, use_analyzer=False, receive_timeout=1000,
-                           mode=PULL):
+                           mode=PULL, raw_forwarding=False, status_interval=10):
 
     _logger.info("Input stream connecting to '%s'.", stream_address)
 
-    try:
-
-        source_host, source_port = stream_address.rsplit(":", maxsplit=1)
+    # The analyzer reads the buffer in its own thread, off the receiving path.
+    if use_analyzer:
+        analyzer = StreamAnalyzer(stream_address, raw_forwarding)
+        Thread(target=analyzer.run, args=(message_buffer, running_event), daemon=True).start()
 
-        source_host = source_host.split("//")[1]
-        source_port = int(source_port)
+    try:
 
-        _logger.info("Input stream host '%s' and port '%s'.", source_host, source_port)
+        with connect_to_stream(stream_address, mode, receive_timeout) as stream:
 
-        with source(host=source_host, port=source_port, mode=mode, receive_timeout=receive_timeout) as stream:
+            receive_message = get_receive_function(stream, raw_forwarding)
+            last_status_timestamp = time()
 
             while running_event.is_set():
-                message = stream.receive()
+                message = receive_message()
 
                 # In case you set a receive timeout, the returned message can be None.
                 if message is None:
                     continue
 
-                message_timestamp = time()
+                buffer_received_message(message, message_buffer, raw_forwarding)
+
+                if time() - last_status_timestamp >= status_interval:
+                    log_buffer_status(message_buffer)
+                    last_status_timestamp = time()
 
-                if use_analyzer:
-                    analyze_message(message)
+    except Exception as e:
+        running_event.clear()
+        _logger.error("Exception happened in buffer thread. Stopping buffer: %s", e)
 
-                message_buffer.append((message, message_timestamp))
 
-                _logger.debug('Message with pulse_id %d and timestamp %s added to the buffer.',
-                              message.data.pulse_id, message_timestamp)
+def buffer_bsread_streams(stream_buffers, running_event, poll_timeout=1000, mode=PULL, status_interval=10):
+
+    try:
+
+        with ExitStack() as exit_stack:
+
+            # All the input streams are received in this thread - we poll their sockets.
+            poller = zmq.Poller()
+            receivers = {}
+
+            for stream_buffer in stream_buffers:
+                _logger.info("Input stream connecting to '%s'.", stream_buffer.stream_address)
+
+                stream = exit_stack.enter_context(connect_to_stream(stream_buffer.stream_address, mode))
+                stream_socket = stream.stream.socket
+
+                poller.register(stream_socket, zmq.POLLIN)
+                receivers[stream_socket] = (get_receive_function(stream, stream_buffer.raw_forwarding),
+                                            stream_buffer)
+
+            last_status_timestamp = time()
+
+            while running_event.is_set():
+
+                # One message per ready stream in each iteration, so a busy stream cannot starve the others.
+                for stream_socket, _ in poller.poll(poll_timeout):
+                    receive_message, stream_buffer = receivers[stream_socket]
+
+                    message = receive_message()
+
+                    if message is None:
+                        continue
+
+                    buffer_received_message(message, stream_buffer.message_buffer, stream_buffer.raw_forwarding)
+
+                if time() - last_status_timestamp >= status_interval:
+                    for stream_buffer in stream_buffers:
+                        _logger.info("Status of stream '%s'.", stream_buffer.stream_address)
+                        log_buffer_status(stream_buffer.message_buffer)
+
+                    last_status_timestamp = time()
 
     except Exception as e:
         running_event.clear()
-        _logger.error("Exception happened in buffer thread. Stopping buffer.", e)
+        _logger.error("Exception happened in buffer thread. Stopping buffer: %s", e)
 
 
-def send_bsread_message(output_port, message_buffer, running_event, mode=PUSH, buffer_timeout=0.01):
+def send_bsread_message(output_port, message_buffer, running_event, mode=PUSH, buffer_timeout=0.5,
+                        raw_forwarding=False, cursor=None, latency_histogram=None, channel_filter=None):
 
     _logger.info("Output stream binding to port '%s'.", output_port)
 
+    if cursor is None:
+        cursor = message_buffer.cursor(output_port)
+
     try:
 
         with sender(port=output_port, mode=mode, queue_size=1) as output_stream:
 
             while running_event.is_set():
 
-                if len(message_buffer) == 0:
-                    sleep(buffer_timeout)
+                # Blocks until a message is available - the timeout is only used to check the running_event.
+                buffer_entry = message_buffer.read(cursor, timeout=buffer_timeout)
+
+                if buffer_entry is None:
                     continue
 
-                message, message_timestamp = message_buffer.popleft()
+                pulse_id, message, message_timestamp = buffer_entry
+
+                # Raw frames are forwarded unchanged - no re-serialization and no type checks.
+                if raw_forwarding:
+
+                    # Only the frames of the selected channels are sent.
+                    if channel_filter is not None:
+                        message = channel_filter.filter_frames(message)
+
+                    send_raw_message(output_stream, message)
+
+                    if latency_histogram is not None:
+                        latency_histogram.observe(time() - message_timestamp)
+
+                    _logger.debug("Raw message with pulse_id '%s' forwarded.", pulse_id)
+                    continue
 
                 data = {}
                 for value_name, bsread_value in message.data.data.items():
-                    data[value_name] = bsread_value.value
+                    if channel_filter is None or channel_filter.is_selected(value_name):
+                        data[value_name] = bsread_value.value
 
-                _logger.debug("Sending message with pulse_id '%s'.", message.data.pulse_id)
+                _logger.debug("Sending message with pulse_id '%s'.", pulse_id)
 
                 output_stream.send(timestamp=message_timestamp,
-                                   pulse_id=message.data.pulse_id,
+                                   pulse_id=pulse_id,
                                    data=data,
                                    check_data=True)
 
-                _logger.debug("Message with pulse_id '%s' forwarded.", message.data.pulse_id)
+                if latency_histogram is not None:
+                    latency_histogram.observe(time() - message_timestamp)
+
+                _logger.debug("Message with pulse_id '%s' forwarded.", pulse_id)
 
     except Exception as e:
         running_event.clear()
-        _logger.error("Exception happened in sending thread. Stopping buffer.", e)
+        _logger.error("Exception happened in sending thread. Stopping buffer: %s", e)
+
+
+def process_buffer_request(request, consumers):
+
+    if START_PULSE_ID_KEY not in request:
+        raise ValueError("Unknown buffer request '%s'." % request)
+
+    start_pulse_id = int(request[START_PULSE_ID_KEY])
+
+    # The output port can be omitted if there is only 1 consumer.
+    if OUTPUT_PORT_KEY in request:
+        output_port = int(request[OUTPUT_PORT_KEY])
+    elif len(consumers) == 1:
+        output_port = next(iter(consumers))
+    else:
+        raise ValueError("Buffer has multiple output ports %s, output_port must be specified." % list(consumers))
+
+    if output_port not in consumers:
+        raise ValueError("Unknown output_port %d. Available output ports: %s." % (output_port, list(consumers)))
+
+    message_buffer, cursor = consumers[output_port]
+
+    _logger.info("Replay from start_pulse_id %d requested on output port %d.", start_pulse_id, output_port)
+
+    first_pulse_id = message_buffer.seek(cursor, start_pulse_id)
+
+    if first_pulse_id is None:
+        status = "Start pulse_id %d not yet in buffer. Sending from next message." % start_pulse_id
+    else:
+        status = "Replaying from pulse_id %d." % first_pulse_id
 
+    _logger.info(status)
 
-def start_server(stream_address, output_port, ring_buffer_length, use_analyzer=False):
-    _logger.info("Requesting stream from: %s", stream_address)
+    return {"state": "ok",
+            "status": status,
+            FIRST_PULSE_ID_KEY: first_pulse_id}
 
-    message_buffer = deque(maxlen=ring_buffer_length)
+
+def serve_buffer_requests(request_port, consumers, running_event, receive_timeout=1000):
+
+    _logger.info("Request channel binding to port '%s'.", request_port)
+
+    request_socket = zmq.Context.instance().socket(zmq.REP)
+    request_socket.setsockopt(zmq.RCVTIMEO, receive_timeout)
+    request_socket.setsockopt(zmq.LINGER, 0)
+
+    try:
+        request_socket.bind("tcp://*:%d" % request_port)
+
+        while running_event.is_set():
+
+            try:
+                request = request_socket.recv_json()
+            except zmq.Again:
+                continue
+
+            try:
+                response = process_buffer_request(request, consumers)
+            except Exception as e:
+                _logger.error("Buffer request '%s' failed: %s", request, e)
+                response = {"state": "error",
+                            "status": str(e)}
+
+            request_socket.send_json(response)
+
+    except Exception as e:
+        running_event.clear()
+        _logger.error("Exception happened in request thread. Stopping buffer: %s", e)
+
+    finally:
+        request_socket.close()
+
+
+def parse_bytes(value):
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+    value = value.strip().upper().rstrip("B")
+
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+
+    return int(value)
+
+
+def create_message_buffer(ring_buffer_length, ring_buffer_bytes=None, storage_folder=None,
+                          segment_size=DEFAULT_SEGMENT_SIZE):
+
+    if storage_folder is None:
+
+        if ring_buffer_bytes is not None:
+            _logger.info("Limiting the buffer to %d bytes.", ring_buffer_bytes)
+
+        return RingBuffer(maxlen=ring_buffer_length, max_bytes=ring_buffer_bytes)
+
+    if ring_buffer_bytes is None:
+        raise ValueError("The buffer size in bytes is needed for the storage in folder '%s'." % storage_folder)
+
+    n_segments = max(2, -(-ring_buffer_bytes // segment_size))
+
+    return MmapRingBuffer(storage_folder, segment_size, n_segments, maxlen=ring_buffer_length)
+
+
+def load_stream_buffers(config_file, defaults):
+
+    with open(config_file) as input_file:
+        stream_configs = json.load(input_file)
+
+    stream_buffers = []
+
+    for stream_config in stream_configs:
+        config = dict(defaults)
+        config.update(stream_config)
+
+        if "stream" not in config or "output_port" not in config:
+            raise ValueError("Stream config needs 'stream' and 'output_port', but received '%s'." % stream_config)
+
+        stream_buffers.append(create_stream_buffer(**config))
+
+    return stream_buffers
+
+
+def create_stream_buffer(stream, output_port, buffer_length=None, buffer_bytes=None, storage_folder=None,
+                         segment_size=DEFAULT_SEGMENT_SIZE, raw=False, analyzer=False, analyzer_sampling=1,
+                         analyzer_report_interval=10, channels_include=None, channels_exclude=None):
+
+    _logger.info("Requesting stream from: %s", stream)
+
+    if storage_folder is not None and not raw:
+        raise ValueError("Storing the buffer in segment files is possible only in raw forwarding mode.")
+
+    verify_channel_patterns(channels_include)
+    verify_channel_patterns(channels_exclude)
+
+    # Sizes in a config file can be strings with units.
+    if isinstance(buffer_bytes, str):
+        buffer_bytes = parse_bytes(buffer_bytes)
+
+    if isinstance(segment_size, str):
+        segment_size = parse_bytes(segment_size)
+
+    if buffer_length is None and buffer_bytes is None:
+        buffer_length = DEFAULT_BUFFER_LENGTH
+
+    message_buffer = create_message_buffer(buffer_length, buffer_bytes, storage_folder, segment_size)
+    output_ports = output_port if isinstance(output_port, (list, tuple)) else [output_port]
+
+    if analyzer:
+        analyzer = StreamAnalyzer(stream, raw, analyzer_sampling, analyzer_report_interval)
+    else:
+        analyzer = None
+
+    return StreamBuffer(stream, message_buffer, output_ports, raw_forwarding=raw, analyzer=analyzer,
+                        channels_include=channels_include, channels_exclude=channels_exclude)
+
+
+def start_streams(stream_buffers, request_port=None, metrics_port=None):
 
     running_event = Event()
     running_event.set()
 
-    buffer_thread = Thread(target=buffer_bsread_messages, args=(stream_address, message_buffer,
-                                                                running_event, use_analyzer))
-    send_thread = Thread(target=send_bsread_message, args=(output_port, message_buffer, running_event))
+    # Each output port is an independent consumer with its own cursor (fan-out).
+    consumers = {}
+
+    for stream_buffer in stream_buffers:
+        for port in stream_buffer.output_ports:
+
+            if port in consumers:
+                raise ValueError("Output port %d used more than once." % port)
+
+            consumers[port] = (stream_buffer.message_buffer, stream_buffer.message_buffer.cursor(port))
 
-    buffer_thread.start()
-    send_thread.start()
+    threads = [Thread(target=buffer_bsread_streams, args=(stream_buffers, running_event))]
 
-    _logger.info("Started listening to the stream.")
+    for stream_buffer in stream_buffers:
+        for port in stream_buffer.output_ports:
+            message_buffer, cursor = consumers[port]
+
+            threads.append(Thread(target=send_bsread_message, args=(port, message_buffer, running_event),
+                                  kwargs={"raw_forwarding": stream_buffer.raw_forwarding,
+                                          "cursor": cursor,
+                                          "latency_histogram": stream_buffer.latency_histograms[port],
+                                          "channel_filter": stream_buffer.get_channel_filter()}))
+
+    for stream_buffer in stream_buffers:
+        if stream_buffer.analyzer is not None:
+            threads.append(Thread(target=stream_buffer.analyzer.run, args=(stream_buffer.message_buffer,
+                                                                           running_event)))
+
+    if request_port is not None:
+        threads.append(Thread(target=serve_buffer_requests, args=(request_port, consumers, running_event)))
+
+    for thread in threads:
+        thread.start()
+
+    # The metrics API does not stop by itself, so the process can exit without it.
+    if metrics_port is not None:
+        Thread(target=start_rest_api, args=(stream_buffers, metrics_port), daemon=True).start()
+
+    _logger.info("Started listening to %d stream(s).", len(stream_buffers))
 
     # We wait indefinitely.
-    buffer_thread.join()
-    send_thread.join()
+    for thread in threads:
+        thread.join()
+
+
+def start_server(stream_address, output_port, ring_buffer_length, use_analyzer=False, raw_forwarding=False,
+                 request_port=None, ring_buffer_bytes=None, storage_folder=None, segment_size=DEFAULT_SEGMENT_SIZE,
+                 analyzer_sampling=1, analyzer_report_interval=10, metrics_port=None, channels_include=None,
+                 channels_exclude=None):
+
+    stream_buffer = create_stream_buffer(stream=stream_address,
+                                         output_port=output_port,
+                                         buffer_length=ring_buffer_length,
+                                         buffer_bytes=ring_buffer_bytes,
+                                         storage_folder=storage_folder,
+                                         segment_size=segment_size,
+                                         raw=raw_forwarding,
+                                         analyzer=use_analyzer,
+                                         analyzer_sampling=analyzer_sampling,
+                                         analyzer_report_interval=analyzer_report_interval,
+                                         channels_include=channels_include,
+                                         channels_exclude=channels_exclude)
+
+    start_streams([stream_buffer], request_port, metrics_port)
 
 
 def run():
     parser = argparse.ArgumentParser(description='bsread buffer')
 
-    parser.add_argument("stream", help="Stream source in format tcp://127.0.0.1:10000")
+    parser.add_argument("stream", nargs="?", default=None, help="Stream source in format tcp://127.0.0.1:10000")
+    parser.add_argument("-c", "--config", default=None,
+                        help="JSON file with a list of streams to buffer in this process. The command line "
+                             "arguments are used as defaults for each stream.")
 
-    parser.add_argument('-o', '--output_port', type=int, default=8082,
-                        help="Port to bind the output stream to.")
-    parser.add_argument("-b", "--buffer_length", type=int, default=100,
-                        help="Length of the ring buffer.")
+    parser.add_argument('-o', '--output_port', type=int, nargs="+", default=[8082],
+                        help="Port(s) to bind the output stream to. Each port gets all the messages.")
+    parser.add_argument("-b", "--buffer_length", type=int, default=None,
+                        help="Length of the ring buffer (default 100 if no buffer_bytes is given).")
+    parser.add_argument("--buffer_bytes", type=parse_bytes, default=None,
+                        help="Maximum size of the ring buffer payload in bytes (suffixes K, M, G, T accepted).")
 
     parser.add_argument("--log_level", default="INFO",
                         choices=['CRITICAL', 'ERROR', 'WARNING', 'INFO', 'DEBUG'],
                         help="Log level to use.")
 
     parser.add_argument("--analyzer", action="store_true", help="Analyze the incoming stream for anomalies.")
+    parser.add_argument("--analyzer_sampling", type=int, default=1,
+                        help="Analyze only 1 in N messages.")
+    parser.add_argument("--analyzer_report_interval", type=float, default=10,
+                        help="Interval in seconds between analyzer reports.")
+    parser.add_argument("--storage_folder", default=None,
+                        help="Store the buffered frames in memory mapped segment files in this folder "
+                             "(requires --raw and --buffer_bytes).")
+    parser.add_argument("--segment_size", type=parse_bytes, default=DEFAULT_SEGMENT_SIZE,
+                        help="Size of a storage segment file in bytes (suffixes K, M, G, T accepted).")
+    parser.add_argument("-r", "--request_port", type=int, default=None,
+                        help="Port to bind the request channel to (replay from pulse_id).")
+    parser.add_argument("-m", "--metrics_port", type=int, default=None,
+                        help="Port for the metrics REST api (JSON statistics and Prometheus metrics).")
+    parser.add_argument("--raw", action="store_true",
+                        help="Forward the received frames without decoding them (only the main header is decoded).")
+    parser.add_argument("--channels_include", nargs="+", default=None,
+                        help="Send only the channels matching these glob patterns to the output ports.")
+    parser.add_argument("--channels_exclude", nargs="+", default=None,
+                        help="Do not send the channels matching these glob patterns to the output ports.")
 
     arguments = parser.parse_args()
 
     # Setup the logging level.
     logging.basicConfig(level=arguments.log_level, format='[%(levelname)s] %(message)s')
 
+    if (arguments.stream is None) == (arguments.config is None):
+        parser.error("Specify either the stream or the --config file.")
+
+    if arguments.storage_folder is not None and (not arguments.raw or arguments.buffer_bytes is None):
+        parser.error("--storage_folder requires --raw and --buffer_bytes.")
+
+    if arguments.config is not None:
+        _logger.info("Loading streams from config file '%s'.", arguments.config)
+
+        # Output ports (and storage folders) must be unique, so they come only from the config file.
+        defaults = {"buffer_length": arguments.buffer_length,
+                    "buffer_bytes": arguments.buffer_bytes,
+                    "segment_size": arguments.segment_size,
+                    "raw": arguments.raw,
+                    "analyzer": arguments.analyzer,
+                    "analyzer_sampling": arguments.analyzer_sampling,
+                    "analyzer_report_interval": arguments.analyzer_report_interval,
+                    "channels_include": arguments.channels_include,
+                    "channels_exclude": arguments.channels_exclude}
+
+        start_streams(stream_buffers=load_stream_buffers(arguments.config, defaults),
+                      request_port=arguments.request_port,
+                      metrics_port=arguments.metrics_port)
+
+        return
+
     _logger.info("Connecting to stream '%s'.", arguments.stream)
 
     start_server(stream_address=arguments.stream,
                  output_port=arguments.output_port,
                  ring_buffer_length=arguments.buffer_length,
-                 use_analyzer=arguments.analyzer)
+                 use_analyzer=arguments.analyzer,
+                 raw_forwarding=arguments.raw,
+                 request_port=arguments.request_port,
+                 ring_buffer_bytes=arguments.buffer_bytes,
+                 storage_folder=arguments.storage_folder,
+                 segment_size=arguments.segment_size,
+                 analyzer_sampling=arguments.analyzer_sampling,
+                 analyzer_report_interval=arguments.analyzer_report_interval,
+                 metrics_port=arguments.metrics_port,
+                 channels_include=arguments.channels_include,
+                 channels_exclude=arguments.channels_exclude)
 
 
 if __name__ == "__main__":
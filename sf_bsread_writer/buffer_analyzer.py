@@ -1,11 +1,119 @@
 import logging
+from time import time
+
+import numpy
+
+from sf_bsread_writer.raw_message import get_main_header, get_data_header, get_value_frames
 
 _logger = logging.getLogger(__name__)
 
+N_REPORTED_CHANNELS = 10
+
+
+def get_missing_values(message):
+    values = message.data.data.values()
+    return numpy.fromiter((value.value is None for value in values), dtype=bool, count=len(values))
+
+
+def get_missing_raw_values(frames):
+    # Missing values are sent as empty frames.
+    value_frames = get_value_frames(frames)
+    return numpy.fromiter((len(frame) == 0 for frame in value_frames), dtype=bool, count=len(value_frames))
+
+
+class StreamAnalyzer(object):
+    def __init__(self, name, raw_forwarding=False, sampling=1, report_interval=10):
+        self.name = name
+        self.raw_forwarding = raw_forwarding
+        self.sampling = sampling
+        self.report_interval = report_interval
+
+        self.channel_names = []
+        self.data_header_hash = None
+
+        self.n_analyzed = 0
+        self.n_missing = numpy.zeros(0, dtype=numpy.uint64)
+
+        self.last_report_timestamp = time()
+
+    def _reset_channels(self, channel_names):
+        _logger.info("Analyzer for '%s' detected %d channels. Resetting counters.", self.name, len(channel_names))
+
+        self.channel_names = channel_names
+        self.n_analyzed = 0
+        self.n_missing = numpy.zeros(len(channel_names), dtype=numpy.uint64)
+
+    def _get_raw_channel_names(self, frames, main_header):
+        try:
+            return [channel["name"] for channel in get_data_header(frames, main_header)["channels"]]
+
+        except Exception as e:
+            _logger.warning("Analyzer for '%s' cannot read the channel names: %s", self.name, e)
+            return ["channel_%d" % index for index in range(len(get_value_frames(frames)))]
+
+    def analyze(self, message):
+
+        if self.raw_forwarding:
+            main_header = get_main_header(message)
+
+            if main_header.get("hash") != self.data_header_hash:
+                self.data_header_hash = main_header.get("hash")
+                self._reset_channels(self._get_raw_channel_names(message, main_header))
+
+            missing_values = get_missing_raw_values(message)
+
+        else:
+            channel_names = list(message.data.data.keys())
+
+            if channel_names != self.channel_names:
+                self._reset_channels(channel_names)
+
+            missing_values = get_missing_values(message)
+
+        self.n_missing += missing_values
+        self.n_analyzed += 1
+
+    def get_report(self):
+        missing_channels = numpy.flatnonzero(self.n_missing)
+
+        # The channels with the most missing values first.
+        worst_channels = missing_channels[numpy.argsort(self.n_missing[missing_channels])[::-1]]
+
+        return {"n_analyzed": self.n_analyzed,
+                "sampling": self.sampling,
+                "n_channels": len(self.channel_names),
+                "n_channels_with_missing_data": len(missing_channels),
+                "missing_data": {self.channel_names[index]: int(self.n_missing[index])
+                                 for index in worst_channels[:N_REPORTED_CHANNELS]}}
+
+    def log_report(self):
+        report = self.get_report()
+
+        _logger.info("Analyzer report for '%s': %d messages analyzed (1 in %d), %d of %d channels with missing data.",
+                     self.name, report["n_analyzed"], report["sampling"],
+                     report["n_channels_with_missing_data"], report["n_channels"])
+
+        for channel_name, n_missing in report["missing_data"].items():
+            _logger.info("Channel '%s' data missing in %d of %d analyzed messages.",
+                         channel_name, n_missing, report["n_analyzed"])
+
+    def run(self, message_buffer, running_event, buffer_timeout=0.5):
+        cursor = message_buffer.cursor("analyzer")
+
+        while running_event.is_set():
+            buffer_entry = message_buffer.read(cursor, timeout=buffer_timeout)
+
+            if buffer_entry is not None:
+                _, message, _ = buffer_entry
+
+                try:
+                    self.analyze(message)
+                except Exception as e:
+                    _logger.warning("Analyzer for '%s' could not analyze message: %s", self.name, e)
 
-def analyze_message(message):
-    pulse_id = message.data.pulse_id
+                # Analyze only 1 in sampling messages.
+                message_buffer.skip(cursor, self.sampling - 1)
 
-    for name, value in message.data.data.items():
-        if value.value is None:
-            _logger.info("Channel '%s' data missing in pulse_id %d.", name, pulse_id)
+            if time() - self.last_report_timestamp >= self.report_interval:
+                self.log_report()
+                self.last_report_timestamp = time()
@@ -0,0 +1,40 @@
+import logging
+
+import zmq
+
+_logger = logging.getLogger(__name__)
+
+# JSON protocol of the buffer request channel.
+START_PULSE_ID_KEY = "start_pulse_id"
+OUTPUT_PORT_KEY = "output_port"
+FIRST_PULSE_ID_KEY = "pulse_id"
+
+
+def request_buffer_replay(request_address, start_pulse_id, output_port=None, timeout=1000):
+    # Returns the first pulse_id that is replayed, or None if the start pulse_id is not yet in the buffer.
+
+    _logger.info("Requesting replay from pulse_id %d at '%s'.", start_pulse_id, request_address)
+
+    request = {START_PULSE_ID_KEY: start_pulse_id}
+
+    if output_port is not None:
+        request[OUTPUT_PORT_KEY] = output_port
+
+    request_socket = zmq.Context.instance().socket(zmq.REQ)
+    request_socket.setsockopt(zmq.RCVTIMEO, timeout)
+    request_socket.setsockopt(zmq.SNDTIMEO, timeout)
+    request_socket.setsockopt(zmq.LINGER, 0)
+
+    try:
+        request_socket.connect(request_address)
+        request_socket.send_json(request)
+
+        response = request_socket.recv_json()
+
+    finally:
+        request_socket.close()
+
+    if response["state"] != "ok":
+        raise ValueError("Buffer replay request failed: %s" % response["status"])
+
+    return response[FIRST_PULSE_ID_KEY]
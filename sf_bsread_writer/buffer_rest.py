@@ -0,0 +1,131 @@
+import json
+import logging
+from collections import OrderedDict
+
+import bottle
+
+from sf_bsread_writer.metrics import PrometheusText, RateMeter
+
+_logger = logging.getLogger(__name__)
+
+
+class BufferStatistics(object):
+    def __init__(self, stream_buffers):
+        self.stream_buffers = stream_buffers
+        self.rate_meters = {}
+
+    def _get_rate(self, key, value):
+        if key not in self.rate_meters:
+            self.rate_meters[key] = RateMeter()
+
+        return self.rate_meters[key].update(value)
+
+    def get_statistics(self):
+        statistics = []
+
+        for stream_buffer in self.stream_buffers:
+            message_buffer = stream_buffer.message_buffer
+            stream_address = stream_buffer.stream_address
+
+            consumers = OrderedDict()
+
+            for cursor in message_buffer.cursors:
+                consumer_key = (stream_address, cursor.name)
+                latency_histogram = stream_buffer.latency_histograms.get(cursor.name)
+
+                consumers[str(cursor.name)] = {
+                    "messages_sent": cursor.n_read,
+                    "bytes_sent": cursor.n_bytes_read,
+                    "messages_dropped": cursor.n_dropped,
+                    "messages_behind": message_buffer.next_sequence - max(cursor.sequence,
+                                                                          message_buffer.first_sequence),
+                    "messages_per_second": self._get_rate(consumer_key + ("messages",), cursor.n_read),
+                    "bytes_per_second": self._get_rate(consumer_key + ("bytes",), cursor.n_bytes_read),
+                    "latency": latency_histogram.get_statistics() if latency_histogram else None}
+
+            stream_statistics = {
+                "stream": stream_address,
+                "messages_received": message_buffer.next_sequence,
+                "bytes_received": message_buffer.n_bytes_appended,
+                "messages_per_second": self._get_rate((stream_address, "messages"), message_buffer.next_sequence),
+                "bytes_per_second": self._get_rate((stream_address, "bytes"), message_buffer.n_bytes_appended),
+                "occupancy_messages": len(message_buffer),
+                "occupancy_bytes": message_buffer.n_bytes,
+                "messages_evicted": message_buffer.n_evicted,
+                "consumers": consumers}
+
+            if stream_buffer.analyzer is not None:
+                stream_statistics["analyzer"] = stream_buffer.analyzer.get_report()
+
+            statistics.append(stream_statistics)
+
+        return statistics
+
+    def get_prometheus_text(self):
+        metrics = PrometheusText()
+
+        for stream_buffer in self.stream_buffers:
+            message_buffer = stream_buffer.message_buffer
+            stream_labels = OrderedDict([("stream", stream_buffer.stream_address)])
+
+            metrics.add("sf_bsread_buffer_received_messages_total", message_buffer.next_sequence,
+                        stream_labels, "counter")
+            metrics.add("sf_bsread_buffer_received_bytes_total", message_buffer.n_bytes_appended,
+                        stream_labels, "counter")
+            metrics.add("sf_bsread_buffer_evicted_messages_total", message_buffer.n_evicted, stream_labels, "counter")
+            metrics.add("sf_bsread_buffer_occupancy_messages", len(message_buffer), stream_labels)
+            metrics.add("sf_bsread_buffer_occupancy_bytes", message_buffer.n_bytes, stream_labels)
+
+            for cursor in message_buffer.cursors:
+                consumer_labels = OrderedDict(stream_labels)
+                consumer_labels["consumer"] = cursor.name
+
+                metrics.add("sf_bsread_buffer_sent_messages_total", cursor.n_read, consumer_labels, "counter")
+                metrics.add("sf_bsread_buffer_sent_bytes_total", cursor.n_bytes_read, consumer_labels, "counter")
+                metrics.add("sf_bsread_buffer_dropped_messages_total", cursor.n_dropped, consumer_labels, "counter")
+
+                latency_histogram = stream_buffer.latency_histograms.get(cursor.name)
+
+                if latency_histogram is not None:
+                    metrics.add_histogram("sf_bsread_buffer_send_latency_seconds", latency_histogram, consumer_labels)
+
+        return metrics.get_text()
+
+
+def register_rest_interface(app, statistics):
+    @app.get("/status")
+    def get_status():
+        return {"state": "ok",
+                "status": "buffering"}
+
+    @app.get("/statistics")
+    def get_statistics():
+        return {"state": "ok",
+                "status": "buffering",
+                "statistics": statistics.get_statistics()}
+
+    @app.get("/metrics")
+    def get_metrics():
+        bottle.response.content_type = "text/plain; version=0.0.4"
+        return statistics.get_prometheus_text()
+
+    @app.error(500)
+    def error_handler_500(error):
+        bottle.response.content_type = 'application/json'
+        bottle.response.status = 200
+
+        error_text = str(error.exception)
+
+        _logger.error(error_text)
+
+        return json.dumps({"state": "error",
+                           "status": error_text})
+
+
+def start_rest_api(stream_buffers, rest_port, rest_host="127.0.0.1"):
+    app = bottle.Bottle()
+
+    register_rest_interface(app, BufferStatistics(stream_buffers))
+
+    _logger.info("Starting buffer metrics API on port %s." % rest_port)
+    bottle.run(app=app, host=rest_host, port=rest_port, quiet=True)
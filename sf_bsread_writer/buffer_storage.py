@@ -0,0 +1,116 @@
+import logging
+import mmap
+import os
+
+import zmq
+
+from sf_bsread_writer.ring_buffer import RingBuffer
+
+_logger = logging.getLogger(__name__)
+
+SEGMENT_FILE_NAME = "segment_%04d.bin"
+
+
+def open_segment(folder, index, segment_size):
+    file_name = os.path.join(folder, SEGMENT_FILE_NAME % index)
+
+    _logger.debug("Allocating segment file '%s' of %d bytes.", file_name, segment_size)
+
+    file_descriptor = os.open(file_name, os.O_RDWR | os.O_CREAT, 0o600)
+
+    try:
+        # Reserve the disk space upfront - we do not want to find out the disk is full while buffering.
+        if hasattr(os, "posix_fallocate"):
+            os.posix_fallocate(file_descriptor, 0, segment_size)
+        else:
+            os.ftruncate(file_descriptor, segment_size)
+
+        return mmap.mmap(file_descriptor, segment_size)
+
+    finally:
+        os.close(file_descriptor)
+
+
+class MmapRingBuffer(RingBuffer):
+    # Buffer entries are (pulse_id, frames, message_timestamp) - the frames are stored in the segment files and
+    # only their location is kept in memory.
+
+    def __init__(self, folder, segment_size, n_segments, maxlen=None):
+        super(MmapRingBuffer, self).__init__(maxlen=maxlen)
+
+        if n_segments < 2:
+            raise ValueError("At least 2 segments are needed, but %d requested." % n_segments)
+
+        _logger.info("Allocating %d segments of %d bytes in folder '%s'.", n_segments, segment_size, folder)
+
+        os.makedirs(folder, exist_ok=True)
+
+        self.segment_size = segment_size
+        self._segments = [open_segment(folder, index, segment_size) for index in range(n_segments)]
+
+        self._segment_index = 0
+        self._segment_offset = 0
+
+    def append(self, pulse_id, item, n_bytes=0):
+
+        if n_bytes > self.segment_size:
+            _logger.error("Message with pulse_id %d has %d bytes and does not fit in a segment of %d bytes. "
+                          "Dropping message.", pulse_id, n_bytes, self.segment_size)
+            return
+
+        super(MmapRingBuffer, self).append(pulse_id, item, n_bytes)
+
+    def close(self):
+        with self._condition:
+            self._evict(len(self))
+
+            for segment in self._segments:
+                segment.close()
+
+    def _store(self, item):
+        pulse_id, frames, message_timestamp = item
+
+        frame_sizes = [len(frame) for frame in frames]
+
+        # Move to the next segment - all the messages in it are the oldest in the buffer, so they are evicted.
+        if self._segment_offset + sum(frame_sizes) > self.segment_size:
+            self._segment_index = (self._segment_index + 1) % len(self._segments)
+            self._segment_offset = 0
+
+            self._evict_segment(self._segment_index)
+
+        segment = self._segments[self._segment_index]
+        location = (self._segment_index, self._segment_offset, frame_sizes)
+
+        offset = self._segment_offset
+        for frame, frame_size in zip(frames, frame_sizes):
+            segment[offset:offset + frame_size] = frame
+            offset += frame_size
+
+        self._segment_offset = offset
+
+        return pulse_id, location, message_timestamp
+
+    def _load(self, item):
+        pulse_id, (segment_index, offset, frame_sizes), message_timestamp = item
+
+        frames = []
+
+        # Frames are copied directly from the mapped segment into the ZMQ messages (called with the buffer lock).
+        with memoryview(self._segments[segment_index]) as segment_view:
+            for frame_size in frame_sizes:
+                with segment_view[offset:offset + frame_size] as frame_view:
+                    frames.append(zmq.Frame(frame_view, copy=True))
+
+                offset += frame_size
+
+        return pulse_id, frames, message_timestamp
+
+    def _evict_segment(self, segment_index):
+        while len(self) > 0:
+            _, (item_segment_index, _, _), _ = self._items[self.first_sequence % self._capacity]
+
+            if item_segment_index != segment_index:
+                break
+
+            self._evict(1)
@@ -0,0 +1,149 @@
+import hashlib
+import json
+from fnmatch import fnmatch
+
+from sf_bsread_writer.raw_message import decode_data_header, get_main_header
+
+
+def verify_channel_patterns(patterns):
+
+    if patterns is None:
+        return
+
+    if isinstance(patterns, str) or not all(isinstance(pattern, str) for pattern in patterns):
+        raise ValueError("Channel patterns must be a list of glob patterns, but received '%s'." % (patterns,))
+
+
+class ChannelFilter(object):
+    # Selects the channels matching one of the include patterns (all channels without them) and none of the
+    # exclude patterns.
+
+    def __init__(self, include=None, exclude=None):
+        verify_channel_patterns(include)
+        verify_channel_patterns(exclude)
+
+        self.include = list(include or [])
+        self.exclude = list(exclude or [])
+
+        self.selected_channels = {}
+
+        # The channels are matched once per data header, not on every message.
+        self.data_header_hash = None
+        self.selection = None
+
+    def is_selected(self, channel_name):
+
+        if channel_name not in self.selected_channels:
+            is_included = not self.include or any(fnmatch(channel_name, pattern) for pattern in self.include)
+            is_excluded = any(fnmatch(channel_name, pattern) for pattern in self.exclude)
+
+            self.selected_channels[channel_name] = is_included and not is_excluded
+
+        return self.selected_channels[channel_name]
+
+    def get_selection(self, main_header, raw_data_header):
+        # Returns which value frames are kept, the filtered data header and its hash.
+
+        if main_header["hash"] != self.data_header_hash:
+            data_header = decode_data_header(raw_data_header, main_header)
+
+            is_channel_selected = [self.is_selected(channel["name"]) for channel in data_header["channels"]]
+
+            data_header["channels"] = [channel for channel, is_selected
+                                       in zip(data_header["channels"], is_channel_selected) if is_selected]
+
+            filtered_data_header = json.dumps(data_header).encode()
+
+            # Each channel has a value and a timestamp frame.
+            is_frame_selected = [is_selected for is_selected in is_channel_selected for _ in range(2)]
+
+            self.data_header_hash = main_header["hash"]
+            self.selection = (is_frame_selected, filtered_data_header,
+                              hashlib.md5(filtered_data_header).hexdigest())
+
+        return self.selection
+
+    def get_main_header(self, main_header, data_header_hash):
+        # The filtered data header is not compressed.
+        main_header = dict(main_header, hash=data_header_hash)
+        main_header.pop("dh_compression", None)
+
+        return main_header
+
+    def filter_frames(self, frames):
+        main_header = get_main_header(frames)
+
+        if len(frames) < 2:
+            return frames
+
+        is_frame_selected, filtered_data_header, data_header_hash = self.get_selection(main_header, frames[1])
+
+        filtered_frames = [json.dumps(self.get_main_header(main_header, data_header_hash)).encode(),
+                           filtered_data_header]
+
+        filtered_frames.extend(frame for frame, is_selected in zip(frames[2:], is_frame_selected) if is_selected)
+
+        return filtered_frames
+
+
+class ChannelFilterReceiver(object):
+    # Gives the handler only the frames of the selected channels - the other frames are received, but not decoded.
+
+    def __init__(self, receiver, channel_filter):
+        self.receiver = receiver
+        self.channel_filter = channel_filter
+
+        self.headers = None
+        self.is_frame_selected = []
+        self.n_value_frames = 0
+
+    def _receive_headers(self):
+        main_header = self.receiver.next(as_json=True)
+
+        # The data header is needed for the hash in the main header.
+        if not self.receiver.has_more():
+            return [main_header]
+
+        self.is_frame_selected, filtered_data_header, data_header_hash = self.channel_filter.get_selection(
+            main_header, self.receiver.next())
+
+        self._skip_frames()
+
+        return [self.channel_filter.get_main_header(main_header, data_header_hash), filtered_data_header]
+
+    def next(self, as_json=False):
+
+        if self.headers is None:
+            self.headers = self._receive_headers()
+
+            main_header = self.headers.pop(0)
+            return main_header if as_json else json.dumps(main_header).encode()
+
+        if self.headers:
+            data_header = self.headers.pop(0)
+            return json.loads(data_header.decode()) if as_json else data_header
+
+        frame = self.receiver.next(as_json)
+
+        self.n_value_frames += 1
+        self._skip_frames()
+
+        return frame
+
+    def _skip_frames(self):
+
+        while self.n_value_frames < len(self.is_frame_selected) and \
+                not self.is_frame_selected[self.n_value_frames] and self.receiver.has_more():
+
+            self.receiver.next()
+            self.n_value_frames += 1
+
+    def has_more(self):
+        return bool(self.headers) or self.receiver.has_more()
+
+    def __getattr__(self, name):
+        return getattr(self.receiver, name)
+
+
+def receive_selected_channels(receiver, handler, channel_filter):
+    return handler(ChannelFilterReceiver(receiver, channel_filter))
@@ -0,0 +1,117 @@
+import argparse
+import logging
+
+import h5py
+import numpy
+
+from sf_bsread_writer.writer_datasets import PRESENCE_BITMAP_NAME, read_presence_bitmap
+from sf_bsread_writer.writer_format import SCALARS_GROUP_NAME, get_chunk_shape
+from sf_bsread_writer.writer_index import INDEX_GROUP_NAME
+
+_logger = logging.getLogger(__name__)
+
+
+def get_table_channel_names(dataset):
+    return [channel_name.decode() if isinstance(channel_name, bytes) else channel_name
+            for channel_name in dataset.attrs["channel_names"]]
+
+
+def get_channel_pulse_ids(h5_file, channel_name, row_pulse_ids):
+    # The pulse_id of the channel is the pulse_id of the message, plus the offset of the channel in the index.
+    channel_pulse_ids = numpy.array(row_pulse_ids, dtype="i8")
+
+    if INDEX_GROUP_NAME + "channel_name" not in h5_file:
+        return channel_pulse_ids
+
+    index_channel_names = list(h5_file[INDEX_GROUP_NAME + "channel_name"].asstr()[:])
+
+    if channel_name not in index_channel_names:
+        return channel_pulse_ids
+
+    is_channel = h5_file[INDEX_GROUP_NAME + "offset_channel"][:] == index_channel_names.index(channel_name)
+
+    offset_rows = h5_file[INDEX_GROUP_NAME + "offset_row"][:][is_channel]
+    offsets = h5_file[INDEX_GROUP_NAME + "offset"][:][is_channel]
+
+    for row, offset, next_row in zip(offset_rows, offsets, list(offset_rows[1:]) + [len(channel_pulse_ids)]):
+        channel_pulse_ids[row:next_row] += offset
+
+    return channel_pulse_ids
+
+
+def convert_scalar_tables(input_file, output_file, block_rows=4096):
+    # Writes a copy of the file with each channel of the scalar tables in its own group, like the default layout.
+
+    with h5py.File(input_file, "r") as input_h5, h5py.File(output_file, "w") as output_h5:
+
+        for name in input_h5:
+            if "/" + name + "/" != SCALARS_GROUP_NAME:
+                input_h5.copy(name, output_h5)
+
+        if SCALARS_GROUP_NAME not in input_h5:
+            _logger.info("No scalar tables in file '%s'.", input_file)
+            return
+
+        row_pulse_ids = input_h5[SCALARS_GROUP_NAME + "pulse_id"][:]
+        n_rows = len(row_pulse_ids)
+
+        if PRESENCE_BITMAP_NAME in input_h5:
+            bitmap_is_data_present, bitmap_channel_names = read_presence_bitmap(input_h5)
+
+        for table_name, table_group in input_h5[SCALARS_GROUP_NAME].items():
+            if not isinstance(table_group, h5py.Group):
+                continue
+
+            data_table = table_group["data"]
+            channel_names = get_table_channel_names(data_table)
+
+            _logger.info("Converting %d channels of table '%s'.", len(channel_names), table_group.name)
+
+            data_datasets = []
+
+            for channel_name in channel_names:
+                channel_group = output_h5.create_group("/data/" + channel_name)
+
+                data_datasets.append(channel_group.create_dataset(
+                    "data", shape=(n_rows, 1), maxshape=(None, 1), dtype=data_table.dtype,
+                    chunks=get_chunk_shape(data_table.dtype, [1])))
+
+                channel_group.create_dataset("pulse_id", maxshape=(None,), chunks=get_chunk_shape("i8", []),
+                                             data=get_channel_pulse_ids(input_h5, channel_name, row_pulse_ids))
+
+                if PRESENCE_BITMAP_NAME in input_h5:
+                    is_data_present = bitmap_is_data_present[:, bitmap_channel_names.index(channel_name)]
+                else:
+                    is_data_present = table_group["is_data_present"][:, channel_names.index(channel_name)]
+
+                channel_group.create_dataset("is_data_present", maxshape=(None,), chunks=get_chunk_shape("u1", []),
+                                             data=numpy.asarray(is_data_present, dtype="u1"))
+
+            # The table is read in blocks of rows - reading 1 column at a time would read the whole table each time.
+            for start_row in range(0, n_rows, block_rows):
+                block = data_table[start_row:start_row + block_rows]
+
+                for column, data_dataset in enumerate(data_datasets):
+                    data_dataset[start_row:start_row + len(block), 0] = block[:, column]
+
+
+def run():
+    parser = argparse.ArgumentParser(description='Convert the scalar tables of a bsread file to 1 group per channel.')
+
+    parser.add_argument("input_file", help="File written with the scalar table layout.")
+    parser.add_argument("output_file", help="File to write with 1 group per channel.")
+
+    parser.add_argument("--log_level", default="INFO",
+                        choices=['CRITICAL', 'ERROR', 'WARNING', 'INFO', 'DEBUG'],
+                        help="Log level to use.")
+
+    arguments = parser.parse_args()
+
+    # Setup the logging level.
+    logging.basicConfig(level=arguments.log_level, format='[%(levelname)s] %(message)s')
+
+    convert_scalar_tables(arguments.input_file, arguments.output_file)
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,110 @@
+from bisect import bisect_left
+from collections import OrderedDict
+from time import time
+
+DEFAULT_LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60)
+
+
+class Histogram(object):
+    def __init__(self, buckets=DEFAULT_LATENCY_BUCKETS):
+        self.buckets = buckets
+
+        # The last count is for the values above the last bucket.
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def get_cumulative_counts(self):
+        cumulative_counts = []
+        cumulative_count = 0
+
+        for upper_bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            cumulative_count += count
+            cumulative_counts.append((upper_bound, cumulative_count))
+
+        return cumulative_counts
+
+    def get_percentile(self, percentile):
+        # Approximation - the upper bound of the bucket the percentile falls in.
+        if self.count == 0:
+            return None
+
+        target_count = percentile / 100 * self.count
+
+        for upper_bound, cumulative_count in self.get_cumulative_counts():
+            if cumulative_count >= target_count:
+                return upper_bound
+
+    def get_statistics(self):
+        return {"count": self.count,
+                "mean": self.sum / self.count if self.count else None,
+                "p50": self.get_percentile(50),
+                "p90": self.get_percentile(90),
+                "p99": self.get_percentile(99)}
+
+
+class RateMeter(object):
+    def __init__(self, min_interval=1):
+        self.min_interval = min_interval
+
+        self.last_value = 0
+        self.last_timestamp = time()
+        self.rate = 0.0
+
+    def update(self, value):
+        current_timestamp = time()
+        interval = current_timestamp - self.last_timestamp
+
+        # Calls closer than min_interval get the last rate, so frequent polling does not give noisy rates.
+        if interval >= self.min_interval:
+            self.rate = (value - self.last_value) / interval
+
+            self.last_value = value
+            self.last_timestamp = current_timestamp
+
+        return self.rate
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+
+    return "{%s}" % ",".join('%s="%s"' % (name, value) for name, value in labels.items())
+
+
+class PrometheusText(object):
+    def __init__(self):
+        # Samples of the same metric have to be grouped together in the output.
+        self.metrics = OrderedDict()
+
+    def add(self, name, value, labels=None, metric_type="gauge"):
+        _, samples = self.metrics.setdefault(name, (metric_type, []))
+        samples.append("%s%s %s" % (name, format_labels(labels), value))
+
+    def add_histogram(self, name, histogram, labels=None):
+        labels = labels or {}
+
+        _, samples = self.metrics.setdefault(name, ("histogram", []))
+
+        for upper_bound, cumulative_count in histogram.get_cumulative_counts():
+            bucket_labels = OrderedDict(labels)
+            bucket_labels["le"] = "+Inf" if upper_bound == float("inf") else upper_bound
+
+            samples.append("%s_bucket%s %s" % (name, format_labels(bucket_labels), cumulative_count))
+
+        samples.append("%s_sum%s %s" % (name, format_labels(labels), histogram.sum))
+        samples.append("%s_count%s %s" % (name, format_labels(labels), histogram.count))
+
+    def get_text(self):
+        lines = []
+
+        for name, (metric_type, samples) in self.metrics.items():
+            lines.append("# TYPE %s %s" % (name, metric_type))
+            lines.extend(samples)
+
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,187 @@
+import json
+import struct
+from time import perf_counter
+
+import numpy
+
+try:
+    import bitshuffle
+except ImportError:
+    bitshuffle = None
+
+
+def receive_raw_message(receiver):
+    frames = [receiver.next()]
+
+    while receiver.has_more():
+        frames.append(receiver.next())
+
+    return frames
+
+
+def receive_main_header(receiver):
+    main_header = receiver.next(as_json=True)
+
+    # The rest of the message is received, but not decoded.
+    while receiver.has_more():
+        receiver.next()
+
+    return main_header
+
+
+def send_raw_message(output_stream, frames, block=True):
+    last_frame_index = len(frames) - 1
+
+    for index, frame in enumerate(frames):
+        output_stream.stream.send(frame, send_more=index < last_frame_index, block=block)
+
+
+def get_main_header(frames):
+    return json.loads(bytes(frames[0]).decode())
+
+
+def get_message_pulse_id(frames):
+    return get_main_header(frames)["pulse_id"]
+
+
+def decompress_bitshuffle_lz4(raw_data):
+
+    if bitshuffle is None:
+        raise ValueError("The bitshuffle package is needed to decompress bitshuffle_lz4 data.")
+
+    # Same layout as the HDF5 bitshuffle filter: uncompressed size, block size, compressed data.
+    data_size = struct.unpack(">q", raw_data[:8])[0]
+    block_size = struct.unpack(">i", raw_data[8:12])[0]
+
+    compressed_data = numpy.frombuffer(raw_data[12:], dtype=numpy.uint8)
+
+    return bitshuffle.decompress_lz4(compressed_data, (data_size,), numpy.dtype(numpy.uint8), block_size).tobytes()
+
+
+def get_data_header(frames, main_header=None):
+
+    if main_header is None:
+        main_header = get_main_header(frames)
+
+    return decode_data_header(frames[1], main_header)
+
+
+def decode_data_header(raw_data_header, main_header):
+    raw_data_header = bytes(raw_data_header)
+    compression = main_header.get("dh_compression")
+
+    if compression == "bitshuffle_lz4":
+        raw_data_header = decompress_bitshuffle_lz4(raw_data_header)
+
+    elif compression not in (None, "none"):
+        raise ValueError("Data header compression '%s' not supported." % compression)
+
+    return json.loads(raw_data_header.decode())
+
+
+def get_value_frames(frames):
+    # After the main and data header, each channel has a value and a timestamp frame.
+    return frames[2::2]
+
+
+def get_message_size(frames):
+    return sum(len(frame) for frame in frames)
+
+
+class MeasuringReceiver(object):
+    def __init__(self, receiver):
+        self.receiver = receiver
+        self.n_bytes = 0
+
+    def next(self, as_json=False):
+        frame = self.receiver.next()
+        self.n_bytes += len(frame)
+
+        if as_json:
+            return json.loads(bytes(frame).decode())
+
+        return frame
+
+    def has_more(self):
+        return self.receiver.has_more()
+
+    def __getattr__(self, name):
+        return getattr(self.receiver, name)
+
+
+def measure_message(receiver, handler):
+    measuring_receiver = MeasuringReceiver(receiver)
+    message = handler(measuring_receiver)
+
+    return message, measuring_receiver.n_bytes
+
+
+class PeekedReceiver(object):
+    # Gives back the main header, already received, as the first frame of the message.
+
+    def __init__(self, receiver, main_header):
+        self.receiver = receiver
+        self.main_header = main_header
+
+    def next(self, as_json=False):
+
+        if self.main_header is not None:
+            main_header = self.main_header
+            self.main_header = None
+
+            return main_header if as_json else json.dumps(main_header).encode()
+
+        return self.receiver.next(as_json)
+
+    def has_more(self):
+        return self.receiver.has_more()
+
+    def __getattr__(self, name):
+        return getattr(self.receiver, name)
+
+
+class HeaderFilter(object):
+    # Decodes only the messages accepted by their main header - the others are returned as {"header": main_header}.
+
+    def __init__(self, handler, is_accepted, decode_histogram=None):
+        self.handler = handler
+        self.is_accepted = is_accepted
+        self.decode_histogram = decode_histogram
+
+        self.n_decoded = 0
+        self.n_skipped = 0
+        self.decode_time = 0.0
+
+    def receive(self, receiver):
+        main_header = receiver.next(as_json=True)
+
+        if not self.is_accepted(main_header):
+
+            while receiver.has_more():
+                receiver.next()
+
+            self.n_skipped += 1
+            return {"header": main_header}
+
+        start_time = perf_counter()
+        message = self.handler(PeekedReceiver(receiver, main_header))
+
+        decode_time = perf_counter() - start_time
+
+        self.decode_time += decode_time
+        self.n_decoded += 1
+
+        if self.decode_histogram is not None:
+            self.decode_histogram.observe(decode_time)
+
+        return message
+
+    def get_statistics(self):
+        mean_decode_time = self.decode_time / self.n_decoded if self.n_decoded else None
+
+        return {"n_decoded": self.n_decoded,
+                "n_skipped": self.n_skipped,
+                "decode_time": self.decode_time,
+                "mean_decode_time": mean_decode_time,
+                # Estimated from the decoded messages.
+                "skipped_decode_time": mean_decode_time * self.n_skipped if mean_decode_time else None}
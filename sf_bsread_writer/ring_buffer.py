@@ -0,0 +1,190 @@
+from threading import Condition
+
+INITIAL_CAPACITY = 1024
+
+# A pulse_id this much lower than the last one is a reset of the pulse_ids, not a message out of order.
+PULSE_ID_RESET_THRESHOLD = 10000
+
+
+class RingBufferCursor(object):
+    def __init__(self, sequence, name=None):
+        self.name = name
+
+        # Sequence number of the next item to read.
+        self.sequence = sequence
+
+        self.n_read = 0
+        self.n_bytes_read = 0
+        self.n_dropped = 0
+
+
+class RingBuffer(object):
+    def __init__(self, maxlen=None, max_bytes=None):
+        self.maxlen = maxlen
+        self.max_bytes = max_bytes
+
+        # Without a maximum length the ring grows until the bytes budget is reached.
+        self._capacity = maxlen or INITIAL_CAPACITY
+
+        self._items = [None] * self._capacity
+        self._pulse_ids = [None] * self._capacity
+        self._max_pulse_ids = [None] * self._capacity
+        self._sizes = [0] * self._capacity
+        self._condition = Condition()
+
+        # Every appended item gets a sequence number - the item is stored at position sequence % capacity.
+        self.first_sequence = 0
+        self.next_sequence = 0
+
+        self.n_bytes = 0
+        self.n_bytes_appended = 0
+        self.n_evicted = 0
+
+        # Every consumer reads with its own cursor.
+        self.cursors = []
+
+    def __len__(self):
+        return self.next_sequence - self.first_sequence
+
+    def append(self, pulse_id, item, n_bytes=0):
+        with self._condition:
+
+            # The old pulse_ids cannot be found anymore after a pulse_id reset.
+            if len(self) > 0 and \
+                    pulse_id < self._pulse_ids[(self.next_sequence - 1) % self._capacity] - PULSE_ID_RESET_THRESHOLD:
+                self._evict(len(self))
+
+            if self.maxlen is not None and len(self) == self.maxlen:
+                self._evict(1)
+
+            # Evict the oldest items until the new one fits in the budget (a too big item is still stored).
+            if self.max_bytes is not None:
+                while len(self) > 0 and self.n_bytes + n_bytes > self.max_bytes:
+                    self._evict(1)
+
+            item = self._store(item)
+
+            if len(self) == self._capacity:
+                self._grow()
+
+            # The running maximum of the pulse_ids is in order, also with messages out of order.
+            max_pulse_id = pulse_id
+
+            if len(self) > 0:
+                max_pulse_id = max(pulse_id, self._max_pulse_ids[(self.next_sequence - 1) % self._capacity])
+
+            position = self.next_sequence % self._capacity
+            self._items[position] = item
+            self._pulse_ids[position] = pulse_id
+            self._max_pulse_ids[position] = max_pulse_id
+            self._sizes[position] = n_bytes
+
+            self.next_sequence += 1
+            self.n_bytes += n_bytes
+            self.n_bytes_appended += n_bytes
+
+            self._condition.notify_all()
+
+    def cursor(self, name=None):
+        with self._condition:
+            cursor = RingBufferCursor(self.first_sequence, name)
+            self.cursors.append(cursor)
+
+            return cursor
+
+    def read(self, cursor, timeout=None):
+        with self._condition:
+
+            # Returns None if there is still nothing to read after the timeout.
+            if not self._condition.wait_for(lambda: cursor.sequence < self.next_sequence, timeout):
+                return None
+
+            # The items the cursor did not read in time were evicted.
+            if cursor.sequence < self.first_sequence:
+                cursor.n_dropped += self.first_sequence - cursor.sequence
+                cursor.sequence = self.first_sequence
+
+            position = cursor.sequence % self._capacity
+            item = self._load(self._items[position])
+
+            cursor.sequence += 1
+            cursor.n_read += 1
+            cursor.n_bytes_read += self._sizes[position]
+
+            return item
+
+    def skip(self, cursor, n_items):
+        with self._condition:
+            cursor.sequence += n_items
+
+    def find(self, pulse_id):
+        with self._condition:
+            low = self.first_sequence
+            high = self.next_sequence
+
+            # Binary search for the first item in arrival order with a pulse_id >= the requested one: the first item
+            # where the running maximum reaches it. The maximum still includes the evicted items, so when a larger
+            # pulse_id before messages out of order is evicted the lookup can start a few items early, never too late.
+            while low < high:
+                middle = (low + high) // 2
+
+                if self._max_pulse_ids[middle % self._capacity] < pulse_id:
+                    low = middle + 1
+                else:
+                    high = middle
+
+            return low
+
+    def seek(self, cursor, pulse_id):
+        with self._condition:
+            cursor.sequence = self.find(pulse_id)
+            self._condition.notify_all()
+
+            # The requested pulse_id is not in the buffer yet.
+            if cursor.sequence == self.next_sequence:
+                return None
+
+            return self._pulse_ids[cursor.sequence % self._capacity]
+
+    def clear(self):
+        with self._condition:
+            self._evict(len(self))
+
+    def _store(self, item):
+        return item
+
+    def _load(self, item):
+        return item
+
+    def _evict(self, n_items):
+        for sequence in range(self.first_sequence, self.first_sequence + n_items):
+            position = sequence % self._capacity
+
+            self._items[position] = None
+            self.n_bytes -= self._sizes[position]
+
+        self.first_sequence += n_items
+        self.n_evicted += n_items
+
+    def _grow(self):
+        new_capacity = 2 * self._capacity
+
+        items = [None] * new_capacity
+        pulse_ids = [None] * new_capacity
+        max_pulse_ids = [None] * new_capacity
+        sizes = [0] * new_capacity
+
+        for sequence in range(self.first_sequence, self.next_sequence):
+            old_position = sequence % self._capacity
+            new_position = sequence % new_capacity
+
+            items[new_position] = self._items[old_position]
+            pulse_ids[new_position] = self._pulse_ids[old_position]
+            max_pulse_ids[new_position] = self._max_pulse_ids[old_position]
+            sizes[new_position] = self._sizes[old_position]
+
+        self._items = items
+        self._pulse_ids = pulse_ids
+        self._max_pulse_ids = max_pulse_ids
+        self._sizes = sizes
+        self._capacity = new_capacity
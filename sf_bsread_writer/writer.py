@@ -1,29 +1,64 @@
 import argparse
 import logging
-from threading import Event, Thread
-from time import time
+from collections import deque
+from contextlib import contextmanager
+from functools import partial
+from queue import Queue, Full
+from threading import Event, Lock, Thread
+from time import perf_counter, time
 
 import bottle
 import os
+import zmq
 
 from bsread import PULL, source
 from bsread.handlers import extended
 
-from sf_bsread_writer.writer_format import BsreadH5Writer
+from sf_bsread_writer.buffer_request import request_buffer_replay
+from sf_bsread_writer.channel_filter import ChannelFilter, receive_selected_channels
+from sf_bsread_writer.raw_message import HeaderFilter, receive_main_header
+from sf_bsread_writer.writer_format import verify_format_parameters
+from sf_bsread_writer.writer_metrics import WriterMetrics, get_message_bytes
 from sf_bsread_writer.writer_rest import register_rest_interface
+from sf_bsread_writer.writer_rollover import create_h5_writer
 
 _logger = logging.getLogger(__name__)
 
+DEFAULT_WRITE_QUEUE_LENGTH = 100
+N_ACQUISITION_STATISTICS = 100
+
+# Messages stamped before a stop_now can still be on the way - they are written if received within this time (s).
+STOP_GRACE_PERIOD = 0.1
+
+
+def get_message_handler(parameters):
+    handler = extended.Handler().receive
+
+    channels_include = parameters.get("format/channels_include")
+    channels_exclude = parameters.get("format/channels_exclude")
+
+    # The channels not selected are not decoded and get no datasets.
+    if channels_include or channels_exclude:
+        _logger.info("Writing channels matching %s, except %s.", channels_include, channels_exclude)
+
+        channel_filter = ChannelFilter(channels_include, channels_exclude)
+        handler = partial(receive_selected_channels, handler=handler, channel_filter=channel_filter)
+
+    return handler
+
 
 class BsreadWriterManager(object):
     REQUIRED_PARAMETERS = ["general/created", "general/user", "general/process", "general/instrument"]
 
-    def __init__(self, stream_address, output_file, receive_timeout=1000, mode=PULL):
+    def __init__(self, stream_address, output_file, receive_timeout=1000, mode=PULL, buffer_request_address=None,
+                 write_queue_length=DEFAULT_WRITE_QUEUE_LENGTH):
 
         self.stream_address = stream_address
         self.output_file = output_file
         self.receive_timeout = receive_timeout
         self.mode = mode
+        self.buffer_request_address = buffer_request_address
+        self.write_queue_length = write_queue_length
         self.parameters = {}
 
         _logger.info("Starting writer manager with stream_address %s, output_file %s.",
@@ -34,6 +69,35 @@ class BsreadWriterManager(object):
 
         self._writing_thread = None
 
+        self._writer = None
+        self._write_queue = None
+        self._write_thread = None
+
+        # Timings of each stage and message counters, for all the acquisitions.
+        self.metrics = WriterMetrics()
+
+        # Only the messages in the acquisition range are decoded.
+        self._header_filter = HeaderFilter(None, self._is_message_in_range, self.metrics.stage_histograms["decode"])
+
+        # In daemon mode or when armed, the stream is received by its own thread and stays connected.
+        self.daemon = False
+        self._connected_event = Event()
+        self._stream_thread = None
+        self._is_receiving_acquisition = False
+
+        # Acquisitions on a connected stream are started by the REST api and ended by the stream thread.
+        self._acquisition_lock = Lock()
+        self._acquisition = None
+        self.acquisitions = deque(maxlen=N_ACQUISITION_STATISTICS)
+
+        self.write_queue_max_fill = 0
+        self.n_write_queue_full = 0
+        self.close_time = None
+
+        # Stop requests wake up the thread waiting for the next message.
+        self._control_address = "inproc://sf_bsread_writer_control_%d" % id(self)
+        self._stop_request_time = None
+
         self.start_pulse_id = None
         self.start_timestamp = None
 
@@ -42,6 +106,36 @@ class BsreadWriterManager(object):
 
         self.last_pulse_id = -1
         self.last_timestamp = None
+        self._last_message_time = 0
+
+        # First pulse_id replayed by the buffer - the messages received before it were sent before the replay.
+        self._replay_pulse_id = None
+        self._last_written_pulse_id = None
+
+    def _update_last_message(self, main_header):
+        self.last_pulse_id = main_header["pulse_id"]
+
+        self.last_timestamp = main_header["global_timestamp"]["sec"]
+        self.last_timestamp += 1e-9 * main_header["global_timestamp"]["ns"]
+
+        self._last_message_time = time()
+
+    def _is_message_in_range(self, main_header):
+        self._update_last_message(main_header)
+
+        return not self._is_last_message_out_of_order() and not self._is_last_message_too_early() and \
+            not self._is_last_message_too_late()
+
+    def _is_last_message_out_of_order(self):
+        if self._replay_pulse_id is not None:
+
+            if self.last_pulse_id != self._replay_pulse_id:
+                return True
+
+            self._replay_pulse_id = None
+
+        # Each pulse_id is written once, in order.
+        return self._last_written_pulse_id is not None and self.last_pulse_id <= self._last_written_pulse_id
 
     def _is_last_message_too_early(self):
         if self.start_pulse_id is not None and self.last_pulse_id < self.start_pulse_id:
@@ -56,26 +150,171 @@ class BsreadWriterManager(object):
         if self.stop_pulse_id is not None and self.last_pulse_id > self.stop_pulse_id:
             return True
 
-        elif self.stop_timestamp is not None and self.last_timestamp > self.stop_timestamp:
+        elif self.stop_timestamp is not None and \
+                (self.last_timestamp > self.stop_timestamp or time() >= self.stop_timestamp + STOP_GRACE_PERIOD):
             return True
 
         return False
 
-    def _stop_writing(self, writer):
-        if writer:
-            writer.prune_and_close(self.stop_pulse_id)
+    def _is_stop_reached(self):
+        # Only after a message of this acquisition or a stop request during it - not with an earlier last pulse_id.
+        if self.last_timestamp is None and self._stop_request_time is None:
+            return False
+
+        # No message is waiting - the stop pulse_id was already received or the stop time has passed. The messages
+        # received before the replay from the buffer are not part of the acquisition.
+        if self.stop_pulse_id is not None and self._replay_pulse_id is None and \
+                self.last_pulse_id >= self.stop_pulse_id:
+            return True
+
+        # A message at the stop time was received, or no message arrived for the grace period.
+        elif self.stop_timestamp is not None:
+
+            if self.last_timestamp is not None and self.last_timestamp >= self.stop_timestamp:
+                return True
+
+            return time() >= max(self.stop_timestamp, self._last_message_time) + STOP_GRACE_PERIOD
+
+        return False
+
+    def _get_receive_timeout(self):
+        # After a stop_now, the receive waits only for the grace period.
+        if self.stop_timestamp is None or self._acquisition is None:
+            return self.receive_timeout
+
+        grace_timeout = int(STOP_GRACE_PERIOD * 1000)
+
+        if self.receive_timeout < 0:
+            return grace_timeout
+
+        return min(self.receive_timeout, grace_timeout)
+
+    @contextmanager
+    def _open_control_socket(self):
+        control_socket = zmq.Context.instance().socket(zmq.PULL)
+        control_socket.bind(self._control_address)
+
+        try:
+            yield control_socket
+        finally:
+            control_socket.close(linger=0)
+
+    def _wake_receiver(self):
+        wake_socket = zmq.Context.instance().socket(zmq.PUSH)
+        wake_socket.setsockopt(zmq.LINGER, 0)
+
+        try:
+            wake_socket.connect(self._control_address)
+            wake_socket.send(b"", zmq.NOBLOCK)
+
+        # No thread is receiving.
+        except zmq.Again:
+            pass
+
+        finally:
+            wake_socket.close()
+
+    def _receive(self, stream, control_socket, get_handler):
+        # Waits for the next message or a stop request - returns None for a stop request or a receive timeout.
+        # The handler is selected after the wait, as the request can start an acquisition.
+        poller = zmq.Poller()
+        poller.register(stream.stream.socket, zmq.POLLIN)
+        poller.register(control_socket, zmq.POLLIN)
+
+        ready_sockets = dict(poller.poll(self._get_receive_timeout()))
+
+        if control_socket in ready_sockets:
+            while control_socket.poll(0):
+                control_socket.recv()
+
+        # The messages already received are processed before the stop.
+        if stream.stream.socket in ready_sockets:
+            start_time = perf_counter()
+            message = stream.receive(handler=get_handler())
+
+            self.metrics.observe("receive", start_time)
+            return message
+
+        return None
+
+    def _stop_writing(self):
+        self._close_write_queue()
 
         _logger.info("Stopping bsread writer at pulse_id: %s" % self.stop_pulse_id)
         self._running_event.clear()
 
-    def write_stream(self, start_pulse_id, start_timestamp, output_file, persistant_writer=False):
+    def _write_messages(self, writer, write_queue):
+
+        try:
+            while True:
+                message = write_queue.get()
+
+                # None marks the end of the acquisition.
+                if message is None:
+                    break
+
+                if writer:
+                    writer.write_message(message)
+
+        except Exception as e:
+            _logger.error("Error while writing message to file. Stopping writer: %s", e)
+            self._running_event.clear()
+
+            # Keep emptying the queue - the receiving thread must not block on a full queue.
+            while write_queue.get() is not None:
+                pass
+
+        if writer:
+            writer.prune_and_close(self.stop_pulse_id)
+
+    def _start_write_queue(self, writer):
+        self._write_queue = Queue(maxsize=self.write_queue_length)
+
+        self.write_queue_max_fill = 0
+        self.n_write_queue_full = 0
+
+        self._write_thread = Thread(target=self._write_messages, args=(writer, self._write_queue))
+        self._write_thread.start()
+
+    def _queue_message(self, message):
+
+        try:
+            self._write_queue.put_nowait(message)
+
+        except Full:
+            if self.n_write_queue_full == 0:
+                _logger.warning("Write queue is full (%d messages). Storage is not keeping up with the stream.",
+                                self.write_queue_length)
 
+            self.n_write_queue_full += 1
+            self._write_queue.put(message)
+
+        self.write_queue_max_fill = max(self.write_queue_max_fill, self._write_queue.qsize())
+
+    def _close_write_queue(self):
+
+        if self._write_thread is None:
+            return
+
+        _logger.info("Waiting for %d queued messages to be written.", self._write_queue.qsize())
+        close_start_time = time()
+
+        self._write_queue.put(None)
+        self._write_thread.join()
+
+        self.close_time = time() - close_start_time
+
+        self._write_thread = None
+
+    def _get_source_address(self):
         source_host, source_port = self.stream_address.rsplit(":", maxsplit=1)
 
         source_host = source_host.split("//")[1]
         source_port = int(source_port)
 
-        _logger.info("Input stream host '%s' and port '%s'.", source_host, source_port)
+        return source_host, source_port
+
+    def _open_output_file(self, output_file, start_pulse_id, start_timestamp):
 
         if start_pulse_id is not None:
             _logger.info("First pulse_id to write: %d.", start_pulse_id)
@@ -84,52 +323,39 @@ class BsreadWriterManager(object):
             _logger.info("First message to write after timestamp %s.", start_timestamp)
 
         if output_file != "/dev/null":
-            writer = BsreadH5Writer(output_file, self.parameters)
+            writer = create_h5_writer(output_file, self.parameters, self.metrics)
         else:
             writer = None
 
-        handler = extended.Handler()
+        # With a known pulse_id range the writer can preallocate the datasets.
+        if writer and start_pulse_id is not None:
+            writer.set_pulse_range(start_pulse_id, self.stop_pulse_id)
 
-        with source(host=source_host, port=source_port,
-                    mode=self.mode, receive_timeout=self.receive_timeout,
-                    queue_size=1) as stream:
+        self._writer = writer
+        self._start_write_queue(writer)
 
-            self._running_event.set()
-
-            while self._running_event.is_set():
-
-                message = stream.receive(handler=handler.receive)
-
-                # In case you set a receive timeout, the returned message can be None.
-                if message is None:
+        self._stop_request_time = None
+        self.metrics.last_pulse_id = None
+        self._last_written_pulse_id = None
 
-                    # In case the stop_pulse_id was set after the camera stream has ended.
-                    if self._is_last_message_too_late():
-                        self._stop_writing(writer)
-
-                    continue
+        # The last message of the previous acquisition is not part of this one.
+        self.last_pulse_id = -1
+        self.last_timestamp = None
 
-                self.last_pulse_id = message.data["header"]["pulse_id"]
+        # A new handler for each acquisition - the channel selection can be different.
+        self._header_filter.handler = get_message_handler(self.parameters)
 
-                self.last_timestamp = message.data["header"]["global_timestamp"]["sec"]
-                self.last_timestamp += 1e-9 * message.data["header"]["global_timestamp"]["ns"]
+        self._acquisition = {"output_file": output_file,
+                             "start_time": time(),
+                             "n_messages": 0,
+                             "first_pulse_id": None}
 
-                _logger.debug('Received message with pulse_id %d and timestamp %s.',
-                              self.last_pulse_id, self.last_timestamp)
+    def _close_output_file(self):
 
-                if self._is_last_message_too_early():
-                    _logger.debug("Discarding early messages with pulse_id=%s (start_pulse_id=%s) "
-                                  "and timestamp=%s (start_timestamp=%s)",
-                                  self.last_pulse_id, self.start_pulse_id,
-                                  self.last_timestamp, self.start_timestamp)
-                    continue
+        # In case the writer was stopped from outside, the queued messages are still written.
+        self._close_write_queue()
 
-                if self._is_last_message_too_late():
-                    self._stop_writing(writer)
-                    continue
-             
-                if writer:
-                    writer.write_message(message)
+        self._writer = None
 
         if self.start_pulse_id is not None:
             _logger.info("Writing completed. Pulse_id range from %s to %s written to file.",
@@ -142,9 +368,189 @@ class BsreadWriterManager(object):
         else:
             _logger.warning("This should not be possible, but the file is probably still written fine.")
 
+        self._acquisition.update({"start_pulse_id": self.start_pulse_id,
+                                  "stop_pulse_id": self.stop_pulse_id,
+                                  "start_timestamp": self.start_timestamp,
+                                  "stop_timestamp": self.stop_timestamp,
+                                  "last_pulse_id": self.last_pulse_id,
+                                  "write_queue_max_fill": self.write_queue_max_fill,
+                                  "n_write_queue_full": self.n_write_queue_full,
+                                  "close_time": self.close_time,
+                                  "duration": time() - self._acquisition["start_time"]})
+
+        # From the stop request to the closed file.
+        if self._stop_request_time is not None:
+            self._acquisition["stop_latency"] = time() - self._stop_request_time
+            self._stop_request_time = None
+
+        self.acquisitions.append(self._acquisition)
+        self._acquisition = None
+
+        self._replay_pulse_id = None
+
+    def _process_message(self, message):
+
+        # In case you set a receive timeout, the returned message can be None.
+        if message is None:
+
+            # In case the stop_pulse_id was set after the camera stream has ended.
+            if self._is_stop_reached():
+                self._stop_writing()
+
+            return
+
+        self._update_last_message(message.data["header"])
+
+        _logger.debug('Received message with pulse_id %d and timestamp %s.',
+                      self.last_pulse_id, self.last_timestamp)
+
+        self.metrics.count("messages_received")
+        self.metrics.count("bytes_received", get_message_bytes(message))
+
+        if self._is_last_message_out_of_order():
+            self.metrics.count("messages_discarded_out_of_order")
+
+            _logger.debug("Discarding message with pulse_id=%s (replay from pulse_id=%s, last written pulse_id=%s).",
+                          self.last_pulse_id, self._replay_pulse_id, self._last_written_pulse_id)
+            return
+
+        if self._is_last_message_too_early():
+            self.metrics.count("messages_discarded_early")
+
+            _logger.debug("Discarding early messages with pulse_id=%s (start_pulse_id=%s) "
+                          "and timestamp=%s (start_timestamp=%s)",
+                          self.last_pulse_id, self.start_pulse_id,
+                          self.last_timestamp, self.start_timestamp)
+            return
+
+        if self._is_last_message_too_late():
+            self.metrics.count("messages_discarded_late")
+
+            self._stop_writing()
+            return
+
+        # Not decoded - the acquisition range changed after the message was received.
+        if "data" not in message.data:
+            return
+
+        self.metrics.count_pulse_id(self.last_pulse_id, self.parameters.get("format/pulse_id_step") or 1)
+
+        self._queue_message(message)
+        self._last_written_pulse_id = self.last_pulse_id
+
+        if self._acquisition["first_pulse_id"] is None:
+            self._acquisition["first_pulse_id"] = self.last_pulse_id
+
+        self._acquisition["n_messages"] += 1
+
+    def write_stream(self, start_pulse_id, start_timestamp, output_file, persistant_writer=False):
+
+        source_host, source_port = self._get_source_address()
+
+        _logger.info("Input stream host '%s' and port '%s'.", source_host, source_port)
+
+        self._open_output_file(output_file, start_pulse_id, start_timestamp)
+
+        with source(host=source_host, port=source_port,
+                    mode=self.mode, receive_timeout=self.receive_timeout,
+                    queue_size=1) as stream, self._open_control_socket() as control_socket:
+
+            self._running_event.set()
+
+            while self._running_event.is_set():
+                self._process_message(self._receive(stream, control_socket, lambda: self._header_filter.receive))
+
+        self._close_output_file()
+
         if not persistant_writer:
             os._exit(0)
 
+    def receive_stream(self):
+
+        source_host, source_port = self._get_source_address()
+
+        _logger.info("Connecting to stream host '%s' and port '%s'.", source_host, source_port)
+
+        with source(host=source_host, port=source_port,
+                    mode=self.mode, receive_timeout=self.receive_timeout,
+                    queue_size=1) as stream, self._open_control_socket() as control_socket:
+
+            self._connected_event.set()
+
+            while self._connected_event.is_set():
+
+                self._is_receiving_acquisition = self._running_event.is_set()
+                message = self._receive(stream, control_socket, self._get_stream_handler)
+
+                with self._acquisition_lock:
+
+                    if self._is_receiving_acquisition and self._running_event.is_set():
+                        self._process_message(message)
+
+                    # The acquisition ended - stop condition reached, write error or stop request.
+                    if not self._running_event.is_set() and self._acquisition is not None:
+                        self._close_output_file()
+
+                        if not self.daemon:
+                            os._exit(0)
+
+        with self._acquisition_lock:
+            if self._acquisition is not None:
+                self._close_output_file()
+
+        _logger.info("Disconnected from stream.")
+
+    def _get_stream_handler(self):
+        # Between acquisitions only the main header is decoded - the messages are discarded anyway.
+        self._is_receiving_acquisition = self._running_event.is_set()
+
+        return self._header_filter.receive if self._is_receiving_acquisition else receive_main_header
+
+    def connect_stream(self, daemon=False):
+        self.daemon = daemon
+
+        if self._stream_thread is not None:
+            return
+
+        self._stream_thread = Thread(target=self.receive_stream)
+        self._stream_thread.start()
+
+        if not self._connected_event.wait(2):
+            _logger.error("Bsread writer did not connect to the stream in time. Killing.")
+            os._exit(-1)
+
+    def arm(self):
+        _logger.info("Arming the writer.")
+        self.connect_stream(daemon=self.daemon)
+
+    def acquire(self, output_file, start_pulse_id=None, stop_pulse_id=None):
+
+        if self._stream_thread is None:
+            raise ValueError("Acquisitions on request are available only in daemon mode or when armed.")
+
+        with self._acquisition_lock:
+
+            if self._acquisition is not None:
+                raise ValueError("Acquisition to file '%s' still running." % self._acquisition["output_file"])
+
+            _logger.info("Starting acquisition to file '%s' from pulse_id %s to %s.",
+                         output_file, start_pulse_id, stop_pulse_id)
+
+            self.start_pulse_id = start_pulse_id
+            self.start_timestamp = time() if start_pulse_id is None else None
+
+            self.stop_pulse_id = stop_pulse_id
+            self.stop_timestamp = None
+
+            if start_pulse_id is not None and self.buffer_request_address is not None:
+                self._request_buffer_replay(start_pulse_id)
+
+            self._open_output_file(output_file, self.start_pulse_id, self.start_timestamp)
+            self._running_event.set()
+
+        # The next message is already received with the handler of the acquisition.
+        self._wake_receiver()
+
     def set_parameters(self, parameters):
 
         _logger.debug("Setting parameters %s." % parameters)
@@ -153,12 +559,24 @@ class BsreadWriterManager(object):
             raise ValueError("Missing mandatory parameters. Mandatory parameters '%s' but received '%s'." %
                              (self.REQUIRED_PARAMETERS, list(parameters.keys())))
 
+        verify_format_parameters(parameters)
+
         self.parameters = parameters
 
     def get_parameters(self):
         return self.parameters
 
     def get_status(self):
+        if self._stream_thread is not None:
+
+            if not self._stream_thread.is_alive():
+                return "error"
+
+            if self._acquisition is not None:
+                return "writing"
+
+            return "waiting" if self.daemon else "armed"
+
         if self._writing_thread is None:
             return "waiting"
 
@@ -171,15 +589,24 @@ class BsreadWriterManager(object):
         _logger.info("Stopping bsread writer.")
 
         self._running_event.clear()
+        self._connected_event.clear()
+        self._wake_receiver()
 
         if self._writing_thread is not None:
             self._writing_thread.join()
             self._writing_thread = None
 
+        if self._stream_thread is not None:
+            self._stream_thread.join()
+
         os._exit(0)
 
     def start_writer(self, pulse_id, output_file=None):
 
+        if self._stream_thread is not None:
+            self.acquire(output_file or self.output_file, pulse_id)
+            return
+
         persistant_writer = False
 
         if output_file is not None:
@@ -203,6 +630,9 @@ class BsreadWriterManager(object):
             self.start_pulse_id = pulse_id
             self.start_timestamp = None
 
+            if self.buffer_request_address is not None:
+                self._request_buffer_replay(pulse_id)
+
         self._writing_thread = Thread(target=self.write_stream, args=(self.start_pulse_id, self.start_timestamp,
                                                                       self.output_file, persistant_writer))
 
@@ -214,9 +644,29 @@ class BsreadWriterManager(object):
             _logger.error("Bsread writer did not start in time. Killing.")
             os._exit(-1)
 
+    def _request_buffer_replay(self, pulse_id):
+        # The writer discards early messages anyway - a failed replay request only costs bandwidth.
+        self._replay_pulse_id = None
+
+        try:
+            # The buffer identifies the consumer by the output port we are connected to.
+            output_port = int(self.stream_address.rsplit(":", maxsplit=1)[1])
+
+            first_pulse_id = request_buffer_replay(self.buffer_request_address, pulse_id, output_port)
+            _logger.info("Buffer replaying from pulse_id %s.", first_pulse_id)
+
+        except Exception as e:
+            _logger.warning("Could not request replay from buffer at '%s': %s", self.buffer_request_address, e)
+            return
+
+        # The messages already sent by the buffer are discarded until the replay starts.
+        self._replay_pulse_id = first_pulse_id
+
     def stop_writer(self, pulse_id):
         _logger.info("Set stop_pulse_id=%s", pulse_id)
 
+        self._stop_request_time = time()
+
         if pulse_id is None:
             current_timestamp = time()
 
@@ -227,19 +677,42 @@ class BsreadWriterManager(object):
             self.stop_pulse_id = pulse_id
             self.stop_timestamp = None
 
+            writer = self._writer
+
+            if writer is not None and self.start_pulse_id is not None:
+                writer.set_pulse_range(self.start_pulse_id, pulse_id)
+
+        # The stream might have ended - the stop is not left waiting for the next message or the receive timeout.
+        self._wake_receiver()
+
     def get_statistics(self):
         return {"start_pulse_id": self.start_pulse_id,
                 "stop_pulse_id": self.stop_pulse_id,
                 "start_timestamp": self.start_timestamp,
                 "stop_timestamp": self.stop_timestamp,
                 "last_pulse_id": self.last_pulse_id,
-                "last_timestamp": self.last_timestamp}
+                "last_timestamp": self.last_timestamp,
+                "write_queue_length": self._write_queue.qsize() if self._write_queue is not None else 0,
+                "write_queue_max_fill": self.write_queue_max_fill,
+                "write_queue_size": self.write_queue_length,
+                "n_write_queue_full": self.n_write_queue_full,
+                "decoding": self._header_filter.get_statistics(),
+                "metrics": self.metrics.get_statistics(),
+                "acquisitions": list(self.acquisitions)}
+
+    def get_prometheus_text(self):
+        write_queue_length = self._write_queue.qsize() if self._write_queue is not None else 0
+
+        return self.metrics.get_prometheus_text([("sf_bsread_writer_write_queue_length", write_queue_length),
+                                                 ("sf_bsread_writer_last_pulse_id", self.last_pulse_id)])
 
 
-def start_server(stream_address, output_file, user_id, rest_port):
+def start_server(stream_address, output_file, user_id, rest_port, buffer_request_address=None,
+                 write_queue_length=DEFAULT_WRITE_QUEUE_LENGTH, daemon=False, armed=False):
     app = bottle.Bottle()
 
-    manager = BsreadWriterManager(stream_address, output_file)
+    manager = BsreadWriterManager(stream_address, output_file, buffer_request_address=buffer_request_address,
+                                  write_queue_length=write_queue_length)
 
     register_rest_interface(app, manager)
 
@@ -262,6 +735,9 @@ def start_server(stream_address, output_file, user_id, rest_port):
     else:
         _logger.info("Folder '%s' already exists.", filename_folder)
 
+    if daemon or armed:
+        manager.connect_stream(daemon=daemon)
+
     try:
         _logger.info("Starting rest API on port %s." % rest_port)
         bottle.run(app=app, host="127.0.0.1", port=rest_port)
@@ -278,6 +754,16 @@ def run():
                                                   "Use -1 for current user.")
     parser.add_argument("rest_port", type=int, help="Port for REST api.")
 
+    parser.add_argument("--buffer_request_address", default=None,
+                        help="Address of the buffer request channel, to replay the buffer from start_pulse_id.")
+    parser.add_argument("--write_queue_length", type=int, default=DEFAULT_WRITE_QUEUE_LENGTH,
+                        help="Number of received messages that can wait to be written to disk.")
+    parser.add_argument("--daemon", action="store_true",
+                        help="Keep the process and the stream connection between acquisitions. "
+                             "Acquisitions are started with the REST api.")
+    parser.add_argument("--armed", action="store_true",
+                        help="Connect to the stream at startup, so the acquisition starts without connection delay.")
+
     parser.add_argument("--log_level", default="INFO",
                         choices=['CRITICAL', 'ERROR', 'WARNING', 'INFO', 'DEBUG'],
                         help="Log level to use.")
@@ -290,7 +776,11 @@ def run():
     start_server(stream_address=arguments.stream_address,
                  output_file=arguments.output_file,
                  user_id=arguments.user_id,
-                 rest_port=arguments.rest_port)
+                 rest_port=arguments.rest_port,
+                 buffer_request_address=arguments.buffer_request_address,
+                 write_queue_length=arguments.write_queue_length,
+                 daemon=arguments.daemon,
+                 armed=arguments.armed)
 
 
 if __name__ == "__main__":
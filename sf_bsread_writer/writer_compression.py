@@ -0,0 +1,96 @@
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import numpy
+
+try:
+    import bitshuffle
+except ImportError:
+    bitshuffle = None
+
+DEFAULT_GZIP_LEVEL = 4
+
+BITSHUFFLE_FILTER_ID = 32008
+BITSHUFFLE_LZ4 = 2
+BITSHUFFLE_BLOCK_BYTES = 8192
+
+
+def compress_gzip(data, level=DEFAULT_GZIP_LEVEL):
+    # The HDF5 deflate filter stores the chunks as zlib streams.
+    return zlib.compress(data, level)
+
+
+def compress_bitshuffle_lz4(data):
+    block_size = max(8, BITSHUFFLE_BLOCK_BYTES // data.itemsize // 8 * 8)
+
+    # Same layout as the bitshuffle HDF5 filter: uncompressed size, block size in bytes, compressed data.
+    header = struct.pack(">qi", data.nbytes, block_size * data.itemsize)
+
+    return header + bitshuffle.compress_lz4(data, block_size).tobytes()
+
+
+def get_compression(name, gzip_level=DEFAULT_GZIP_LEVEL):
+    # Returns the function to compress a chunk and the dataset arguments for h5py to register the filter.
+
+    if name == "gzip":
+        return partial(compress_gzip, level=gzip_level), {"compression": "gzip",
+                                                          "compression_opts": gzip_level}
+
+    if name == "bitshuffle_lz4":
+
+        if bitshuffle is None:
+            raise ValueError("The bitshuffle package is needed for bitshuffle_lz4 compression.")
+
+        return compress_bitshuffle_lz4, {"compression": BITSHUFFLE_FILTER_ID,
+                                         "compression_opts": (0, BITSHUFFLE_LZ4),
+                                         "allow_unknown_filter": True}
+
+    raise ValueError("Compression '%s' not supported. Use 'gzip' or 'bitshuffle_lz4'." % name)
+
+
+def compress_chunk(compress, data, chunk_shape):
+
+    # Direct chunk writes need complete chunks - the chunks at the edges of the dataset are padded.
+    if data.shape != chunk_shape:
+        padded_data = numpy.zeros(chunk_shape, dtype=data.dtype)
+        padded_data[tuple(slice(0, size) for size in data.shape)] = data
+
+        data = padded_data
+
+    return compress(numpy.ascontiguousarray(data))
+
+
+class ChunkCompressor(object):
+    # The chunks are compressed by the workers, but written (in order) by the thread submitting them.
+
+    def __init__(self, n_workers):
+        self.executor = ThreadPoolExecutor(max_workers=n_workers)
+
+        # Enough chunks to keep all the workers busy, without keeping too many of them in memory.
+        self.max_pending_chunks = 2 * n_workers
+        self.pending_chunks = deque()
+
+    def submit(self, dataset, chunk_offset, data, compress):
+        future = self.executor.submit(compress_chunk, compress, data, dataset.chunks)
+        self.pending_chunks.append((dataset, chunk_offset, future))
+
+        while len(self.pending_chunks) > self.max_pending_chunks:
+            self._write_chunk()
+
+        while self.pending_chunks and self.pending_chunks[0][2].done():
+            self._write_chunk()
+
+    def _write_chunk(self):
+        dataset, chunk_offset, future = self.pending_chunks.popleft()
+        dataset.id.write_direct_chunk(chunk_offset, future.result())
+
+    def flush(self):
+        while self.pending_chunks:
+            self._write_chunk()
+
+    def close(self):
+        self.flush()
+        self.executor.shutdown()
@@ -0,0 +1,250 @@
+import itertools
+from operator import itemgetter
+
+import h5py
+import numpy
+
+PRESENCE_BITMAP_NAME = "/is_data_present"
+
+
+def get_free_dataset_name(h5_file, dataset_name):
+    # Replaced datasets are kept under the first free name: data(1), data(2)...
+    index = 1
+
+    while "%s(%d)" % (dataset_name, index) in h5_file:
+        index += 1
+
+    return "%s(%d)" % (dataset_name, index)
+
+
+def get_fill_value(dtype):
+    return "" if dtype.kind == "O" else 0
+
+
+class BatchedDataset(object):
+    def __init__(self, dataset, batch_size):
+        self.dataset = dataset
+        self.fill_value = get_fill_value(dataset.dtype)
+
+        self.staging = numpy.full((batch_size,) + dataset.shape[1:], self.fill_value, dtype=dataset.dtype)
+
+        self.n_rows = dataset.shape[0]
+        self.n_staged = 0
+
+        self.n_allocated = dataset.shape[0]
+
+    def resize(self, n_rows):
+        # Preallocated rows are filled by the flushes without resizing the dataset.
+        self.dataset.resize(n_rows, axis=0)
+        self.n_allocated = n_rows
+
+    def append(self, value):
+
+        # Missing values are written as the fill value, like the rows of a resized dataset.
+        if value is None:
+            self.staging[self.n_staged] = self.fill_value
+        else:
+            self.staging[self.n_staged] = value
+
+        self.n_staged += 1
+
+        if self.n_staged == len(self.staging):
+            self.flush()
+
+    def flush(self):
+
+        if self.n_staged == 0:
+            return
+
+        n_rows = self.n_rows + self.n_staged
+
+        if n_rows > self.n_allocated:
+            self.resize(n_rows)
+
+        self.dataset[self.n_rows:n_rows] = self.staging[:self.n_staged]
+
+        self.n_rows = n_rows
+        self.n_staged = 0
+
+
+class CompressedDataset(BatchedDataset):
+    # Rows are staged one chunk at a time and the chunks are compressed by the compressor workers. A partially
+    # filled chunk is written when flushed, and written again once it is complete.
+
+    def __init__(self, dataset, compressor, compress):
+        super(CompressedDataset, self).__init__(dataset, dataset.chunks[0])
+
+        self.compressor = compressor
+        self.compress = compress
+
+        # Large values are split in more than 1 chunk per row.
+        row_shape = dataset.shape[1:]
+        chunk_row_shape = dataset.chunks[1:]
+
+        chunk_offsets = itertools.product(*(range(0, size, chunk_size)
+                                            for size, chunk_size in zip(row_shape, chunk_row_shape)))
+
+        self.chunk_slices = [tuple(slice(offset, offset + chunk_size)
+                                   for offset, chunk_size in zip(offsets, chunk_row_shape))
+                             for offsets in chunk_offsets]
+
+        self.n_flushed = 0
+
+        # A channel added later starts within a chunk - the chunk is written whole, with the empty rows before it.
+        n_leading_rows = self.n_rows % len(self.staging)
+
+        if n_leading_rows:
+            self.staging[:n_leading_rows] = self.fill_value
+
+            self.n_rows -= n_leading_rows
+            self.n_staged = n_leading_rows
+
+    def flush(self):
+
+        if self.n_staged == self.n_flushed:
+            return
+
+        is_chunk_complete = self.n_staged == len(self.staging)
+
+        # The compressor still needs the data after the staging array is reused.
+        if is_chunk_complete:
+            chunk = self.staging
+            self.staging = numpy.empty_like(self.staging)
+
+        else:
+            chunk = self.staging.copy()
+            chunk[self.n_staged:] = self.fill_value
+
+        if self.n_rows + self.n_staged > self.n_allocated:
+            self.resize(self.n_rows + self.n_staged)
+
+        for chunk_slice in self.chunk_slices:
+            chunk_offset = (self.n_rows,) + tuple(row_slice.start for row_slice in chunk_slice)
+            self.compressor.submit(self.dataset, chunk_offset, chunk[(slice(None),) + chunk_slice], self.compress)
+
+        if is_chunk_complete:
+            self.n_rows += self.n_staged
+            self.n_staged = 0
+
+        self.n_flushed = self.n_staged
+
+
+class BatchedColumns(object):
+    # One 1D dataset per channel, all with the same dtype and number of rows. A message fills a column of the
+    # staging array for all the channels at once, and each flush writes a row of it to a dataset.
+
+    def __init__(self, dtype, n_channels, batch_size):
+        self.datasets = [None] * n_channels
+        self.staging = numpy.zeros((n_channels, batch_size), dtype=dtype)
+
+        self.n_rows = 0
+        self.n_staged = 0
+
+        self.n_allocated = 0
+
+    def add_dataset(self, channel_index, dataset):
+
+        if dataset.shape[0] != self.n_allocated:
+            dataset.resize(self.n_allocated, axis=0)
+
+        self.datasets[channel_index] = dataset
+
+    def resize(self, n_rows):
+
+        for dataset in self.datasets:
+            if dataset is not None:
+                dataset.resize(n_rows, axis=0)
+
+        self.n_allocated = n_rows
+
+    def append(self, values):
+        self.staging[:, self.n_staged] = values
+        self.n_staged += 1
+
+        if self.n_staged == self.staging.shape[1]:
+            self.flush()
+
+    def flush(self):
+
+        if self.n_staged == 0:
+            return
+
+        n_rows = self.n_rows + self.n_staged
+
+        if n_rows > self.n_allocated:
+            self.resize(n_rows)
+
+        # Channels in the scalar tables have no datasets.
+        for channel_index, dataset in enumerate(self.datasets):
+            if dataset is not None:
+                dataset[self.n_rows:n_rows] = self.staging[channel_index, :self.n_staged]
+
+        self.n_rows = n_rows
+        self.n_staged = 0
+
+
+class BatchedTable(BatchedDataset):
+    # The values of many scalar channels with the same dtype, in the columns of 1 dataset: (rows, channels).
+
+    def __init__(self, dataset, channel_indexes, batch_size):
+        super(BatchedTable, self).__init__(dataset, batch_size)
+
+        self.channel_indexes = numpy.asarray(channel_indexes)
+
+        if len(channel_indexes) > 1:
+            self.get_values = itemgetter(*channel_indexes)
+        else:
+            self.get_values = lambda data: (data[channel_indexes[0]],)
+
+    def append_row(self, data, is_data_valid):
+        values = self.get_values(data)
+
+        if not is_data_valid[self.channel_indexes].all():
+            values = [self.fill_value if value is None else value for value in values]
+
+        try:
+            row = numpy.asarray(values, dtype=self.dataset.dtype).reshape(-1)
+
+        # Scalars can be received as arrays with 1 element.
+        except ValueError:
+            row = numpy.array([numpy.ravel(value)[0] for value in values], dtype=self.dataset.dtype)
+
+        self.append(row)
+
+
+class PresenceBitmap(BatchedDataset):
+    # The is_data_present of all the channels in 1 dataset, with 1 bit per channel: (rows, channels / 8) bytes.
+
+    def __init__(self, dataset, batch_size):
+        super(PresenceBitmap, self).__init__(dataset, batch_size)
+        self.n_channels = dataset.attrs["n_channels"]
+
+    def add_dataset(self, channel_index, dataset):
+        raise ValueError("Channels have no is_data_present dataset with the presence bitmap.")
+
+    def append(self, values):
+        is_present = numpy.broadcast_to(numpy.asarray(values, dtype=bool), (self.n_channels,))
+        super(PresenceBitmap, self).append(numpy.packbits(is_present))
+
+
+def create_presence_bitmap_dataset(h5_file, channel_names, n_rows, chunks):
+    dataset = h5_file.create_dataset(PRESENCE_BITMAP_NAME, shape=(n_rows, (len(channel_names) + 7) // 8),
+                                     maxshape=(None, (len(channel_names) + 7) // 8), dtype="u1", chunks=chunks)
+
+    # The bit of each channel, from the most significant bit of the first byte.
+    dataset.attrs["n_channels"] = len(channel_names)
+    dataset.attrs.create("channel_names", channel_names, dtype=h5py.special_dtype(vlen=str))
+
+    return dataset
+
+
+def read_presence_bitmap(h5_file, rows=slice(None)):
+    # Returns a bool array (rows, channels) and the channel names.
+    dataset = h5_file[PRESENCE_BITMAP_NAME]
+
+    channel_names = [channel_name.decode() if isinstance(channel_name, bytes) else channel_name
+                     for channel_name in dataset.attrs["channel_names"]]
+
+    is_data_present = numpy.unpackbits(dataset[rows], axis=-1, count=len(channel_names)).astype(bool)
+
+    return is_data_present, channel_names
@@ -1,41 +1,159 @@
 import logging
-from time import time
+from fnmatch import fnmatch
+from itertools import repeat
+from operator import is_not
+from time import perf_counter, time
 
 import h5py
 import numpy
 from bsread.data.serialization import channel_type_deserializer_mapping
-from bsread.writer import Writer
+
+from sf_bsread_writer.channel_filter import verify_channel_patterns
+from sf_bsread_writer.writer_compression import ChunkCompressor, DEFAULT_GZIP_LEVEL, get_compression
+from sf_bsread_writer.writer_datasets import BatchedColumns, BatchedDataset, BatchedTable, CompressedDataset, \
+    PresenceBitmap, create_presence_bitmap_dataset, get_free_dataset_name
+from sf_bsread_writer.writer_index import PulseIdIndex, create_index_datasets
+from sf_bsread_writer.writer_metrics import WriterMetrics
 
 _logger = logging.getLogger(__name__)
 
 
 DATA_DATASET_NAME = "data"
-CHUNK_SIZE = 100
+SCALARS_GROUP_NAME = "/scalars/"
+
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_FLUSH_INTERVAL = 1
+
+DEFAULT_CHUNK_BYTES = 1024 * 1024
+DEFAULT_MAX_CHUNK_ROWS = 4096
+
+DEFAULT_COMPRESSION_WORKERS = 4
+
+# Maximum number of empty rows written for 1 gap in the pulse_ids, outside of the preallocated rows.
+DEFAULT_MAX_PULSE_ID_GAP = 10000
+
+
+def get_chunk_shape(dtype, row_shape, chunk_bytes=DEFAULT_CHUNK_BYTES, max_chunk_rows=DEFAULT_MAX_CHUNK_ROWS):
+    row_shape = list(row_shape)
+    row_bytes = numpy.dtype(dtype).itemsize * int(numpy.prod(row_shape))
+
+    # Small values (scalars, short waveforms) - as many rows as fit in the chunk.
+    if row_bytes <= chunk_bytes:
+        n_rows = max(1, min(chunk_bytes // row_bytes, max_chunk_rows))
+        return tuple([n_rows] + row_shape)
+
+    # Large values (images) - 1 row per chunk, split along the slowest changing axes.
+    for axis in range(len(row_shape)):
+        while row_bytes > chunk_bytes and row_shape[axis] > 1:
+            new_size = (row_shape[axis] + 1) // 2
+
+            row_bytes = row_bytes // row_shape[axis] * new_size
+            row_shape[axis] = new_size
 
+    return tuple([1] + row_shape)
 
-def get_chunk_size(dataset_size=None):
 
-    chunking_size = [CHUNK_SIZE]
+def is_scalar_channel(channel_definition):
+    return channel_definition.get('type', "float64") != "string" and channel_definition.get('shape', [1]) == [1]
 
-    if dataset_size is not None:
-        chunking_size = dataset_size
-        chunking_size[0] = CHUNK_SIZE
 
-    return tuple(chunking_size)
+def verify_format_parameters(parameters):
+
+    if parameters.get("format/presence", "datasets") not in ("datasets", "bitmap"):
+        raise ValueError("Presence '%s' not supported. Use 'datasets' or 'bitmap'." % parameters["format/presence"])
+
+    if parameters.get("format/scalar_layout", "groups") not in ("groups", "table"):
+        raise ValueError("Scalar layout '%s' not supported. Use 'groups' or 'table'." %
+                         parameters["format/scalar_layout"])
+
+    verify_channel_patterns(parameters.get("format/channels_include"))
+    verify_channel_patterns(parameters.get("format/channels_exclude"))
+
+    for name in ["format/rollover_bytes", "format/rollover_pulses", "format/rollover_seconds",
+                 "format/max_pulse_id_gap"]:
+        if parameters.get(name) is not None and parameters[name] <= 0:
+            raise ValueError("Parameter '%s' must be positive, but received '%s'." % (name, parameters[name]))
+
+    compressions = list(parameters.get("format/compression", {}).values())
+    compressions += list(parameters.get("format/compression_types", {}).values())
+
+    for compression in compressions:
+        if compression not in (None, "none"):
+            get_compression(compression)
 
 
 class BsreadH5Writer(object):
-    def __init__(self, output_file, parameters):
+    def __init__(self, output_file, parameters, metrics=None):
         self.output_file = output_file
         self.parameters = parameters
 
-        self.h5_writer = Writer()
-        self.h5_writer.open_file(self.output_file)
+        # Timings of the verify, write and flush stages.
+        self.metrics = metrics or WriterMetrics()
+
+        # Rows are kept in memory and written in batches of up to batch_size messages.
+        self.batch_size = parameters.get("format/batch_size", DEFAULT_BATCH_SIZE)
+        self.flush_interval = parameters.get("format/flush_interval", DEFAULT_FLUSH_INTERVAL)
+
+        self.chunk_bytes = parameters.get("format/chunk_bytes", DEFAULT_CHUNK_BYTES)
+        self.max_chunk_rows = parameters.get("format/max_chunk_rows", DEFAULT_MAX_CHUNK_ROWS)
+
+        verify_format_parameters(parameters)
+
+        # Compression by channel name pattern, or by channel type.
+        self.compression = parameters.get("format/compression", {})
+        self.compression_types = parameters.get("format/compression_types", {})
+        self.gzip_level = parameters.get("format/gzip_level", DEFAULT_GZIP_LEVEL)
+        self.compression_workers = parameters.get("format/compression_workers", DEFAULT_COMPRESSION_WORKERS)
+
+        self.compressor = None
+
+        # With the pulse_id step given, each row is at its pulse_id offset and missing pulses get empty rows.
+        self.pulse_id_step = parameters.get("format/pulse_id_step")
+        self.max_pulse_id_gap = parameters.get("format/max_pulse_id_gap", DEFAULT_MAX_PULSE_ID_GAP)
+
+        # Rows of the gaps too large to fill - the following messages are written this many rows before their offset.
+        self.n_skipped_rows = 0
+
+        self.pulse_range = None
+        self.allocated_pulse_range = None
+        self.n_allocated_rows = 0
+
+        # In SWMR mode the file can be read while it is written. All the datasets are created from the first data
+        # header, and each flush makes the written rows visible to the readers.
+        self.swmr = parameters.get("format/swmr", False)
+        self.dropped_channels = set()
+
+        # The is_data_present of all the channels can be written as 1 bitmap dataset instead of 1 dataset per channel.
+        self.presence_bitmap = parameters.get("format/presence", "datasets") == "bitmap"
+
+        # The scalar channels can be written in 1 table per dtype instead of 1 group per channel.
+        self.scalar_table = parameters.get("format/scalar_layout", "groups") == "table"
+
+        self.table_channels = set()
+        self.scalar_tables = []
+        self.scalar_pulse_ids = None
+
+        # Given by the rollover writer, so all the part files have the same tables.
+        self.table_channel_names = None
+
+        if self.swmr:
+            self.file = h5py.File(self.output_file, "w", libver="latest")
+        else:
+            self.file = h5py.File(self.output_file, "w")
 
         self.cached_channel_definitions = None
         self.first_iteration = True
         self.data_header_hash = None
 
+        self.data_datasets = None
+        self.pulse_ids = None
+        self.is_data_present = None
+
+        # Written at close, to find the row of a pulse_id without reading the pulse_id of every channel.
+        self.index = None
+
+        self.last_flush_time = time()
+
     def prune_and_close(self, stop_pulse_id):
         start_time = time()
         _logger.info("Starting to close the file.")
@@ -60,6 +178,25 @@ class BsreadH5Writer(object):
             n_channels = len(data_header['channels'])
             self.cached_channel_definitions = [None] * n_channels
 
+            self.data_datasets = [None] * n_channels
+            self.pulse_ids = BatchedColumns("i8", n_channels, self.batch_size)
+
+            if self.presence_bitmap:
+                channel_names = [channel['name'] for channel in data_header['channels']]
+                dataset = create_presence_bitmap_dataset(self.file, channel_names, 0, self._get_chunk_shape(
+                    "u1", [(n_channels + 7) // 8]))
+
+                self.is_data_present = PresenceBitmap(dataset, self.batch_size)
+
+            else:
+                self.is_data_present = BatchedColumns("u1", n_channels, self.batch_size)
+
+            self.index = PulseIdIndex(channel['name'] for channel in data_header['channels'])
+            create_index_datasets(self.file)
+
+            if self.scalar_table:
+                self._create_scalar_tables(data_header['channels'], data_values)
+
             self.first_iteration = False
 
         if n_channels != len(self.cached_channel_definitions):
@@ -74,6 +211,9 @@ class BsreadH5Writer(object):
         _logger.info("Data header change detected.")
         self.data_header_hash = data_header_hash
 
+        # The datasets of all channels need to have the same number of rows before they are changed.
+        self.flush()
+
         # Interpret the data header and add required datasets
         for channel_index, channel_definition in enumerate(data_header['channels']):
 
@@ -82,15 +222,21 @@ class BsreadH5Writer(object):
 
             channel_group_name = '/data/' + channel_name + "/"
 
+            # The channels in the scalar tables have no datasets of their own.
+            if channel_index in self.table_channels:
+                self._verify_table_channel(channel_index, channel_definition, channel_value)
+
             # New channel.
-            if self.cached_channel_definitions[channel_index] is None:
+            elif self.cached_channel_definitions[channel_index] is None:
 
                 _logger.debug("Creating datasets for channel_name '%s' at index %d.", channel_name, channel_index)
 
-                self.h5_writer.add_dataset(channel_group_name + 'pulse_id', dataset_group_name='pulse_id', dtype='i8',
-                                           chunks=get_chunk_size())
-                self.h5_writer.add_dataset(channel_group_name + 'is_data_present', dataset_group_name='is_data_present',
-                                           dtype='u1', chunks=get_chunk_size())
+                self.pulse_ids.add_dataset(channel_index, self._create_column_dataset(
+                    channel_group_name + 'pulse_id', 'i8'))
+
+                if not self.presence_bitmap:
+                    self.is_data_present.add_dataset(channel_index, self._create_column_dataset(
+                        channel_group_name + 'is_data_present', 'u1'))
 
                 self._setup_channel_data_dataset(channel_group_name, channel_index, channel_definition, channel_value)
 
@@ -101,38 +247,337 @@ class BsreadH5Writer(object):
                              "\nOld definition: %s\nNew definition%s.",
                              channel_name, self.cached_channel_definitions[channel_index], channel_definition)
 
-                self._modify_channel_data_dataset(channel_group_name, channel_index, channel_definition)
+                # No datasets can be created once the file is in SWMR mode.
+                if self.file.swmr_mode:
+                    _logger.error("Channel '%s' cannot be changed in SWMR mode. Its data is not written anymore.",
+                                  channel_name)
+
+                    self.dropped_channels.add(channel_index)
+                    self.cached_channel_definitions[channel_index] = channel_definition
+
+                else:
+                    self._modify_channel_data_dataset(channel_group_name, channel_index, channel_definition)
+
+        if self.swmr and not self.file.swmr_mode:
+            _logger.info("Starting SWMR mode.")
+            self.file.swmr_mode = True
+
+    def _create_scalar_tables(self, channels, data_values):
+        table_channel_indexes = {}
+
+        # The definition of channels without data cannot be trusted - they get a group when their data arrives.
+        # In SWMR mode no group can be created later, so the data header is trusted.
+        for channel_index, (channel_definition, channel_value) in enumerate(zip(channels, data_values)):
+
+            if self.table_channel_names is not None:
+                is_table_channel = channel_definition['name'] in self.table_channel_names
+            else:
+                is_table_channel = channel_value is not None or self.swmr
+
+            if is_scalar_channel(channel_definition) and is_table_channel:
+                dtype = numpy.dtype(channel_type_deserializer_mapping[channel_definition.get('type', "float64")][0])
+                table_channel_indexes.setdefault(dtype.name, []).append(channel_index)
+
+        self.table_channel_names = set(channels[channel_index]['name']
+                                       for channel_indexes in table_channel_indexes.values()
+                                       for channel_index in channel_indexes)
+
+        if not table_channel_indexes:
+            return
+
+        _logger.info("Writing %d scalar channels in %d tables.",
+                     sum(len(indexes) for indexes in table_channel_indexes.values()), len(table_channel_indexes))
+
+        # The pulse_id of the message, for all the tables.
+        self.scalar_pulse_ids = BatchedDataset(self._create_table_dataset(SCALARS_GROUP_NAME + "pulse_id", "i8", []),
+                                               self.batch_size)
+
+        for dtype_name, channel_indexes in table_channel_indexes.items():
+            channel_names = [channels[channel_index]['name'] for channel_index in channel_indexes]
+            table_group_name = SCALARS_GROUP_NAME + dtype_name + "/"
+
+            data_table = BatchedTable(self._create_table_dataset(table_group_name + DATA_DATASET_NAME, dtype_name,
+                                                                 channel_names), channel_indexes, self.batch_size)
+
+            if self.presence_bitmap:
+                presence_table = None
+            else:
+                presence_table = BatchedTable(self._create_table_dataset(table_group_name + "is_data_present", "u1",
+                                                                         channel_names), channel_indexes,
+                                              self.batch_size)
+
+            self.scalar_tables.append((data_table, presence_table))
+            self.table_channels.update(channel_indexes)
+
+    def _create_table_dataset(self, dataset_name, dtype, channel_names):
+        row_shape = [len(channel_names)] if channel_names else []
+
+        dataset = self.file.create_dataset(dataset_name, shape=[self.n_allocated_rows] + row_shape,
+                                           maxshape=[None] + row_shape, dtype=dtype,
+                                           chunks=self._get_chunk_shape(dtype, row_shape))
+
+        # The channel of each column.
+        if channel_names:
+            dataset.attrs.create("channel_names", channel_names, dtype=h5py.special_dtype(vlen=str))
+
+        return dataset
+
+    def _verify_table_channel(self, channel_index, channel_definition, channel_value):
+        cached_channel_definition = self.cached_channel_definitions[channel_index]
+        self.cached_channel_definitions[channel_index] = channel_definition
+
+        if cached_channel_definition is None or channel_value is None or \
+                cached_channel_definition == channel_definition:
+            return
+
+        # The column of a table cannot change - only the dtype of the scalar can, as the values are converted.
+        if is_scalar_channel(channel_definition):
+            _logger.info("Channel definition changed for channel_name '%s'. The values are converted to the "
+                         "dtype of its scalar table.", channel_definition['name'])
+
+        else:
+            _logger.error("Channel '%s' is not a scalar anymore. Its data is not written anymore.",
+                          channel_definition['name'])
+
+            self.dropped_channels.add(channel_index)
+
+    def _get_table_datasets(self):
+        table_datasets = [self.scalar_pulse_ids] if self.scalar_pulse_ids is not None else []
+
+        for data_table, presence_table in self.scalar_tables:
+            table_datasets.append(data_table)
+
+            if presence_table is not None:
+                table_datasets.append(presence_table)
+
+        return table_datasets
+
+    def set_pulse_range(self, start_pulse_id, stop_pulse_id=None):
+        # Called from other threads - the datasets are resized by the writing thread.
+        self.pulse_range = (start_pulse_id, stop_pulse_id)
 
     def write_message(self, message):
         message_data = message.data
+        start_time = perf_counter()
 
         self._verify_datasets(message_data)
 
-        data = message_data['data']
+        if self.pulse_range != self.allocated_pulse_range:
+            self._preallocate_datasets()
 
-        self.h5_writer.write(data, dataset_group_name='data')
+        start_time = self.metrics.observe("verify", start_time)
 
-        self.h5_writer.write(message_data['pulse_ids'], dataset_group_name='pulse_id')
+        if self.pulse_id_step is not None and self.pulse_range is not None:
+            if not self._write_missing_pulses(message_data["header"]["pulse_id"]):
+                return
+
+        data = message_data['data']
+
+        if self.dropped_channels:
+            data = [None if channel_index in self.dropped_channels else data_point
+                    for channel_index, data_point in enumerate(data)]
 
         # Because some channels might not be decoded properly, we have to write if data is written in a specific cell.
-        is_data_valid = [1 if data_point is not None else 0 for data_point in data]
-        self.h5_writer.write(is_data_valid, dataset_group_name='is_data_present')
+        is_data_valid = numpy.frombuffer(bytes(map(is_not, data, repeat(None))), dtype=bool)
+
+        self._append_row(message_data["header"]["pulse_id"], data, message_data['pulse_ids'], is_data_valid)
+
+        start_time = self.metrics.observe("write", start_time)
+        self.metrics.count("messages_written")
+
+        if time() - self.last_flush_time >= self.flush_interval:
+            self.flush()
+            self.metrics.observe("flush", start_time)
+
+    def _append_row(self, pulse_id, data, pulse_ids, is_data_valid):
+
+        # Stubs (channels without data so far) have no dataset.
+        for data_dataset, data_point in zip(self.data_datasets, data):
+            if data_dataset is not None:
+                data_dataset.append(data_point)
+
+        self.pulse_ids.append(pulse_ids)
+        self.is_data_present.append(is_data_valid)
+
+        if self.scalar_pulse_ids is not None:
+            self.scalar_pulse_ids.append(pulse_id)
+
+            for data_table, presence_table in self.scalar_tables:
+                data_table.append_row(data, is_data_valid)
+
+                if presence_table is not None:
+                    presence_table.append(is_data_valid[presence_table.channel_indexes])
+
+        self.index.append(pulse_id, pulse_ids)
+
+    def _write_missing_pulses(self, pulse_id):
+        # Returns False if the message cannot be written at its offset.
+        start_pulse_id, _ = self.pulse_range
+
+        n_written_rows = self.pulse_ids.n_rows + self.pulse_ids.n_staged
+        row = (pulse_id - start_pulse_id) // self.pulse_id_step - self.n_skipped_rows
+
+        if row < n_written_rows:
+            _logger.warning("Pulse_id %d is before the last written row %d. Message not written.",
+                            pulse_id, n_written_rows - 1)
+            return False
+
+        # Gaps are filled only in the preallocated rows, or up to the maximum gap.
+        if row > n_written_rows and row >= self.n_allocated_rows and row - n_written_rows > self.max_pulse_id_gap:
+            _logger.warning("Gap of %d pulses before pulse_id %d is larger than the maximum of %d. Empty rows not "
+                            "written.", row - n_written_rows, pulse_id, self.max_pulse_id_gap)
+
+            self.n_skipped_rows += row - n_written_rows
+            return True
+
+        if row > n_written_rows:
+            _logger.debug("Pulses missing before pulse_id %d. Writing %d empty rows.", pulse_id, row - n_written_rows)
+
+        empty_data = [None] * len(self.data_datasets)
+        no_data_present = numpy.zeros(len(self.data_datasets), dtype=bool)
+
+        for missing_row in range(n_written_rows, row):
+            missing_pulse_id = start_pulse_id + (missing_row + self.n_skipped_rows) * self.pulse_id_step
+            self._append_row(missing_pulse_id, empty_data, missing_pulse_id, no_data_present)
+
+        return True
+
+    def _preallocate_datasets(self):
+        self.allocated_pulse_range = self.pulse_range
+        start_pulse_id, stop_pulse_id = self.pulse_range
+
+        if stop_pulse_id is None or stop_pulse_id < start_pulse_id:
+            return
+
+        # SWMR readers follow the length of the datasets - it must be the number of written rows.
+        if self.swmr:
+            return
+
+        n_rows = (stop_pulse_id - start_pulse_id) // (self.pulse_id_step or 1) + 1
+
+        if n_rows <= self.n_allocated_rows:
+            return
+
+        _logger.info("Preallocating %d rows for pulse_id range %d to %d.", n_rows, start_pulse_id, stop_pulse_id)
+        self.n_allocated_rows = n_rows
+
+        for data_dataset in self.data_datasets:
+            if data_dataset is not None and data_dataset.n_allocated < n_rows:
+                data_dataset.resize(n_rows)
+
+        if self.pulse_ids.n_allocated < n_rows:
+            self.pulse_ids.resize(n_rows)
+            self.is_data_present.resize(n_rows)
+
+        for table_dataset in self._get_table_datasets():
+            if table_dataset.n_allocated < n_rows:
+                table_dataset.resize(n_rows)
+
+    def _shrink_datasets(self):
+        # Only the rows not written are removed, no data is moved.
+        n_rows = self.pulse_ids.n_rows
+
+        for data_dataset in self.data_datasets:
+            if data_dataset is not None and data_dataset.n_allocated > n_rows:
+                data_dataset.resize(n_rows)
+
+        if self.pulse_ids.n_allocated > n_rows:
+            self.pulse_ids.resize(n_rows)
+            self.is_data_present.resize(n_rows)
+
+        for table_dataset in self._get_table_datasets():
+            if table_dataset.n_allocated > n_rows:
+                table_dataset.resize(n_rows)
+
+    def flush(self):
+
+        if self.first_iteration:
+            return
+
+        for data_dataset in self.data_datasets:
+            if data_dataset is not None:
+                data_dataset.flush()
+
+        self.pulse_ids.flush()
+        self.is_data_present.flush()
+
+        for table_dataset in self._get_table_datasets():
+            table_dataset.flush()
+
+        if self.compressor is not None:
+            self.compressor.flush()
+
+        if self.file.swmr_mode:
+            self.file.flush()
+
+        self.last_flush_time = time()
 
     def _prepare_format_datasets(self):
 
         _logger.info("Initializing format datasets.")
 
-        self.h5_writer.file.create_dataset("/general/created",
-                                           data=numpy.string_(self.parameters.get("general/created", "not given")))
+        self.file.create_dataset("/general/created",
+                                 data=numpy.string_(self.parameters.get("general/created", "not given")))
+
+        self.file.create_dataset("/general/instrument",
+                                 data=numpy.string_(self.parameters.get("general/instrument", "not given")))
+
+        self.file.create_dataset("/general/process",
+                                 data=numpy.string_(self.parameters.get("general/process", "not given")))
+
+        self.file.create_dataset("/general/user",
+                                 data=numpy.string_(self.parameters.get("general/user", "not given")))
+
+    def _create_column_dataset(self, dataset_name, dtype):
+        return self.file.create_dataset(dataset_name, shape=(self.pulse_ids.n_rows,), maxshape=(None,),
+                                        dtype=dtype, chunks=self._get_chunk_shape(dtype, ()))
+
+    def _create_data_dataset(self, dataset_name, channel_definition):
+        dtype, dataset_shape, dataset_max_shape = self._get_channel_data_dataset_definition(channel_definition)
+
+        # A channel added later gets empty rows for the messages already written.
+        dataset_shape[0] = self.pulse_ids.n_rows
+
+        compression = self._get_channel_compression(channel_definition)
+
+        # Variable length strings cannot be compressed in chunks.
+        if compression is None or channel_definition.get('type') == "string":
+            dataset = self.file.create_dataset(dataset_name, shape=dataset_shape, maxshape=dataset_max_shape,
+                                               dtype=dtype, chunks=self._get_chunk_shape(dtype, dataset_shape[1:]))
 
-        self.h5_writer.file.create_dataset("/general/instrument",
-                                           data=numpy.string_(self.parameters.get("general/instrument", "not given")))
+            data_dataset = BatchedDataset(dataset, min(self.batch_size, dataset.chunks[0]))
 
-        self.h5_writer.file.create_dataset("/general/process",
-                                           data=numpy.string_(self.parameters.get("general/process", "not given")))
+        else:
+            compress, compression_arguments = get_compression(compression, self.gzip_level)
+
+            dataset = self.file.create_dataset(dataset_name, shape=dataset_shape, maxshape=dataset_max_shape,
+                                               dtype=dtype, chunks=self._get_chunk_shape(dtype, dataset_shape[1:]),
+                                               **compression_arguments)
+
+            if self.compressor is None:
+                _logger.info("Starting %d compression workers.", self.compression_workers)
+                self.compressor = ChunkCompressor(self.compression_workers)
+
+            data_dataset = CompressedDataset(dataset, self.compressor, compress)
+
+        if self.n_allocated_rows > data_dataset.n_allocated:
+            data_dataset.resize(self.n_allocated_rows)
+
+        return data_dataset
+
+    def _get_channel_compression(self, channel_definition):
+
+        for channel_pattern, compression in self.compression.items():
+            if fnmatch(channel_definition['name'], channel_pattern):
+                break
+
+        else:
+            compression = self.compression_types.get(channel_definition.get('type', "float64"))
 
-        self.h5_writer.file.create_dataset("/general/user",
-                                           data=numpy.string_(self.parameters.get("general/user", "not given")))
+        return None if compression == "none" else compression
+
+    def _get_chunk_shape(self, dtype, row_shape):
+        return get_chunk_shape(dtype, row_shape, self.chunk_bytes, self.max_chunk_rows)
 
     def _get_channel_data_dataset_definition(self, channel_definition):
 
@@ -153,35 +598,44 @@ class BsreadH5Writer(object):
     def _setup_channel_data_dataset(self, channel_group_name, channel_index, channel_definition, channel_value):
 
         # If we do not have a channel value we cannot be sure that the header is correct or just default.
-        if channel_value is None:
+        # In SWMR mode the dataset cannot be created later, so the data header is trusted.
+        if channel_value is None and not self.swmr:
             _logger.info("No data for channel_name '%s' was received. Creating dataset stub.",
                          channel_definition['name'])
 
-            self.h5_writer.add_dataset_stub(dataset_group_name='data',
-                                            dataset_name=channel_group_name + DATA_DATASET_NAME)
-
+            self.data_datasets[channel_index] = None
             self.cached_channel_definitions[channel_index] = {}
 
         else:
-            dtype, dataset_shape, dataset_max_shape = self._get_channel_data_dataset_definition(channel_definition)
-
-            self.h5_writer.add_dataset(channel_group_name + 'data', dataset_group_name='data', shape=dataset_shape,
-                                       maxshape=dataset_max_shape, dtype=dtype, chunks=get_chunk_size(dataset_shape))
+            self.data_datasets[channel_index] = self._create_data_dataset(channel_group_name + DATA_DATASET_NAME,
+                                                                          channel_definition)
 
             self.cached_channel_definitions[channel_index] = channel_definition
 
     def _modify_channel_data_dataset(self, channel_group_name, channel_index, channel_definition):
 
-        dtype, dataset_shape, dataset_max_shape = self._get_channel_data_dataset_definition(channel_definition)
+        dataset_name = channel_group_name + DATA_DATASET_NAME
+
+        # Keep the data written with the old definition.
+        if self.data_datasets[channel_index] is not None:
+            old_data_dataset = self.data_datasets[channel_index]
 
-        self.h5_writer.replace_dataset(dataset_group_name="data",
-                                       dataset_name=channel_group_name + DATA_DATASET_NAME,
-                                       dtype=dtype,
-                                       shape=dataset_shape,
-                                       maxshape=dataset_max_shape,
-                                       chunks=get_chunk_size(dataset_shape))
+            if old_data_dataset.n_allocated > self.pulse_ids.n_rows:
+                old_data_dataset.resize(self.pulse_ids.n_rows)
 
+            self.file.move(dataset_name, get_free_dataset_name(self.file, dataset_name))
+
+        self.data_datasets[channel_index] = self._create_data_dataset(dataset_name, channel_definition)
         self.cached_channel_definitions[channel_index] = channel_definition
 
     def close(self):
-        self.h5_writer.close_file()
+        self.flush()
+
+        if self.compressor is not None:
+            self.compressor.close()
+
+        if not self.first_iteration:
+            self._shrink_datasets()
+            self.index.write(self.file)
+
+        self.file.close()
@@ -0,0 +1,174 @@
+import bisect
+
+import h5py
+import numpy
+
+INDEX_GROUP_NAME = "/index/"
+INDEX_DATASET_NAMES = ["pulse_id", "row", "offset_row", "offset_channel", "offset"]
+
+
+class PulseIdIndex(object):
+    # The pulse_id of each row, and where the pulse_id of a channel differs from the message pulse_id (late data).
+    # The differences are kept only when they change, so channels with aligned data add nothing to the index.
+
+    def __init__(self, channel_names):
+        self.channel_names = list(channel_names)
+
+        self.pulse_ids = numpy.zeros(1024, dtype="i8")
+        self.n_rows = 0
+
+        self.channel_offsets = numpy.zeros(len(self.channel_names), dtype="i8")
+        self.offset_changes = []
+
+    def append(self, pulse_id, channel_pulse_ids):
+
+        if self.n_rows == len(self.pulse_ids):
+            self.pulse_ids = numpy.resize(self.pulse_ids, 2 * len(self.pulse_ids))
+
+        self.pulse_ids[self.n_rows] = pulse_id
+
+        offsets = numpy.asarray(channel_pulse_ids, dtype="i8") - pulse_id
+
+        for channel_index in numpy.flatnonzero(offsets != self.channel_offsets):
+            self.offset_changes.append((self.n_rows, channel_index, offsets[channel_index]))
+
+        self.channel_offsets[:] = offsets
+        self.n_rows += 1
+
+    def write(self, h5_file):
+        write_index(h5_file, self.pulse_ids[:self.n_rows], self.channel_names, self.offset_changes)
+
+
+def create_index_datasets(h5_file):
+    # Created empty before writing, as no datasets can be created in SWMR mode.
+    for dataset_name in INDEX_DATASET_NAMES:
+        h5_file.create_dataset(INDEX_GROUP_NAME + dataset_name, shape=(0,), maxshape=(None,), dtype="i8",
+                               chunks=True)
+
+    h5_file.create_dataset(INDEX_GROUP_NAME + "channel_name", shape=(0,), maxshape=(None,),
+                           dtype=h5py.special_dtype(vlen=str), chunks=True)
+
+
+def write_index_dataset(h5_file, dataset_name, data):
+    dataset = h5_file[INDEX_GROUP_NAME + dataset_name]
+
+    dataset.resize(len(data), axis=0)
+
+    if len(data) > 0:
+        dataset[:] = data
+
+
+def write_index(h5_file, row_pulse_ids, channel_names, offset_changes):
+
+    if INDEX_GROUP_NAME + "pulse_id" not in h5_file:
+        create_index_datasets(h5_file)
+
+    row_pulse_ids = numpy.asarray(row_pulse_ids, dtype="i8")
+
+    # Messages can arrive out of order - the index is sorted by pulse_id, with the row of each pulse_id.
+    rows = numpy.argsort(row_pulse_ids, kind="stable")
+
+    write_index_dataset(h5_file, "pulse_id", row_pulse_ids[rows])
+    write_index_dataset(h5_file, "row", rows)
+    write_index_dataset(h5_file, "channel_name", channel_names)
+
+    offset_changes = numpy.array(offset_changes, dtype="i8").reshape(-1, 3)
+
+    # From each row on, the pulse_id of the channel is the pulse_id of the message plus the offset.
+    write_index_dataset(h5_file, "offset_row", offset_changes[:, 0])
+    write_index_dataset(h5_file, "offset_channel", offset_changes[:, 1])
+    write_index_dataset(h5_file, "offset", offset_changes[:, 2])
+
+
+def merge_indexes(h5_files):
+    # The index of files written one after the other, with the rows of all the files in sequence (parts).
+    row_pulse_ids = []
+    channel_names = []
+    offset_changes = []
+
+    row_offset = 0
+    channel_offsets = {}
+
+    for h5_file in h5_files:
+        if INDEX_GROUP_NAME + "pulse_id" not in h5_file:
+            continue
+
+        index_rows = h5_file[INDEX_GROUP_NAME + "row"][:]
+
+        file_row_pulse_ids = numpy.empty(len(index_rows), dtype="i8")
+        file_row_pulse_ids[index_rows] = h5_file[INDEX_GROUP_NAME + "pulse_id"][:]
+
+        file_channel_names = list(h5_file[INDEX_GROUP_NAME + "channel_name"].asstr()[:])
+
+        for channel_name in file_channel_names:
+            if channel_name not in channel_names:
+                channel_names.append(channel_name)
+
+        # The offsets of each file start from 0.
+        for channel_index, offset in list(channel_offsets.items()):
+            if offset != 0:
+                offset_changes.append((row_offset, channel_index, 0))
+                channel_offsets[channel_index] = 0
+
+        for row, file_channel_index, offset in zip(h5_file[INDEX_GROUP_NAME + "offset_row"][:],
+                                                   h5_file[INDEX_GROUP_NAME + "offset_channel"][:],
+                                                   h5_file[INDEX_GROUP_NAME + "offset"][:]):
+
+            channel_index = channel_names.index(file_channel_names[file_channel_index])
+
+            offset_changes.append((row + row_offset, channel_index, offset))
+            channel_offsets[channel_index] = offset
+
+        row_pulse_ids.append(file_row_pulse_ids)
+        row_offset += len(file_row_pulse_ids)
+
+    row_pulse_ids = numpy.concatenate(row_pulse_ids) if row_pulse_ids else numpy.zeros(0, dtype="i8")
+
+    return row_pulse_ids, channel_names, offset_changes
+
+
+def find_row(h5_file, pulse_id):
+    # Binary search in the index - only log2(n) values are read from the file.
+    index_pulse_ids = h5_file[INDEX_GROUP_NAME + "pulse_id"]
+    position = bisect.bisect_left(index_pulse_ids, pulse_id)
+
+    if position == len(index_pulse_ids) or index_pulse_ids[position] != pulse_id:
+        return None
+
+    return int(h5_file[INDEX_GROUP_NAME + "row"][position])
+
+
+def get_channel_offset(channel_offset_rows, channel_offsets, row):
+    position = bisect.bisect_right(channel_offset_rows, row) - 1
+    return channel_offsets[position] if position >= 0 else 0
+
+
+def get_pulse_id_rows(h5_file, pulse_id):
+    # Returns the row with the pulse_id in the datasets of each channel (None if the pulse_id was not written).
+    row = find_row(h5_file, pulse_id)
+
+    channel_names = list(h5_file[INDEX_GROUP_NAME + "channel_name"].asstr()[:])
+    channel_rows = {channel_name: row for channel_name in channel_names}
+
+    offset_rows = h5_file[INDEX_GROUP_NAME + "offset_row"][:]
+    offset_channels = h5_file[INDEX_GROUP_NAME + "offset_channel"][:]
+    offsets = h5_file[INDEX_GROUP_NAME + "offset"][:]
+
+    # Only the channels with late data need more searches - one for each offset the channel had.
+    for channel_index in numpy.unique(offset_channels):
+        channel_offset_rows = offset_rows[offset_channels == channel_index]
+        channel_offsets = offsets[offset_channels == channel_index]
+
+        channel_name = channel_names[channel_index]
+        channel_rows[channel_name] = None
+
+        # Aligned data first.
+        for offset in [0] + [offset for offset in numpy.unique(channel_offsets) if offset != 0]:
+            channel_row = find_row(h5_file, pulse_id - offset)
+
+            if channel_row is not None and \
+                    get_channel_offset(channel_offset_rows, channel_offsets, channel_row) == offset:
+                channel_rows[channel_name] = channel_row
+                break
+
+    return channel_rows
@@ -0,0 +1,72 @@
+from collections import OrderedDict
+from time import perf_counter
+
+from sf_bsread_writer.metrics import Histogram, PrometheusText, RateMeter
+
+# Receive includes decode. Verify, write and flush are in the write thread.
+WRITER_STAGES = ["receive", "decode", "verify", "write", "flush"]
+STAGE_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+
+WRITER_COUNTERS = ["messages_received", "bytes_received", "messages_written", "messages_discarded_early",
+                   "messages_discarded_late", "messages_discarded_out_of_order", "pulse_id_gaps", "pulse_ids_missing"]
+RATE_COUNTERS = ["messages_received", "bytes_received", "messages_written"]
+
+
+def get_message_bytes(message):
+    # mflow counts the bytes of the last received message.
+    statistics = getattr(message, "statistics", None)
+    return getattr(statistics, "bytes_received", 0)
+
+
+class WriterMetrics(object):
+    # Timings of each stage and counters, over all the acquisitions of the writer process.
+
+    def __init__(self):
+        self.stage_histograms = OrderedDict((stage, Histogram(STAGE_BUCKETS)) for stage in WRITER_STAGES)
+        self.counters = OrderedDict((name, 0) for name in WRITER_COUNTERS)
+        self.rate_meters = {name: RateMeter() for name in RATE_COUNTERS}
+
+        self.last_pulse_id = None
+
+    def observe(self, stage, start_time):
+        # Returns the end time, so the next stage can start from it.
+        end_time = perf_counter()
+        self.stage_histograms[stage].observe(end_time - start_time)
+
+        return end_time
+
+    def count(self, name, value=1):
+        self.counters[name] += value
+
+    def count_pulse_id(self, pulse_id, pulse_id_step=1):
+
+        if self.last_pulse_id is not None and pulse_id - self.last_pulse_id > pulse_id_step:
+            self.counters["pulse_id_gaps"] += 1
+            self.counters["pulse_ids_missing"] += (pulse_id - self.last_pulse_id) // pulse_id_step - 1
+
+        self.last_pulse_id = pulse_id
+
+    def get_statistics(self):
+        statistics = OrderedDict(self.counters)
+
+        for name in RATE_COUNTERS:
+            statistics[name + "_per_second"] = self.rate_meters[name].update(self.counters[name])
+
+        statistics["stages"] = OrderedDict((stage, histogram.get_statistics())
+                                           for stage, histogram in self.stage_histograms.items())
+
+        return statistics
+
+    def get_prometheus_text(self, gauges=()):
+        metrics = PrometheusText()
+
+        for name, value in gauges:
+            metrics.add(name, value)
+
+        for name, value in self.counters.items():
+            metrics.add("sf_bsread_writer_%s_total" % name, value, metric_type="counter")
+
+        for stage, histogram in self.stage_histograms.items():
+            metrics.add_histogram("sf_bsread_writer_stage_seconds", histogram, OrderedDict([("stage", stage)]))
+
+        return metrics.get_text()
@@ -38,6 +38,11 @@ def register_rest_interface(app, manager):
                 "status": manager.get_status(),
                 "statistics": manager.get_statistics()}
 
+    @app.get("/metrics")
+    def get_metrics():
+        bottle.response.content_type = "text/plain; version=0.0.4"
+        return manager.get_prometheus_text()
+
     @app.put("/start_now")
     def start_now():
         _logger.info("Starting writer without pulse_id.")
@@ -47,6 +52,22 @@ def register_rest_interface(app, manager):
 
         manager.start_writer(None, output_file)
 
+    @app.put("/arm")
+    def arm():
+        manager.arm()
+
+        return {"state": "ok",
+                "status": manager.get_status()}
+
+    @app.put("/acquire")
+    def acquire():
+        data = bottle.request.json
+
+        manager.acquire(data["output_file"], data.get("start_pulse_id"), data.get("stop_pulse_id"))
+
+        return {"state": "ok",
+                "status": manager.get_status()}
+
     @app.put("/stop_now")
     def stop_now():
         _logger.info("Stopping writing without pulse_id.")
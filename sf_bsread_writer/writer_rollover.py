@@ -0,0 +1,271 @@
+import logging
+import os
+from time import time
+
+import h5py
+
+from sf_bsread_writer.writer_datasets import PRESENCE_BITMAP_NAME
+from sf_bsread_writer.writer_format import SCALARS_GROUP_NAME, BsreadH5Writer
+from sf_bsread_writer.writer_index import INDEX_GROUP_NAME, merge_indexes, write_index
+
+_logger = logging.getLogger(__name__)
+
+
+ROLLOVER_PARAMETERS = ["format/rollover_bytes", "format/rollover_pulses", "format/rollover_seconds"]
+
+
+def get_part_file_name(output_file, part_index):
+    root, extension = os.path.splitext(output_file)
+    return "%s_%04d%s" % (root, part_index, extension)
+
+
+def create_h5_writer(output_file, parameters, metrics=None):
+
+    if any(parameters.get(name) for name in ROLLOVER_PARAMETERS):
+        return RolloverH5Writer(output_file, parameters, metrics)
+
+    return BsreadH5Writer(output_file, parameters, metrics)
+
+
+def get_part_datasets(part_files):
+    # Returns the datasets of each channel, and their shape in each part: {channel: {name: [(part, shape, dtype)]}}
+    channels = {}
+
+    for part_index, part_file in enumerate(part_files):
+        with h5py.File(part_file, "r") as part:
+
+            for channel_name, channel_group in part.get("data", {}).items():
+                n_rows = len(channel_group["pulse_id"])
+
+                for dataset_name, dataset in channel_group.items():
+
+                    # The data written before a channel change (data(1), data(2)...) is not in all the rows.
+                    if len(dataset) != n_rows:
+                        continue
+
+                    channel = channels.setdefault(channel_name, {})
+                    channel.setdefault(dataset_name, []).append((part_index, dataset.shape, dataset.dtype))
+
+    return channels
+
+
+def write_master_file(master_file, part_files):
+    _logger.info("Writing master file '%s' for %d part files.", master_file, len(part_files))
+
+    channels = get_part_datasets(part_files)
+
+    with h5py.File(master_file, "w") as master:
+
+        if part_files:
+            with h5py.File(part_files[0], "r") as first_part:
+                if "general" in first_part:
+                    first_part.copy("general", master)
+
+        for channel_name, datasets in channels.items():
+
+            # The rows of a channel in each part - the parts without the channel have none.
+            part_rows = {part_index: shape[0] for part_index, shape, _ in datasets["pulse_id"]}
+            part_offsets = {}
+
+            n_rows = 0
+            for part_index in range(len(part_files)):
+                part_offsets[part_index] = n_rows
+                n_rows += part_rows.get(part_index, 0)
+
+            if n_rows == 0:
+                continue
+
+            for dataset_name, sources in datasets.items():
+                dataset_path = "/data/%s/%s" % (channel_name, dataset_name)
+
+                # Rows from parts with a different channel definition are left empty.
+                _, last_shape, dtype = sources[-1]
+                layout = h5py.VirtualLayout(shape=(n_rows,) + last_shape[1:], dtype=dtype)
+
+                for part_index, shape, part_dtype in sources:
+
+                    if shape[1:] != last_shape[1:] or part_dtype != dtype:
+                        _logger.warning("Dataset '%s' in part '%s' does not match the last definition. "
+                                        "Not in the master file.", dataset_path, part_files[part_index])
+                        continue
+
+                    if shape[0] == 0:
+                        continue
+
+                    # Relative to the master file, so the files can be moved together.
+                    offset = part_offsets[part_index]
+                    layout[offset:offset + shape[0]] = h5py.VirtualSource(os.path.basename(part_files[part_index]),
+                                                                          dataset_path, shape=shape)
+
+                master.create_virtual_dataset(dataset_path, layout)
+
+        write_master_row_datasets(master, part_files)
+
+        # The rows of all the channels are aligned in the master file, like in the parts.
+        part_h5_files = [h5py.File(part_file, "r") for part_file in part_files]
+
+        try:
+            write_index(master, *merge_indexes(part_h5_files))
+        finally:
+            for part_h5_file in part_h5_files:
+                part_h5_file.close()
+
+
+def get_row_dataset_names(part):
+    # The datasets with 1 row per message for all the channels together.
+    dataset_names = [PRESENCE_BITMAP_NAME] if PRESENCE_BITMAP_NAME in part else []
+
+    if SCALARS_GROUP_NAME in part:
+        part[SCALARS_GROUP_NAME].visititems(
+            lambda name, item: dataset_names.append(item.name) if isinstance(item, h5py.Dataset) else None)
+
+    return dataset_names
+
+
+def write_master_row_datasets(master, part_files):
+    sources = {}
+    part_offsets = []
+
+    n_rows = 0
+    for part_file in part_files:
+        with h5py.File(part_file, "r") as part:
+            part_offsets.append(n_rows)
+
+            for dataset_name in get_row_dataset_names(part):
+                dataset = part[dataset_name]
+                sources.setdefault(dataset_name, []).append((len(part_offsets) - 1, dataset.shape, dataset.dtype,
+                                                             dict(dataset.attrs)))
+
+            # All the parts have the same number of rows in the row datasets and the index.
+            n_rows += len(part[INDEX_GROUP_NAME + "row"]) if INDEX_GROUP_NAME + "row" in part else 0
+
+    for dataset_name, dataset_sources in sources.items():
+        _, last_shape, dtype, attributes = dataset_sources[-1]
+        layout = h5py.VirtualLayout(shape=(n_rows,) + last_shape[1:], dtype=dtype)
+
+        for part_index, shape, part_dtype, part_attributes in dataset_sources:
+
+            # The columns of a table are given by the channels in the first data header of each part.
+            if shape[1:] != last_shape[1:] or part_dtype != dtype or \
+                    list(part_attributes.get("channel_names", [])) != list(attributes.get("channel_names", [])):
+                _logger.warning("Dataset '%s' in part '%s' does not match the last definition. "
+                                "Not in the master file.", dataset_name, part_files[part_index])
+                continue
+
+            if shape[0] > 0:
+                offset = part_offsets[part_index]
+                layout[offset:offset + shape[0]] = h5py.VirtualSource(os.path.basename(part_files[part_index]),
+                                                                      dataset_name, shape=shape)
+
+        dataset = master.create_virtual_dataset(dataset_name, layout)
+        dataset.attrs.update(attributes)
+
+
+class RolloverH5Writer(object):
+    # Writes the acquisition in part files of limited size, number of messages or duration. Each part file is closed
+    # as soon as it is complete, and a master file with virtual datasets over all the parts is written at close.
+
+    def __init__(self, output_file, parameters, metrics=None):
+        self.output_file = output_file
+        self.parameters = parameters
+        self.metrics = metrics
+
+        self.rollover_bytes = parameters.get("format/rollover_bytes")
+        self.rollover_pulses = parameters.get("format/rollover_pulses")
+        self.rollover_seconds = parameters.get("format/rollover_seconds")
+
+        self.pulse_id_step = parameters.get("format/pulse_id_step")
+
+        self.pulse_range = None
+        self.part_pulse_range = None
+        self.last_pulse_id = None
+
+        self.part_files = []
+        self.part_writer = None
+        self.part_start_pulse_id = None
+        self.part_start_time = None
+        self.n_part_messages = 0
+
+        self._open_part()
+
+    def _open_part(self):
+        part_file = get_part_file_name(self.output_file, len(self.part_files))
+        _logger.info("Opening part file '%s'.", part_file)
+
+        table_channel_names = self.part_writer.table_channel_names if self.part_writer is not None else None
+
+        self.part_writer = BsreadH5Writer(part_file, self.parameters, self.metrics)
+
+        # The scalar tables of all the parts have the channels selected in the first part.
+        self.part_writer.table_channel_names = table_channel_names
+        self.part_files.append(part_file)
+
+        self.part_pulse_range = None
+        self.part_start_time = time()
+        self.n_part_messages = 0
+
+    def _close_part(self):
+        start_time = time()
+
+        self.part_writer.close()
+        _logger.info("Part file '%s' closed in %s seconds.", self.part_files[-1], time() - start_time)
+
+    def _is_part_complete(self):
+
+        if self.n_part_messages == 0:
+            return False
+
+        if self.rollover_pulses and self.n_part_messages >= self.rollover_pulses:
+            return True
+
+        if self.rollover_seconds and time() - self.part_start_time >= self.rollover_seconds:
+            return True
+
+        if self.rollover_bytes and self.part_writer.file.id.get_filesize() >= self.rollover_bytes:
+            return True
+
+        return False
+
+    def set_pulse_range(self, start_pulse_id, stop_pulse_id=None):
+        # Called from other threads - the range is given to the part writer by the writing thread.
+        self.pulse_range = (start_pulse_id, stop_pulse_id)
+
+    def _set_part_pulse_range(self):
+        self.part_pulse_range = self.pulse_range
+        start_pulse_id, stop_pulse_id = self.pulse_range
+
+        # The next parts start after the last pulse of the previous part.
+        if self.part_start_pulse_id is not None:
+            start_pulse_id = self.part_start_pulse_id
+
+        self.part_writer.set_pulse_range(start_pulse_id, stop_pulse_id)
+
+    def write_message(self, message):
+
+        if self._is_part_complete():
+            self._close_part()
+
+            self.part_start_pulse_id = self.last_pulse_id + (self.pulse_id_step or 1)
+            self._open_part()
+
+        if self.pulse_range is not None and self.pulse_range != self.part_pulse_range:
+            self._set_part_pulse_range()
+
+        self.part_writer.write_message(message)
+
+        self.last_pulse_id = message.data["header"]["pulse_id"]
+        self.n_part_messages += 1
+
+    def flush(self):
+        self.part_writer.flush()
+
+    def close(self):
+        self._close_part()
+        write_master_file(self.output_file, self.part_files)
+
+    def prune_and_close(self, stop_pulse_id):
+        start_time = time()
+        _logger.info("Starting to close the file.")
+
+        self.close()
+        _logger.info("File closed in %s seconds.", time() - start_time)
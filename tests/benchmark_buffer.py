@@ -0,0 +1,83 @@
+import logging
+from collections import deque
+from threading import Thread, Event
+from time import sleep, time, process_time
+
+from sf_bsread_writer.ring_buffer import RingBuffer
+
+logging.basicConfig(format='%(asctime)s.%(msecs)03d %(levelname)-8s %(message)s',
+                    level=logging.INFO,
+                    datefmt='%Y-%m-%d %H:%M:%S')
+
+_logger = logging.getLogger(__name__)
+
+n_messages = 500
+message_period = 0.01
+idle_time = 5
+
+polling_timeout = 0.01
+blocking_timeout = 0.5
+
+
+def polling_consumer(message_buffer, running_event, latencies):
+    # The buffer hand-off as it was before the RingBuffer.
+    while running_event.is_set():
+
+        if len(message_buffer) == 0:
+            sleep(polling_timeout)
+            continue
+
+        latencies.append(time() - message_buffer.popleft())
+
+
+def blocking_consumer(message_buffer, running_event, latencies):
+    cursor = message_buffer.cursor()
+
+    while running_event.is_set():
+        append_time = message_buffer.read(cursor, timeout=blocking_timeout)
+
+        if append_time is None:
+            continue
+
+        latencies.append(time() - append_time)
+
+
+def run_benchmark(name, message_buffer, consumer):
+    running_event = Event()
+    running_event.set()
+
+    latencies = []
+
+    consumer_thread = Thread(target=consumer, args=(message_buffer, running_event, latencies))
+    consumer_thread.start()
+
+    for pulse_id in range(n_messages):
+        append_time = time()
+
+        if isinstance(message_buffer, RingBuffer):
+            message_buffer.append(pulse_id, append_time)
+        else:
+            message_buffer.append(append_time)
+
+        sleep(message_period)
+
+    # Measure the CPU time spent while there is no data in the stream.
+    start_cpu_time = process_time()
+    sleep(idle_time)
+    idle_cpu = (process_time() - start_cpu_time) / idle_time
+
+    running_event.clear()
+    consumer_thread.join()
+
+    latencies.sort()
+
+    _logger.info("%s: latency mean %.3f ms, p99 %.3f ms, max %.3f ms; idle CPU %.2f%%.",
+                 name,
+                 1000 * sum(latencies) / len(latencies),
+                 1000 * latencies[int(0.99 * len(latencies))],
+                 1000 * latencies[-1],
+                 100 * idle_cpu)
+
+
+run_benchmark("sleep polling (deque)", deque(maxlen=100), polling_consumer)
+run_benchmark("blocking hand-off (RingBuffer)", RingBuffer(maxlen=100), blocking_consumer)
@@ -0,0 +1,83 @@
+import logging
+import os
+from time import time
+
+import h5py
+import numpy
+
+from sf_bsread_writer.writer_format import get_chunk_shape
+
+logging.basicConfig(format='%(asctime)s.%(msecs)03d %(levelname)-8s %(message)s',
+                    level=logging.INFO,
+                    datefmt='%Y-%m-%d %H:%M:%S')
+
+_logger = logging.getLogger(__name__)
+
+output_file = "ignore_benchmark_chunks.h5"
+
+n_scalar_channels = 500
+n_scalar_messages = 10000
+
+image_shape = (1024, 1280)
+n_images = 100
+
+batch_size = 100
+
+
+def fixed_chunk_shape(dtype, row_shape):
+    # The chunking as it was before get_chunk_shape.
+    return (100,) + tuple(row_shape)
+
+
+def write_datasets(get_chunks, dtype, row_shape, n_channels, n_messages):
+    # Only the HDF5 part is measured - the rows are written in batches, as the writer flushes them.
+    n_batch_rows = min(batch_size, get_chunks(dtype, row_shape)[0])
+    batch = numpy.ones((n_batch_rows,) + row_shape, dtype=dtype)
+
+    start_time = time()
+
+    with h5py.File(output_file, "w") as file:
+        datasets = [file.create_dataset("/data/channel_%d/data" % channel_index, shape=(0,) + row_shape,
+                                        maxshape=(None,) + row_shape, dtype=dtype,
+                                        chunks=get_chunks(dtype, row_shape))
+                    for channel_index in range(n_channels)]
+
+        for n_rows in range(0, n_messages, n_batch_rows):
+            for dataset in datasets:
+                dataset.resize(n_rows + n_batch_rows, axis=0)
+                dataset[n_rows:] = batch
+
+    return time() - start_time
+
+
+def read_datasets(selection):
+    start_time = time()
+
+    with h5py.File(output_file, "r") as file:
+        for channel_name in file["/data"]:
+            file["/data/%s/data" % channel_name][selection]
+
+    return time() - start_time
+
+
+def run_benchmark(name, get_chunks, dtype, row_shape, n_channels, n_messages, selection):
+    write_time = write_datasets(get_chunks, dtype, row_shape, n_channels, n_messages)
+    file_size = os.path.getsize(output_file)
+    read_time = read_datasets(selection)
+
+    n_bytes = numpy.dtype(dtype).itemsize * int(numpy.prod(row_shape)) * n_channels * n_messages
+
+    _logger.info("%-40s chunk %-18s write %6.2f s (%7.1f MB/s), read %.4f s, file %.1f MB", name,
+                 get_chunks(dtype, row_shape), write_time, n_bytes / write_time / 1e6, read_time, file_size / 1e6)
+
+    os.remove(output_file)
+
+
+run_benchmark("Scalars, fixed chunks", fixed_chunk_shape, "f8", (1,), n_scalar_channels, n_scalar_messages,
+              numpy.s_[:])
+run_benchmark("Scalars, byte targeted chunks", get_chunk_shape, "f8", (1,), n_scalar_channels, n_scalar_messages,
+              numpy.s_[:])
+
+# Reading 1 image out of the file.
+run_benchmark("Images, fixed chunks", fixed_chunk_shape, "u2", image_shape, 1, n_images, numpy.s_[50])
+run_benchmark("Images, byte targeted chunks", get_chunk_shape, "u2", image_shape, 1, n_images, numpy.s_[50])
@@ -0,0 +1,77 @@
+import logging
+import os
+from time import time
+
+import h5py
+import numpy
+
+from sf_bsread_writer.writer_compression import ChunkCompressor, get_compression
+from sf_bsread_writer.writer_datasets import BatchedDataset, CompressedDataset
+from sf_bsread_writer.writer_format import get_chunk_shape
+
+logging.basicConfig(format='%(asctime)s.%(msecs)03d %(levelname)-8s %(message)s',
+                    level=logging.INFO,
+                    datefmt='%Y-%m-%d %H:%M:%S')
+
+_logger = logging.getLogger(__name__)
+
+output_file = "ignore_benchmark_compression.h5"
+
+image_shape = (1024, 1280)
+n_images = 200
+
+
+def get_images():
+    # Noise on top of a smooth background - compresses about like a camera image.
+    background = numpy.add.outer(numpy.arange(image_shape[0]), numpy.arange(image_shape[1])) % 1000
+    noise = numpy.random.poisson(5, size=(10,) + image_shape)
+
+    return [(background + noise[index % 10]).astype("u2") for index in range(n_images)]
+
+
+def run_benchmark(name, images, compression=None, n_workers=1):
+    compressor = None
+
+    start_time = time()
+
+    with h5py.File(output_file, "w") as file:
+        dtype = images[0].dtype
+        chunks = get_chunk_shape(dtype, image_shape)
+
+        if compression is None:
+            dataset = BatchedDataset(file.create_dataset("data", shape=(0,) + image_shape,
+                                                         maxshape=(None,) + image_shape,
+                                                         dtype=dtype, chunks=chunks), 1)
+        else:
+            compress, compression_arguments = get_compression(compression)
+            compressor = ChunkCompressor(n_workers)
+
+            dataset = CompressedDataset(file.create_dataset("data", shape=(0,) + image_shape,
+                                                            maxshape=(None,) + image_shape,
+                                                            dtype=dtype, chunks=chunks, **compression_arguments),
+                                        compressor, compress)
+
+        for image in images:
+            dataset.append(image)
+
+        dataset.flush()
+
+        if compressor is not None:
+            compressor.close()
+
+    write_time = time() - start_time
+    n_bytes = images[0].nbytes * n_images
+
+    _logger.info("%-30s write %6.2f s (%7.1f MB/s, %6.1f images/s), compression ratio %.2f", name, write_time,
+                 n_bytes / write_time / 1e6, n_images / write_time, n_bytes / os.path.getsize(output_file))
+
+    os.remove(output_file)
+
+
+images = get_images()
+
+run_benchmark("Uncompressed", images)
+
+for compression in ["bitshuffle_lz4", "gzip"]:
+    for n_workers in [1, 2, 4]:
+        run_benchmark("%s, %d workers" % (compression, n_workers), images, compression, n_workers)
@@ -1,8 +1,9 @@
+import json
 import signal
 import unittest
-from collections import deque
 
 from multiprocessing import Process, Event
+from threading import Thread
 from time import sleep
 
 import os
@@ -10,13 +11,15 @@ import os
 from bsread.sender import sender, PUSH, PULL
 
 from sf_bsread_writer import buffer
+from sf_bsread_writer.raw_message import get_message_pulse_id
+from sf_bsread_writer.ring_buffer import RingBuffer
 
 
 class TestBsreadBuffer(unittest.TestCase):
     def setUp(self):
         self.stream_port = 12345
 
-        self.buffer = deque(maxlen=10)
+        self.buffer = RingBuffer(maxlen=10)
 
         self.runningEvent = Event()
         self.runningEvent.set()
@@ -63,3 +66,65 @@ class TestBsreadBuffer(unittest.TestCase):
         sleep(1.5)
 
         self.assertFalse(self.buffer_process.is_alive())
+
+    def test_raw_forwarding(self):
+        self.buffer_process.terminate()
+        sleep(0.5)
+
+        message_buffer = RingBuffer(maxlen=10)
+
+        running_event = Event()
+        running_event.set()
+
+        buffer_thread = Thread(target=buffer.buffer_bsread_messages,
+                               args=("tcp://127.0.0.1:%d" % self.stream_port,
+                                     message_buffer,
+                                     running_event,
+                                     False,
+                                     1000,
+                                     PULL,
+                                     True))
+        buffer_thread.start()
+        sleep(1)
+
+        with sender(port=self.stream_port, mode=PUSH, queue_size=1) as output_stream:
+            for index in range(10):
+                output_stream.send(pulse_id=index, data={"device1": index})
+
+        sleep(0.5)
+        running_event.clear()
+        buffer_thread.join()
+
+        self.assertEqual(len(message_buffer), 10)
+
+        cursor = message_buffer.cursor()
+
+        for index in range(10):
+            pulse_id, frames, message_timestamp = message_buffer.read(cursor)
+            self.assertEqual(pulse_id, index)
+            self.assertEqual(get_message_pulse_id(frames), index)
+            # Main header, data header, and value and timestamp for 1 channel.
+            self.assertEqual(len(frames), 4)
+
+    def test_load_stream_config(self):
+        config_file = "ignore_buffer_config.json"
+
+        with open(config_file, "w") as output_file:
+            json.dump([{"stream": "tcp://127.0.0.1:8050", "output_port": 12300},
+                       {"stream": "tcp://127.0.0.1:8051", "output_port": [12301, 12302], "buffer_bytes": "1M"}],
+                      output_file)
+
+        try:
+            stream_buffers = buffer.load_stream_buffers(config_file, {"raw": True})
+        finally:
+            os.remove(config_file)
+
+        self.assertEqual(len(stream_buffers), 2)
+
+        self.assertEqual(stream_buffers[0].stream_address, "tcp://127.0.0.1:8050")
+        self.assertListEqual(stream_buffers[0].output_ports, [12300])
+        self.assertEqual(stream_buffers[0].message_buffer.maxlen, 100)
+        self.assertTrue(stream_buffers[0].raw_forwarding)
+
+        self.assertListEqual(stream_buffers[1].output_ports, [12301, 12302])
+        self.assertEqual(stream_buffers[1].message_buffer.max_bytes, 1024 ** 2)
@@ -0,0 +1,79 @@
+import json
+import unittest
+from collections import OrderedDict
+from threading import Event, Thread
+from time import sleep
+from types import SimpleNamespace
+
+from sf_bsread_writer.buffer_analyzer import StreamAnalyzer
+from sf_bsread_writer.ring_buffer import RingBuffer
+
+
+def get_raw_message(pulse_id, values):
+    main_header = {"htype": "bsr_m-1.1", "pulse_id": pulse_id, "hash": "test_hash"}
+    data_header = {"htype": "bsr_d-1.1", "channels": [{"name": name} for name in values]}
+
+    frames = [json.dumps(main_header).encode(), json.dumps(data_header).encode()]
+
+    for value in values.values():
+        frames.append(b"" if value is None else value)
+        frames.append(b"" if value is None else b"timestamp")
+
+    return frames
+
+
+class TestStreamAnalyzer(unittest.TestCase):
+
+    def test_raw_messages(self):
+        analyzer = StreamAnalyzer("test_stream", raw_forwarding=True)
+
+        for pulse_id in range(10):
+            values = OrderedDict([("always", b"1"),
+                                  ("never", None),
+                                  ("even", None if pulse_id % 2 else b"1")])
+
+            analyzer.analyze(get_raw_message(pulse_id, values))
+
+        report = analyzer.get_report()
+
+        self.assertEqual(report["n_analyzed"], 10)
+        self.assertEqual(report["n_channels"], 3)
+        self.assertEqual(report["n_channels_with_missing_data"], 2)
+        self.assertListEqual(list(report["missing_data"].items()), [("never", 10), ("even", 5)])
+
+    def test_decoded_messages(self):
+        analyzer = StreamAnalyzer("test_stream")
+
+        for pulse_id in range(4):
+            data = OrderedDict([("device1", SimpleNamespace(value=1)),
+                                ("device2", SimpleNamespace(value=None))])
+
+            analyzer.analyze(SimpleNamespace(data=SimpleNamespace(pulse_id=pulse_id, data=data)))
+
+        # A change of channels resets the counters.
+        data = OrderedDict([("device1", SimpleNamespace(value=None))])
+        analyzer.analyze(SimpleNamespace(data=SimpleNamespace(pulse_id=4, data=data)))
+
+        report = analyzer.get_report()
+        self.assertEqual(report["n_analyzed"], 1)
+        self.assertDictEqual(report["missing_data"], {"device1": 1})
+
+    def test_sampling(self):
+        message_buffer = RingBuffer(maxlen=100)
+        analyzer = StreamAnalyzer("test_stream", raw_forwarding=True, sampling=3)
+
+        for pulse_id in range(9):
+            frames = get_raw_message(pulse_id, {"device1": b"1"})
+            message_buffer.append(pulse_id, (pulse_id, frames, 0))
+
+        running_event = Event()
+        running_event.set()
+
+        analyzer_thread = Thread(target=analyzer.run, args=(message_buffer, running_event, 0.1))
+        analyzer_thread.start()
+
+        sleep(0.3)
+        running_event.clear()
+        analyzer_thread.join()
+
+        self.assertEqual(analyzer.n_analyzed, 3)
@@ -0,0 +1,58 @@
+import shutil
+import tempfile
+import unittest
+
+from sf_bsread_writer.buffer_storage import MmapRingBuffer
+
+
+class TestMmapRingBuffer(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix="ignore_buffer_storage")
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_store_and_load(self):
+        ring_buffer = MmapRingBuffer(self.folder, segment_size=1000, n_segments=3)
+        cursor = ring_buffer.cursor()
+
+        for pulse_id in range(5):
+            frames = [b"header_%d" % pulse_id, b"data_header", b"value_%d" % pulse_id, b""]
+            ring_buffer.append(pulse_id, (pulse_id, frames, 0.5 * pulse_id), sum(len(frame) for frame in frames))
+
+        for pulse_id in range(5):
+            loaded_pulse_id, frames, message_timestamp = ring_buffer.read(cursor)
+
+            self.assertEqual(loaded_pulse_id, pulse_id)
+            self.assertEqual(message_timestamp, 0.5 * pulse_id)
+            self.assertListEqual([frame.bytes for frame in frames],
+                                 [b"header_%d" % pulse_id, b"data_header", b"value_%d" % pulse_id, b""])
+
+        ring_buffer.close()
+
+    def test_segment_recycling(self):
+        ring_buffer = MmapRingBuffer(self.folder, segment_size=100, n_segments=2)
+        cursor = ring_buffer.cursor()
+
+        # 2 messages fit in one segment, the 5th message overwrites the first segment.
+        for pulse_id in range(5):
+            frame = bytes([pulse_id]) * 40
+            ring_buffer.append(pulse_id, (pulse_id, [frame], 0), len(frame))
+
+        self.assertEqual(ring_buffer.n_evicted, 2)
+        self.assertEqual(len(ring_buffer), 3)
+
+        for pulse_id in range(2, 5):
+            loaded_pulse_id, frames, _ = ring_buffer.read(cursor)
+
+            self.assertEqual(loaded_pulse_id, pulse_id)
+            self.assertEqual(frames[0].bytes, bytes([pulse_id]) * 40)
+
+        self.assertEqual(cursor.n_dropped, 2)
+
+        # Too big messages are dropped.
+        ring_buffer.append(5, (5, [b"x" * 101], 0), 101)
+        self.assertEqual(len(ring_buffer), 3)
+
+        ring_buffer.close()
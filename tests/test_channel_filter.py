@@ -0,0 +1,64 @@
+import unittest
+
+import json
+
+from sf_bsread_writer.channel_filter import ChannelFilter, receive_selected_channels
+from sf_bsread_writer.raw_message import get_data_header, get_main_header, receive_raw_message
+from tests.test_raw_message import FramesReceiver
+
+CHANNEL_NAMES = ["CAMERA:FPICTURE", "CAMERA:WIDTH", "BPM1:X", "BPM1:Y", "BPM2:X"]
+
+
+def get_frames(pulse_id):
+    data_header = {"htype": "bsr_d-1.1", "channels": [{"name": name, "type": "int64"} for name in CHANNEL_NAMES]}
+    frames = [json.dumps({"pulse_id": pulse_id, "hash": "original"}).encode(), json.dumps(data_header).encode()]
+
+    for name in CHANNEL_NAMES:
+        frames += [(name + " value").encode(), (name + " timestamp").encode()]
+
+    return frames
+
+
+class TestChannelFilter(unittest.TestCase):
+
+    def test_select_channels(self):
+        channel_filter = ChannelFilter(include=["BPM*", "CAMERA:WIDTH"], exclude=["*:Y"])
+
+        self.assertListEqual([name for name in CHANNEL_NAMES if channel_filter.is_selected(name)],
+                             ["CAMERA:WIDTH", "BPM1:X", "BPM2:X"])
+
+        self.assertTrue(ChannelFilter().is_selected("CAMERA:FPICTURE"))
+        self.assertFalse(ChannelFilter(exclude=["CAMERA:*"]).is_selected("CAMERA:FPICTURE"))
+
+        with self.assertRaises(ValueError):
+            ChannelFilter(include="BPM*")
+
+    def test_filter_frames(self):
+        channel_filter = ChannelFilter(exclude=["CAMERA:*"])
+
+        for pulse_id in range(3):
+            frames = channel_filter.filter_frames(get_frames(pulse_id))
+
+            channels = [channel["name"] for channel in get_data_header(frames)["channels"]]
+            self.assertListEqual(channels, ["BPM1:X", "BPM1:Y", "BPM2:X"])
+
+            self.assertEqual(get_main_header(frames)["pulse_id"], pulse_id)
+            self.assertNotEqual(get_main_header(frames)["hash"], "original")
+
+            self.assertListEqual(frames[2:], [frame for frame in get_frames(pulse_id)[6:]])
+
+    def test_receive_selected_channels(self):
+        channel_filter = ChannelFilter(include=["CAMERA:WIDTH", "BPM2:X"])
+
+        receiver = FramesReceiver(get_frames(0))
+        frames = receive_selected_channels(receiver, receive_raw_message, channel_filter)
+
+        # All the frames are received, but only the selected ones are given to the handler.
+        self.assertFalse(receiver.has_more())
+        self.assertListEqual(frames, channel_filter.filter_frames(get_frames(0)))
+        self.assertListEqual(frames[2:], [b"CAMERA:WIDTH value", b"CAMERA:WIDTH timestamp",
+                                          b"BPM2:X value", b"BPM2:X timestamp"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import unittest
+from types import SimpleNamespace
+
+from sf_bsread_writer.buffer_rest import BufferStatistics
+from sf_bsread_writer.metrics import Histogram, PrometheusText
+from sf_bsread_writer.ring_buffer import RingBuffer
+from sf_bsread_writer.writer_metrics import WriterMetrics
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_histogram(self):
+        histogram = Histogram(buckets=(0.001, 0.01, 0.1))
+
+        for value in [0.0005] * 50 + [0.005] * 40 + [0.05] * 9 + [1]:
+            histogram.observe(value)
+
+        self.assertEqual(histogram.count, 100)
+        self.assertListEqual(histogram.get_cumulative_counts(),
+                             [(0.001, 50), (0.01, 90), (0.1, 99), (float("inf"), 100)])
+
+        self.assertEqual(histogram.get_percentile(50), 0.001)
+        self.assertEqual(histogram.get_percentile(90), 0.01)
+        self.assertEqual(histogram.get_percentile(99), 0.1)
+        self.assertEqual(histogram.get_percentile(100), float("inf"))
+
+    def test_prometheus_grouping(self):
+        metrics = PrometheusText()
+
+        metrics.add("first", 1, {"stream": "a"}, "counter")
+        metrics.add("second", 2, {"stream": "a"})
+        metrics.add("first", 3, {"stream": "b"}, "counter")
+
+        self.assertEqual(metrics.get_text(), '# TYPE first counter\n'
+                                             'first{stream="a"} 1\n'
+                                             'first{stream="b"} 3\n'
+                                             '# TYPE second gauge\n'
+                                             'second{stream="a"} 2\n')
+
+    def test_buffer_statistics(self):
+        message_buffer = RingBuffer(maxlen=5)
+        cursor = message_buffer.cursor(12300)
+
+        for pulse_id in range(10):
+            message_buffer.append(pulse_id, pulse_id, n_bytes=100)
+
+        message_buffer.read(cursor)
+
+        latency_histogram = Histogram()
+        latency_histogram.observe(0.002)
+
+        stream_buffer = SimpleNamespace(stream_address="tcp://localhost:9999",
+                                        message_buffer=message_buffer,
+                                        latency_histograms={12300: latency_histogram},
+                                        analyzer=None)
+
+        statistics = BufferStatistics([stream_buffer])
+
+        stream_statistics = statistics.get_statistics()[0]
+        self.assertEqual(stream_statistics["messages_received"], 10)
+        self.assertEqual(stream_statistics["bytes_received"], 1000)
+        self.assertEqual(stream_statistics["occupancy_messages"], 5)
+        self.assertEqual(stream_statistics["occupancy_bytes"], 500)
+        self.assertEqual(stream_statistics["messages_evicted"], 5)
+
+        consumer_statistics = stream_statistics["consumers"]["12300"]
+        self.assertEqual(consumer_statistics["messages_sent"], 1)
+        self.assertEqual(consumer_statistics["messages_dropped"], 5)
+        self.assertEqual(consumer_statistics["messages_behind"], 4)
+        self.assertEqual(consumer_statistics["latency"]["count"], 1)
+
+        prometheus_text = statistics.get_prometheus_text()
+        self.assertIn('sf_bsread_buffer_received_messages_total{stream="tcp://localhost:9999"} 10', prometheus_text)
+        self.assertIn('sf_bsread_buffer_dropped_messages_total{stream="tcp://localhost:9999",consumer="12300"} 5',
+                      prometheus_text)
+        self.assertIn('sf_bsread_buffer_send_latency_seconds_bucket{stream="tcp://localhost:9999",consumer="12300",'
+                      'le="0.005"} 1', prometheus_text)
+
+    def test_writer_metrics(self):
+        metrics = WriterMetrics()
+
+        # Pulses 13 and 14, and 17 are lost.
+        for pulse_id in [10, 11, 12, 15, 16, 18]:
+            metrics.count("messages_received")
+            metrics.count_pulse_id(pulse_id)
+
+        metrics.stage_histograms["write"].observe(0.0002)
+
+        statistics = metrics.get_statistics()
+        self.assertEqual(statistics["messages_received"], 6)
+        self.assertEqual(statistics["pulse_id_gaps"], 2)
+        self.assertEqual(statistics["pulse_ids_missing"], 3)
+        self.assertEqual(statistics["stages"]["write"]["count"], 1)
+        self.assertEqual(statistics["stages"]["write"]["p50"], 0.0005)
+        self.assertIsNone(statistics["stages"]["flush"]["p50"])
+
+        prometheus_text = metrics.get_prometheus_text([("sf_bsread_writer_write_queue_length", 3)])
+        self.assertIn("sf_bsread_writer_write_queue_length 3", prometheus_text)
+        self.assertIn("sf_bsread_writer_pulse_ids_missing_total 3", prometheus_text)
+        self.assertIn('sf_bsread_writer_stage_seconds_bucket{stage="write",le="0.0005"} 1', prometheus_text)
@@ -0,0 +1,46 @@
+import unittest
+
+import json
+
+from sf_bsread_writer.raw_message import HeaderFilter, receive_raw_message
+
+
+class FramesReceiver(object):
+    def __init__(self, frames):
+        self.frames = list(frames)
+
+    def next(self, as_json=False):
+        frame = self.frames.pop(0)
+        return json.loads(frame.decode()) if as_json else frame
+
+    def has_more(self):
+        return len(self.frames) > 0
+
+
+def get_frames(pulse_id):
+    return [json.dumps({"pulse_id": pulse_id}).encode(), b"data_header", b"value"]
+
+
+class TestHeaderFilter(unittest.TestCase):
+
+    def test_skip_messages(self):
+        header_filter = HeaderFilter(receive_raw_message, lambda main_header: main_header["pulse_id"] >= 10)
+
+        receivers = [FramesReceiver(get_frames(pulse_id)) for pulse_id in range(5, 15)]
+        messages = [header_filter.receive(receiver) for receiver in receivers]
+
+        # The skipped messages are drained, but only their main header is returned.
+        self.assertListEqual(messages[:5], [{"header": {"pulse_id": pulse_id}} for pulse_id in range(5, 10)])
+        self.assertTrue(all(not receiver.has_more() for receiver in receivers))
+
+        # The decoded messages get the already received main header as the first frame.
+        self.assertListEqual(messages[5:], [get_frames(pulse_id) for pulse_id in range(10, 15)])
+
+        statistics = header_filter.get_statistics()
+        self.assertEqual(statistics["n_decoded"], 5)
+        self.assertEqual(statistics["n_skipped"], 5)
+        self.assertIsNotNone(statistics["skipped_decode_time"])
+
+
+if __name__ == '__main__':
+    unittest.main()
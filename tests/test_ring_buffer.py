@@ -0,0 +1,166 @@
+import unittest
+from threading import Thread
+from time import sleep, time
+
+from sf_bsread_writer.ring_buffer import RingBuffer
+
+
+class TestRingBuffer(unittest.TestCase):
+
+    def test_drop_oldest(self):
+        ring_buffer = RingBuffer(maxlen=3)
+        cursor = ring_buffer.cursor()
+
+        for index in range(5):
+            ring_buffer.append(index, "message_%d" % index)
+
+        self.assertEqual(len(ring_buffer), 3)
+        self.assertEqual(ring_buffer.n_evicted, 2)
+
+        self.assertListEqual([ring_buffer.read(cursor) for _ in range(3)], ["message_2", "message_3", "message_4"])
+        self.assertEqual(cursor.n_dropped, 2)
+        self.assertEqual(cursor.n_read, 3)
+
+    def test_read_timeout(self):
+        ring_buffer = RingBuffer(maxlen=3)
+        cursor = ring_buffer.cursor()
+
+        start_time = time()
+        self.assertIsNone(ring_buffer.read(cursor, timeout=0.1))
+        self.assertGreaterEqual(time() - start_time, 0.1)
+
+    def test_read_wakes_up(self):
+        ring_buffer = RingBuffer(maxlen=3)
+        cursor = ring_buffer.cursor()
+        received = []
+
+        def consume():
+            received.append((ring_buffer.read(cursor, timeout=5), time()))
+
+        consumer_thread = Thread(target=consume)
+        consumer_thread.start()
+
+        sleep(0.2)
+        append_time = time()
+        ring_buffer.append(0, "message")
+
+        consumer_thread.join()
+
+        item, receive_time = received[0]
+        self.assertEqual(item, "message")
+        self.assertLess(receive_time - append_time, 0.05)
+
+    def test_find_and_seek(self):
+        ring_buffer = RingBuffer(maxlen=100)
+        cursor = ring_buffer.cursor()
+
+        # Pulse_ids do not need to be consecutive.
+        for pulse_id in range(0, 200, 10):
+            ring_buffer.append(pulse_id, pulse_id)
+
+        self.assertEqual(ring_buffer.find(50), 5)
+        self.assertEqual(ring_buffer.find(55), 6)
+        self.assertEqual(ring_buffer.find(-1), 0)
+        self.assertEqual(ring_buffer.find(1000), 20)
+
+        self.assertEqual(ring_buffer.seek(cursor, 55), 60)
+        self.assertEqual(ring_buffer.read(cursor), 60)
+        self.assertEqual(ring_buffer.read(cursor), 70)
+
+        # Replay an already sent message.
+        self.assertEqual(ring_buffer.seek(cursor, 10), 10)
+        self.assertEqual(ring_buffer.read(cursor), 10)
+
+        # Future pulse_id - the next appended message is read.
+        self.assertIsNone(ring_buffer.seek(cursor, 1000))
+        ring_buffer.append(1000, 1000)
+        self.assertEqual(ring_buffer.read(cursor), 1000)
+
+    def test_pulse_id_reset(self):
+        ring_buffer = RingBuffer(maxlen=10)
+
+        for pulse_id in [100000, 100001, 100002, 0, 1]:
+            ring_buffer.append(pulse_id, pulse_id)
+
+        self.assertEqual(len(ring_buffer), 2)
+        self.assertEqual(ring_buffer.n_evicted, 3)
+        self.assertEqual(ring_buffer.find(1), 4)
+
+    def test_out_of_order(self):
+        ring_buffer = RingBuffer(maxlen=10)
+        cursor = ring_buffer.cursor()
+
+        for pulse_id in [10, 11, 12, 13, 15, 14, 16]:
+            ring_buffer.append(pulse_id, pulse_id)
+
+        # Only a large step back is a pulse_id reset - no message is dropped.
+        self.assertListEqual([ring_buffer.read(cursor) for _ in range(7)], [10, 11, 12, 13, 15, 14, 16])
+        self.assertEqual(cursor.n_dropped, 0)
+        self.assertEqual(ring_buffer.n_evicted, 0)
+
+        self.assertEqual(ring_buffer.find(12), 2)
+        self.assertEqual(ring_buffer.find(14), 4)
+        self.assertEqual(ring_buffer.find(16), 6)
+        self.assertEqual(ring_buffer.find(17), 7)
+
+    def test_out_of_order_eviction(self):
+        ring_buffer = RingBuffer(maxlen=3)
+        cursor = ring_buffer.cursor()
+
+        for pulse_id in [10, 15, 12, 13, 16]:
+            ring_buffer.append(pulse_id, pulse_id)
+
+        # Pulse_id 15 was evicted - the replay from 14 starts early, without skipping pulse_id 16.
+        self.assertEqual(ring_buffer.seek(cursor, 14), 12)
+        self.assertListEqual([ring_buffer.read(cursor) for _ in range(3)], [12, 13, 16])
+
+        self.assertEqual(ring_buffer.find(16), 4)
+        self.assertEqual(ring_buffer.find(17), 5)
+
+    def test_bytes_budget(self):
+        ring_buffer = RingBuffer(max_bytes=1000)
+        cursor = ring_buffer.cursor()
+
+        for pulse_id in range(10):
+            ring_buffer.append(pulse_id, pulse_id, n_bytes=300)
+
+        self.assertEqual(len(ring_buffer), 3)
+        self.assertEqual(ring_buffer.n_bytes, 900)
+        self.assertEqual(ring_buffer.n_evicted, 7)
+
+        # A message bigger than the budget evicts everything else.
+        ring_buffer.append(10, 10, n_bytes=5000)
+        self.assertEqual(len(ring_buffer), 1)
+        self.assertEqual(ring_buffer.n_bytes, 5000)
+
+        self.assertEqual(ring_buffer.read(cursor), 10)
+        self.assertEqual(cursor.n_dropped, 10)
+
+    def test_grow_without_maxlen(self):
+        ring_buffer = RingBuffer(max_bytes=10 ** 9)
+        cursor = ring_buffer.cursor()
+
+        for pulse_id in range(5000):
+            ring_buffer.append(pulse_id, pulse_id, n_bytes=1)
+
+        self.assertEqual(len(ring_buffer), 5000)
+        self.assertEqual(ring_buffer.find(4000), 4000)
+        self.assertListEqual([ring_buffer.read(cursor) for _ in range(5000)], list(range(5000)))
+
+    def test_independent_cursors(self):
+        ring_buffer = RingBuffer(maxlen=5)
+
+        fast_cursor = ring_buffer.cursor("fast")
+        slow_cursor = ring_buffer.cursor("slow")
+
+        for pulse_id in range(10):
+            ring_buffer.append(pulse_id, pulse_id)
+            self.assertEqual(ring_buffer.read(fast_cursor), pulse_id)
+
+        # The slow consumer only lost the evicted messages, the fast one got everything.
+        self.assertListEqual([ring_buffer.read(slow_cursor) for _ in range(5)], list(range(5, 10)))
+        self.assertEqual(slow_cursor.n_dropped, 5)
+        self.assertEqual(fast_cursor.n_dropped, 0)
+        self.assertEqual(fast_cursor.n_read, 10)
+
+        self.assertListEqual([cursor.name for cursor in ring_buffer.cursors], ["fast", "slow"])
@@ -2,11 +2,15 @@ import signal
 import unittest
 
 from multiprocessing import Process
-from time import sleep
+from threading import Thread
+from time import sleep, time
+from types import SimpleNamespace
 
 import os
 
+import h5py
 import requests
+import zmq
 from bsread.sender import sender, PUSH
 
 from sf_bsread_writer import writer
@@ -101,3 +105,298 @@ class TestBsreadWriter(unittest.TestCase):
         sleep(0.5)
         self.assertFalse(self.writer_process.is_alive())
 
+
+class TestBsreadWriterDaemon(unittest.TestCase):
+    def setUp(self):
+        self.rest_port = 10003
+        self.stream_port = 12346
+        self.output_files = ["ignore_daemon_1.h5", "ignore_daemon_2.h5"]
+
+        self.writer_process = Process(target=writer.start_server, args=("tcp://127.0.0.1:%d" % self.stream_port,
+                                                                        "ignore_daemon.h5",
+                                                                        -1,
+                                                                        self.rest_port),
+                                      kwargs={"daemon": True})
+
+        self.rest_url = "http://localhost:%d/" % self.rest_port
+        self.writer_process.start()
+
+        # Give it some time to start.
+        sleep(1)
+
+    def tearDown(self):
+        self.writer_process.terminate()
+        sleep(0.5)
+
+        for output_file in self.output_files:
+            try:
+                os.remove(output_file)
+            except:
+                pass
+
+    def test_multiple_acquisitions(self):
+        parameters = {"general/created": "today",
+                      "general/user": "p11057",
+                      "general/process": "dia",
+                      "general/instrument": "jungfrau"}
+
+        requests.post(self.rest_url + "parameters", json=parameters)
+
+        with sender(port=self.stream_port, mode=PUSH, queue_size=1) as output_stream:
+
+            for output_file, start_pulse_id in zip(self.output_files, [10, 40]):
+                response = requests.put(self.rest_url + "acquire", json={"output_file": output_file,
+                                                                         "start_pulse_id": start_pulse_id,
+                                                                         "stop_pulse_id": start_pulse_id + 9}).json()
+                self.assertEqual(response["state"], "ok")
+                self.assertEqual(response["status"], "writing")
+
+                for pulse_id in range(start_pulse_id - 5, start_pulse_id + 15):
+                    output_stream.send(pulse_id=pulse_id, data={"device1": pulse_id})
+
+                sleep(0.5)
+
+                # Back to idle, with the process still alive.
+                response = requests.get(self.rest_url + "status").json()
+                self.assertEqual(response["status"], "waiting")
+                self.assertTrue(self.writer_process.is_alive())
+
+        acquisitions = requests.get(self.rest_url + "statistics").json()["statistics"]["acquisitions"]
+
+        self.assertEqual(len(acquisitions), 2)
+        self.assertListEqual([acquisition["output_file"] for acquisition in acquisitions], self.output_files)
+        self.assertListEqual([acquisition["n_messages"] for acquisition in acquisitions], [10, 10])
+
+        metrics = requests.get(self.rest_url + "statistics").json()["statistics"]["metrics"]
+
+        self.assertEqual(metrics["messages_written"], 20)
+        self.assertEqual(metrics["messages_discarded_early"], 10)
+        self.assertEqual(metrics["stages"]["write"]["count"], 20)
+
+        prometheus_text = requests.get(self.rest_url + "metrics").text
+        self.assertIn("sf_bsread_writer_messages_written_total 20", prometheus_text)
+
+    def test_stop_after_stream_end(self):
+        parameters = {"general/created": "today",
+                      "general/user": "p11057",
+                      "general/process": "dia",
+                      "general/instrument": "jungfrau"}
+
+        requests.post(self.rest_url + "parameters", json=parameters)
+        requests.put(self.rest_url + "acquire", json={"output_file": self.output_files[0], "start_pulse_id": 0})
+
+        with sender(port=self.stream_port, mode=PUSH, queue_size=1) as output_stream:
+            for pulse_id in range(10):
+                output_stream.send(pulse_id=pulse_id, data={"device1": pulse_id})
+
+        sleep(0.5)
+
+        # The stream has ended - the file is closed without waiting for another message.
+        requests.put(self.rest_url + "stop_pulse_id/9")
+        sleep(0.1)
+
+        response = requests.get(self.rest_url + "status").json()
+        self.assertEqual(response["status"], "waiting")
+
+        acquisitions = requests.get(self.rest_url + "statistics").json()["statistics"]["acquisitions"]
+
+        self.assertEqual(acquisitions[-1]["n_messages"], 10)
+        self.assertLess(acquisitions[-1]["stop_latency"], 0.1)
+
+    def test_stop_now_message_on_the_way(self):
+        parameters = {"general/created": "today",
+                      "general/user": "p11057",
+                      "general/process": "dia",
+                      "general/instrument": "jungfrau"}
+
+        requests.post(self.rest_url + "parameters", json=parameters)
+        requests.put(self.rest_url + "acquire", json={"output_file": self.output_files[0]})
+
+        with sender(port=self.stream_port, mode=PUSH, queue_size=1) as output_stream:
+            sleep(0.2)
+
+            for pulse_id in range(5):
+                output_stream.send(timestamp=time(), pulse_id=pulse_id, data={"device1": pulse_id})
+
+            sleep(0.2)
+
+            # Stamped before the stop, but received after it.
+            message_timestamp = time()
+            requests.put(self.rest_url + "stop_now")
+            output_stream.send(timestamp=message_timestamp, pulse_id=5, data={"device1": 5})
+
+            sleep(0.5)
+
+        response = requests.get(self.rest_url + "status").json()
+        self.assertEqual(response["status"], "waiting")
+
+        acquisitions = requests.get(self.rest_url + "statistics").json()["statistics"]["acquisitions"]
+        self.assertEqual(acquisitions[-1]["n_messages"], 6)
+
+
+class TestBsreadWriterArmed(unittest.TestCase):
+    def setUp(self):
+        self.rest_port = 10004
+        self.stream_port = 12347
+        self.output_file = "ignore_armed.h5"
+
+        self.writer_process = Process(target=writer.start_server, args=("tcp://127.0.0.1:%d" % self.stream_port,
+                                                                        self.output_file,
+                                                                        -1,
+                                                                        self.rest_port),
+                                      kwargs={"armed": True})
+
+        self.rest_url = "http://localhost:%d/" % self.rest_port
+        self.writer_process.start()
+
+        # Give it some time to start.
+        sleep(1)
+
+    def tearDown(self):
+        self.writer_process.terminate()
+        sleep(0.5)
+
+        try:
+            os.remove(self.output_file)
+        except:
+            pass
+
+    def test_armed_start(self):
+        parameters = {"general/created": "today",
+                      "general/user": "p11057",
+                      "general/process": "dia",
+                      "general/instrument": "jungfrau"}
+
+        requests.post(self.rest_url + "parameters", json=parameters)
+
+        response = requests.get(self.rest_url + "status").json()
+        self.assertEqual(response["status"], "armed")
+
+        with sender(port=self.stream_port, mode=PUSH, queue_size=1) as output_stream:
+
+            # Messages before the start are received and discarded.
+            for pulse_id in range(10):
+                output_stream.send(pulse_id=pulse_id, data={"device1": pulse_id})
+
+            requests.put(self.rest_url + "start_pulse_id/10")
+            requests.put(self.rest_url + "stop_pulse_id/14")
+
+            for pulse_id in range(10, 20):
+                output_stream.send(pulse_id=pulse_id, data={"device1": pulse_id})
+
+        sleep(0.5)
+        self.assertFalse(self.writer_process.is_alive())
+
+        file = h5py.File(self.output_file)
+        self.assertListEqual(list(file["/data/device1/pulse_id"]), list(range(10, 15)))
+        file.close()
+
+
+class SlowWriter(object):
+    def __init__(self, write_time):
+        self.write_time = write_time
+        self.written_pulse_ids = []
+        self.closed_at_pulse_id = None
+
+    def write_message(self, message):
+        sleep(self.write_time)
+        self.written_pulse_ids.append(message.data["header"]["pulse_id"])
+
+    def prune_and_close(self, stop_pulse_id):
+        self.closed_at_pulse_id = stop_pulse_id
+
+
+class TestWriteQueue(unittest.TestCase):
+    def test_slow_storage(self):
+        manager = writer.BsreadWriterManager("tcp://127.0.0.1:12345", "ignore_bsread.h5", write_queue_length=5)
+        manager.stop_pulse_id = 19
+
+        slow_writer = SlowWriter(write_time=0.01)
+        manager._start_write_queue(slow_writer)
+
+        for pulse_id in range(20):
+            manager._queue_message(SimpleNamespace(data={"header": {"pulse_id": pulse_id}}))
+
+        manager._stop_writing()
+
+        self.assertListEqual(slow_writer.written_pulse_ids, list(range(20)))
+        self.assertEqual(slow_writer.closed_at_pulse_id, 19)
+
+        statistics = manager.get_statistics()
+        self.assertEqual(statistics["write_queue_size"], 5)
+        self.assertEqual(statistics["write_queue_max_fill"], 5)
+        self.assertGreater(statistics["n_write_queue_full"], 0)
+
+
+class TestAcquisitionStop(unittest.TestCase):
+    def test_stop_below_previous_pulse_id(self):
+        manager = writer.BsreadWriterManager("tcp://127.0.0.1:12345", "/dev/null")
+        manager.last_pulse_id = 300
+
+        # Acquisitions on request need a connected stream.
+        manager._stream_thread = SimpleNamespace(is_alive=lambda: True)
+
+        # Replay of an earlier range - the last pulse_id of the previous acquisition does not stop it.
+        manager.acquire("/dev/null", start_pulse_id=100, stop_pulse_id=150)
+        manager._process_message(None)
+
+        self.assertTrue(manager._running_event.is_set())
+
+        manager._update_last_message({"pulse_id": 150, "global_timestamp": {"sec": 0, "ns": 0}})
+        manager._process_message(None)
+
+        self.assertFalse(manager._running_event.is_set())
+        manager._close_output_file()
+
+
+class TestBufferReplay(unittest.TestCase):
+    def setUp(self):
+        self.request_port = 12348
+        self.replay_requests = []
+
+        # The buffer has the past pulses from 100 on.
+        self.request_socket = zmq.Context.instance().socket(zmq.REP)
+        self.request_socket.bind("tcp://127.0.0.1:%d" % self.request_port)
+
+        def serve_request():
+            self.replay_requests.append(self.request_socket.recv_json())
+            self.request_socket.send_json({"state": "ok", "status": "Replaying from pulse_id 100.", "pulse_id": 100})
+
+        self.buffer_thread = Thread(target=serve_request)
+        self.buffer_thread.start()
+
+    def tearDown(self):
+        self.buffer_thread.join()
+        self.request_socket.close(linger=0)
+
+    def test_past_start_pulse_id(self):
+        manager = writer.BsreadWriterManager("tcp://127.0.0.1:12345", "/dev/null",
+                                             buffer_request_address="tcp://127.0.0.1:%d" % self.request_port)
+
+        # Acquisitions on request need a connected stream.
+        manager._stream_thread = SimpleNamespace(is_alive=lambda: True)
+        manager.acquire("/dev/null", start_pulse_id=100, stop_pulse_id=109)
+
+        self.assertListEqual(self.replay_requests, [{"start_pulse_id": 100, "output_port": 12345}])
+
+        # The live messages sent before the replay are past the stop - they do not end the acquisition.
+        for pulse_id in [150, 151] + list(range(100, 105)) + [103] + list(range(105, 110)):
+            manager._process_message(SimpleNamespace(data={"header": {"pulse_id": pulse_id,
+                                                                      "global_timestamp": {"sec": 0, "ns": 0}},
+                                                           "data": [pulse_id]}))
+
+            if pulse_id == 151:
+                manager._process_message(None)
+                self.assertTrue(manager._running_event.is_set())
+
+        manager._process_message(None)
+
+        self.assertFalse(manager._running_event.is_set())
+        manager._close_output_file()
+
+        acquisition = manager.acquisitions[-1]
+        self.assertEqual(acquisition["first_pulse_id"], 100)
+        self.assertEqual(acquisition["n_messages"], 10)
+
+        self.assertEqual(manager.metrics.counters["messages_discarded_out_of_order"], 3)
+        self.assertEqual(manager.metrics.counters["messages_discarded_late"], 0)
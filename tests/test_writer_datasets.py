@@ -0,0 +1,153 @@
+import unittest
+
+import h5py
+import numpy
+import os
+
+from sf_bsread_writer.writer_compression import ChunkCompressor, get_compression
+from sf_bsread_writer.writer_datasets import BatchedColumns, BatchedDataset, BatchedTable, CompressedDataset, \
+    PresenceBitmap, create_presence_bitmap_dataset, get_free_dataset_name, read_presence_bitmap
+
+
+class TestWriterDatasets(unittest.TestCase):
+
+    OUTPUT_FILE = "ignore_writer_datasets.h5"
+
+    def setUp(self):
+        self.file = h5py.File(self.OUTPUT_FILE, "w")
+
+    def tearDown(self):
+        self.file.close()
+
+        try:
+            os.remove(self.OUTPUT_FILE)
+        except:
+            pass
+
+    def test_batched_dataset(self):
+        dataset = self.file.create_dataset("data", shape=(0, 2), maxshape=(None, 2), dtype="i4", chunks=(10, 2))
+        batched_dataset = BatchedDataset(dataset, batch_size=10)
+
+        for index in range(25):
+            batched_dataset.append(None if index % 5 == 0 else [index, index])
+
+        # Only full batches are written before the flush.
+        self.assertEqual(dataset.shape, (20, 2))
+
+        batched_dataset.flush()
+        self.assertEqual(dataset.shape, (25, 2))
+
+        expected_values = [[0, 0] if index % 5 == 0 else [index, index] for index in range(25)]
+        self.assertListEqual(dataset[:].tolist(), expected_values)
+
+    def test_batched_strings(self):
+        dataset = self.file.create_dataset("data", shape=(2,), maxshape=(None,), chunks=(10,),
+                                           dtype=h5py.special_dtype(vlen=str))
+        batched_dataset = BatchedDataset(dataset, batch_size=10)
+
+        batched_dataset.append("first")
+        batched_dataset.append(None)
+        batched_dataset.flush()
+
+        self.assertListEqual(list(dataset.asstr()[:]), ["", "", "first", ""])
+
+    def test_compressed_dataset(self):
+        compress, compression_arguments = get_compression("gzip")
+        compressor = ChunkCompressor(n_workers=2)
+
+        # 10 rows per chunk, each row split in 2 chunks - the second one at the edge of the dataset.
+        dataset = self.file.create_dataset("data", shape=(0, 5), maxshape=(None, 5), dtype="i4", chunks=(10, 3),
+                                           **compression_arguments)
+        compressed_dataset = CompressedDataset(dataset, compressor, compress)
+
+        for index in range(15):
+            compressed_dataset.append([index] * 5)
+
+        # The partially filled chunk is written again once it is complete.
+        compressed_dataset.flush()
+        compressor.flush()
+        self.assertEqual(dataset.shape, (15, 5))
+
+        for index in range(15, 25):
+            compressed_dataset.append(None if index == 20 else [index] * 5)
+
+        compressed_dataset.flush()
+        compressor.close()
+
+        expected_values = [[0] * 5 if index == 20 else [index] * 5 for index in range(25)]
+        self.assertListEqual(dataset[:].tolist(), expected_values)
+
+    def test_compressed_dataset_added_later(self):
+        compress, compression_arguments = get_compression("gzip")
+        compressor = ChunkCompressor(n_workers=2)
+
+        # 3 rows were written before the channel had data.
+        dataset = self.file.create_dataset("data", shape=(3, 2), maxshape=(None, 2), dtype="u2", chunks=(4, 2),
+                                           **compression_arguments)
+        compressed_dataset = CompressedDataset(dataset, compressor, compress)
+
+        for index in range(3, 10):
+            compressed_dataset.append([index] * 2)
+
+        compressed_dataset.flush()
+        compressor.close()
+
+        expected_values = [[0] * 2 if index < 3 else [index] * 2 for index in range(10)]
+        self.assertListEqual(dataset[:].tolist(), expected_values)
+
+    def test_batched_columns(self):
+        columns = BatchedColumns("i8", n_channels=3, batch_size=4)
+
+        for channel_index in range(3):
+            columns.add_dataset(channel_index, self.file.create_dataset("pulse_id_%d" % channel_index, shape=(0,),
+                                                                        maxshape=(None,), dtype="i8", chunks=(4,)))
+
+        for pulse_id in range(10):
+            columns.append([pulse_id] * 3)
+
+        columns.flush()
+
+        for channel_index in range(3):
+            self.assertListEqual(list(self.file["pulse_id_%d" % channel_index]), list(range(10)))
+
+    def test_presence_bitmap(self):
+        channel_names = ["channel_%d" % channel_index for channel_index in range(11)]
+
+        dataset = create_presence_bitmap_dataset(self.file, channel_names, 0, chunks=(4, 2))
+        presence_bitmap = PresenceBitmap(dataset, batch_size=4)
+
+        is_data_present = numpy.random.randint(0, 2, size=(10, 11)).astype(bool)
+
+        for row in is_data_present:
+            presence_bitmap.append(row)
+
+        # Missing pulses have no data for any channel.
+        presence_bitmap.append(0)
+        presence_bitmap.flush()
+
+        self.assertEqual(self.file["/is_data_present"].shape, (11, 2))
+
+        read_is_data_present, read_channel_names = read_presence_bitmap(self.file)
+
+        self.assertListEqual(read_channel_names, channel_names)
+        self.assertTrue((read_is_data_present[:10] == is_data_present).all())
+        self.assertFalse(read_is_data_present[10].any())
+
+    def test_batched_table(self):
+        dataset = self.file.create_dataset("table", shape=(0, 2), maxshape=(None, 2), dtype="f8", chunks=(4, 2))
+        table = BatchedTable(dataset, channel_indexes=[0, 2], batch_size=4)
+
+        for index in range(10):
+            data = [float(index), "text", numpy.array([index * 2]) if index % 2 else None]
+            table.append_row(data, numpy.array([data_point is not None for data_point in data]))
+
+        table.flush()
+
+        self.assertListEqual(list(self.file["table"][:, 0]), list(range(10)))
+        self.assertListEqual(list(self.file["table"][:, 1]), [index * 2 if index % 2 else 0 for index in range(10)])
+
+    def test_free_dataset_name(self):
+        self.assertEqual(get_free_dataset_name(self.file, "data"), "data(1)")
+
+        self.file.create_dataset("data(1)", data=numpy.zeros(1))
+        self.assertEqual(get_free_dataset_name(self.file, "data"), "data(2)")
@@ -3,11 +3,12 @@ import unittest
 import os
 
 import h5py
+import numpy
 from bsread import source
 from bsread.handlers import extended
 from bsread.sender import sender
 
-from sf_bsread_writer.writer_format import BsreadH5Writer
+from sf_bsread_writer.writer_format import BsreadH5Writer, get_chunk_shape, verify_format_parameters
 
 
 class TestWriterFormat(unittest.TestCase):
@@ -65,6 +66,51 @@ class TestWriterFormat(unittest.TestCase):
 
         file.close()
 
+    def test_start_missing_header_scalar_table(self):
+        parameters = dict(self.WRITER_PARAMETERS)
+        parameters["format/scalar_layout"] = "table"
+
+        self.writer.close()
+        self.writer = BsreadH5Writer(self.OUTPUT_FILE, parameters)
+
+        with sender(port=self.STREAM_PORT) as output_stream:
+            with source(host="localhost", port=self.STREAM_PORT) as input_stream:
+
+                for index in range(10):
+                    data = {"fast_source": index,
+                            "slow_source": None,
+                            "slow_waveform": None}
+
+                    output_stream.send(data=data)
+                    self.writer.write_message(input_stream.receive(handler=self.handler.receive))
+
+                for index in range(10, 20):
+                    data = {"fast_source": index,
+                            "slow_source": index,
+                            "slow_waveform": numpy.full(3, index, dtype="u2")}
+
+                    output_stream.send(data=data)
+                    self.writer.write_message(input_stream.receive(handler=self.handler.receive))
+
+        self.writer.close()
+
+        file = h5py.File(self.OUTPUT_FILE)
+
+        # Only the channels with data in the first message are in the tables.
+        table = file["/scalars/int64/data"]
+        self.assertListEqual(list(table.attrs["channel_names"]), ["fast_source"])
+        self.assertListEqual(list(table[:, 0]), list(range(20)))
+
+        slow_source = file["/data/slow_source/data"]
+        self.assertListEqual(list(slow_source[:10]), [0] * 10)
+        self.assertListEqual(list(slow_source[10:]), list(range(10, 20)))
+
+        slow_waveform = file["/data/slow_waveform/data"]
+        self.assertEqual(slow_waveform.shape, (20, 3))
+        self.assertListEqual(slow_waveform[10:, 0].tolist(), list(range(10, 20)))
+
+        file.close()
+
     def test_change_header(self):
 
         with sender(port=self.STREAM_PORT) as output_stream:
@@ -110,3 +156,232 @@ class TestWriterFormat(unittest.TestCase):
             self.assertListEqual(list(changing_source_2[index]), [index] * 3)
 
         file.close()
+
+    def test_batched_write(self):
+        parameters = dict(self.WRITER_PARAMETERS)
+        parameters["format/batch_size"] = 10
+        parameters["format/flush_interval"] = 60
+
+        self.writer.close()
+        self.writer = BsreadH5Writer(self.OUTPUT_FILE, parameters)
+
+        with sender(port=self.STREAM_PORT) as output_stream:
+            with source(host="localhost", port=self.STREAM_PORT) as input_stream:
+
+                for index in range(25):
+                    output_stream.send(pulse_id=index, data={"scalar_source": index})
+                    self.writer.write_message(input_stream.receive(handler=self.handler.receive))
+
+                # Only complete batches are in the file before closing.
+                self.assertEqual(len(self.writer.file["/data/scalar_source/data"]), 20)
+                self.assertEqual(len(self.writer.file["/data/scalar_source/pulse_id"]), 20)
+
+        self.writer.close()
+
+        file = h5py.File(self.OUTPUT_FILE)
+
+        self.assertListEqual(list(file["/data/scalar_source/data"]), list(range(25)))
+        self.assertListEqual(list(file["/data/scalar_source/pulse_id"]), list(range(25)))
+        self.assertListEqual(list(file["/data/scalar_source/is_data_present"]), [1] * 25)
+
+        file.close()
+
+    def test_chunk_shape(self):
+        # Scalars and small waveforms keep whole rows in a chunk.
+        self.assertEqual(get_chunk_shape("f8", [1], chunk_bytes=1024 * 1024, max_chunk_rows=4096), (4096, 1))
+        self.assertEqual(get_chunk_shape("f8", [2048], chunk_bytes=1024 * 1024), (64, 2048))
+
+        # Images are split along the slowest changing axis.
+        self.assertEqual(get_chunk_shape("u2", [1024, 1280], chunk_bytes=1024 * 1024), (1, 256, 1280))
+        self.assertEqual(get_chunk_shape("u2", [1024, 1280], chunk_bytes=4 * 1024 * 1024), (1, 1024, 1280))
+
+    def test_compression(self):
+        parameters = dict(self.WRITER_PARAMETERS)
+        parameters["format/compression"] = {"image_*": "gzip", "image_raw": "none"}
+
+        self.writer.close()
+        self.writer = BsreadH5Writer(self.OUTPUT_FILE, parameters)
+
+        with sender(port=self.STREAM_PORT) as output_stream:
+            with source(host="localhost", port=self.STREAM_PORT) as input_stream:
+
+                for index in range(25):
+                    output_stream.send(data={"image_compressed": numpy.full((4, 4), index, dtype="u2"),
+                                             "image_raw": numpy.full((4, 4), index, dtype="u2")})
+                    self.writer.write_message(input_stream.receive(handler=self.handler.receive))
+
+        self.writer.close()
+
+        file = h5py.File(self.OUTPUT_FILE)
+
+        self.assertEqual(file["/data/image_compressed/data"].compression, "gzip")
+        self.assertIsNone(file["/data/image_raw/data"].compression)
+
+        for index in range(25):
+            self.assertTrue((file["/data/image_compressed/data"][index] == index).all())
+
+        file.close()
+
+    def test_compression_change_header(self):
+        parameters = dict(self.WRITER_PARAMETERS)
+        parameters["format/compression"] = {"cam": "gzip"}
+
+        self.writer.close()
+        self.writer = BsreadH5Writer(self.OUTPUT_FILE, parameters)
+
+        with sender(port=self.STREAM_PORT) as output_stream:
+            with source(host="localhost", port=self.STREAM_PORT) as input_stream:
+
+                # The compressed datasets are created after the first row - first without data, then changed.
+                for index in range(3):
+                    output_stream.send(data={"cam": None, "scalar_source": index})
+                    self.writer.write_message(input_stream.receive(handler=self.handler.receive))
+
+                for index in range(3, 10):
+                    output_stream.send(data={"cam": numpy.full((4, 4), index, dtype="u2"), "scalar_source": index})
+                    self.writer.write_message(input_stream.receive(handler=self.handler.receive))
+
+                for index in range(10, 15):
+                    output_stream.send(data={"cam": numpy.full((2, 4), index, dtype="u2"), "scalar_source": index})
+                    self.writer.write_message(input_stream.receive(handler=self.handler.receive))
+
+        self.writer.close()
+
+        file = h5py.File(self.OUTPUT_FILE)
+
+        self.assertEqual(file["/data/cam/data"].compression, "gzip")
+        self.assertEqual(len(file["/data/cam/data"]), 15)
+
+        for index in range(15):
+            self.assertTrue((file["/data/cam/data"][index] == (index if index >= 10 else 0)).all())
+
+        for index in range(3, 10):
+            self.assertTrue((file["/data/cam/data(1)"][index] == index).all())
+
+        file.close()
+
+    def test_unknown_compression(self):
+        with self.assertRaises(ValueError):
+            verify_format_parameters({"format/compression_types": {"uint16": "zip"}})
+
+    def test_preallocation(self):
+        parameters = dict(self.WRITER_PARAMETERS)
+        parameters["format/pulse_id_step"] = 1
+
+        self.writer.close()
+        self.writer = BsreadH5Writer(self.OUTPUT_FILE, parameters)
+        self.writer.set_pulse_range(100, 199)
+
+        with sender(port=self.STREAM_PORT) as output_stream:
+            with source(host="localhost", port=self.STREAM_PORT) as input_stream:
+
+                for pulse_id in range(100, 150):
+                    # Pulse 120 is lost.
+                    if pulse_id == 120:
+                        continue
+
+                    output_stream.send(pulse_id=pulse_id, data={"scalar_source": pulse_id})
+                    self.writer.write_message(input_stream.receive(handler=self.handler.receive))
+
+                self.assertEqual(len(self.writer.file["/data/scalar_source/data"]), 100)
+
+        self.writer.close()
+
+        file = h5py.File(self.OUTPUT_FILE)
+
+        # The datasets are shrunk to the last written pulse, and each pulse is at its offset.
+        self.assertListEqual(list(file["/data/scalar_source/pulse_id"]), list(range(100, 150)))
+        self.assertEqual(file["/data/scalar_source/data"][20], 0)
+        self.assertEqual(file["/data/scalar_source/is_data_present"][20], 0)
+        self.assertEqual(file["/data/scalar_source/data"][21], 121)
+
+        file.close()
+
+    def test_max_pulse_id_gap(self):
+        parameters = dict(self.WRITER_PARAMETERS)
+        parameters["format/pulse_id_step"] = 1
+        parameters["format/max_pulse_id_gap"] = 10
+
+        self.writer.close()
+        self.writer = BsreadH5Writer(self.OUTPUT_FILE, parameters)
+        self.writer.set_pulse_range(100)
+
+        with sender(port=self.STREAM_PORT) as output_stream:
+            with source(host="localhost", port=self.STREAM_PORT) as input_stream:
+
+                # The gap before 200 is too large to fill, and 150 is before the last written row.
+                for pulse_id in [100, 101, 102, 110, 200, 201, 150, 202]:
+                    output_stream.send(pulse_id=pulse_id, data={"scalar_source": pulse_id})
+                    self.writer.write_message(input_stream.receive(handler=self.handler.receive))
+
+        self.writer.close()
+
+        file = h5py.File(self.OUTPUT_FILE)
+
+        self.assertListEqual(list(file["/data/scalar_source/pulse_id"]), list(range(100, 111)) + [200, 201, 202])
+        self.assertListEqual(list(file["/data/scalar_source/is_data_present"][:4]), [1, 1, 1, 0])
+        self.assertListEqual(list(file["/data/scalar_source/data"][-4:, 0]), [110, 200, 201, 202])
+
+        file.close()
+
+    def test_swmr(self):
+        parameters = dict(self.WRITER_PARAMETERS)
+        parameters["format/swmr"] = True
+        parameters["format/flush_interval"] = 0
+
+        self.writer.close()
+        self.writer = BsreadH5Writer(self.OUTPUT_FILE, parameters)
+
+        with sender(port=self.STREAM_PORT) as output_stream:
+            with source(host="localhost", port=self.STREAM_PORT) as input_stream:
+
+                output_stream.send(pulse_id=0, data={"scalar_source": 0})
+                self.writer.write_message(input_stream.receive(handler=self.handler.receive))
+
+                # The file can be read while it is written.
+                reader = h5py.File(self.OUTPUT_FILE, "r", libver="latest", swmr=True)
+                scalar_source = reader["/data/scalar_source/data"]
+
+                for index in range(1, 10):
+                    output_stream.send(pulse_id=index, data={"scalar_source": index})
+                    self.writer.write_message(input_stream.receive(handler=self.handler.receive))
+
+                    scalar_source.refresh()
+                    self.assertEqual(len(scalar_source), index + 1)
+                    self.assertEqual(scalar_source[index], index)
+
+        self.writer.close()
+        reader.close()
+
+    def test_scalar_table(self):
+        parameters = dict(self.WRITER_PARAMETERS)
+        parameters["format/scalar_layout"] = "table"
+
+        self.writer.close()
+        self.writer = BsreadH5Writer(self.OUTPUT_FILE, parameters)
+
+        with sender(port=self.STREAM_PORT) as output_stream:
+            with source(host="localhost", port=self.STREAM_PORT) as input_stream:
+
+                for index in range(10):
+                    output_stream.send(pulse_id=index, data={"scalar_1": float(index),
+                                                             "scalar_2": float(index) if index % 2 else None,
+                                                             "waveform": numpy.full(3, index, dtype="u2")})
+                    self.writer.write_message(input_stream.receive(handler=self.handler.receive))
+
+        self.writer.close()
+
+        file = h5py.File(self.OUTPUT_FILE)
+
+        table = file["/scalars/float64/data"]
+        channel_names = list(table.attrs["channel_names"])
+
+        self.assertListEqual(list(file["/scalars/pulse_id"]), list(range(10)))
+        self.assertListEqual(list(table[:, channel_names.index("scalar_1")]), list(range(10)))
+        self.assertListEqual(list(file["/scalars/float64/is_data_present"][:, channel_names.index("scalar_2")]),
+                             [index % 2 for index in range(10)])
+
+        # Only the other channels have a group.
+        self.assertListEqual(list(file["/data"]), ["waveform"])
+
+        file.close()
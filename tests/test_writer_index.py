@@ -0,0 +1,55 @@
+import unittest
+
+import h5py
+
+from sf_bsread_writer.writer_index import PulseIdIndex, find_row, get_pulse_id_rows, merge_indexes, write_index
+
+
+def get_memory_file(name):
+    return h5py.File(name, "w", driver="core", backing_store=False)
+
+
+class TestPulseIdIndex(unittest.TestCase):
+
+    def test_find_row(self):
+        index = PulseIdIndex(["fast_source", "late_source"])
+
+        # Message 104 arrives after 105, and late_source is 2 pulses late from message 107 on.
+        for pulse_id in [100, 101, 102, 103, 105, 104, 106, 107, 108, 109]:
+            index.append(pulse_id, [pulse_id, pulse_id - 2 if pulse_id >= 107 else pulse_id])
+
+        # Only the change of late_source is in the index.
+        self.assertListEqual(index.offset_changes, [(7, 1, -2)])
+
+        with get_memory_file("index.h5") as file:
+            index.write(file)
+
+            self.assertListEqual(list(file["/index/pulse_id"]), list(range(100, 110)))
+            self.assertEqual(find_row(file, 104), 5)
+            self.assertIsNone(find_row(file, 110))
+
+            self.assertDictEqual(get_pulse_id_rows(file, 103), {"fast_source": 3, "late_source": 3})
+            self.assertDictEqual(get_pulse_id_rows(file, 107), {"fast_source": 7, "late_source": 9})
+            self.assertDictEqual(get_pulse_id_rows(file, 108), {"fast_source": 8, "late_source": None})
+
+    def test_merge_indexes(self):
+        files = [get_memory_file("part_%d.h5" % index) for index in range(2)]
+
+        write_index(files[0], [100, 101, 102], ["fast_source", "late_source"], [(1, 1, -1)])
+        write_index(files[1], [103, 104, 105], ["fast_source", "late_source"], [(2, 1, -1)])
+
+        row_pulse_ids, channel_names, offset_changes = merge_indexes(files)
+
+        self.assertListEqual(list(row_pulse_ids), list(range(100, 106)))
+        self.assertListEqual(channel_names, ["fast_source", "late_source"])
+
+        # The offsets start from 0 in each file.
+        self.assertListEqual([tuple(int(value) for value in change) for change in offset_changes],
+                             [(1, 1, -1), (3, 1, 0), (5, 1, -1)])
+
+        for file in files:
+            file.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
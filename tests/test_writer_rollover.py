@@ -0,0 +1,63 @@
+import unittest
+
+import os
+
+import h5py
+from bsread import source
+from bsread.handlers import extended
+from bsread.sender import sender
+
+from sf_bsread_writer.writer_rollover import create_h5_writer, get_part_file_name
+
+
+class TestWriterRollover(unittest.TestCase):
+
+    OUTPUT_FILE = "ignore_writer_rollover.h5"
+    STREAM_PORT = 12001
+    WRITER_PARAMETERS = {"general/created": "now",
+                         "general/instrument": "guitar",
+                         "general/process": "deterministic",
+                         "general/user": "no, thank you",
+                         "format/rollover_pulses": 10}
+
+    def setUp(self):
+        self.handler = extended.Handler()
+
+    def tearDown(self):
+        for file_name in [self.OUTPUT_FILE] + [get_part_file_name(self.OUTPUT_FILE, index) for index in range(5)]:
+            try:
+                os.remove(file_name)
+            except:
+                pass
+
+    def test_rollover(self):
+        writer = create_h5_writer(self.OUTPUT_FILE, self.WRITER_PARAMETERS)
+
+        with sender(port=self.STREAM_PORT) as output_stream:
+            with source(host="localhost", port=self.STREAM_PORT) as input_stream:
+
+                for index in range(25):
+                    output_stream.send(pulse_id=index, data={"scalar_source": index})
+                    writer.write_message(input_stream.receive(handler=self.handler.receive))
+
+                    # Each part is closed as soon as it is complete.
+                    if index == 10:
+                        with h5py.File(get_part_file_name(self.OUTPUT_FILE, 0), "r") as part:
+                            self.assertListEqual(list(part["/data/scalar_source/data"]), list(range(10)))
+
+        writer.close()
+
+        for index in range(3):
+            self.assertTrue(os.path.exists(get_part_file_name(self.OUTPUT_FILE, index)))
+
+        # The master file shows all the parts as one dataset per channel.
+        with h5py.File(self.OUTPUT_FILE, "r") as file:
+            self.assertTrue(file["/data/scalar_source/data"].is_virtual)
+
+            self.assertListEqual(list(file["/data/scalar_source/data"]), list(range(25)))
+            self.assertListEqual(list(file["/data/scalar_source/pulse_id"]), list(range(25)))
+            self.assertEqual(file["/general/user"][()], b"no, thank you")
+
+
+if __name__ == '__main__':
+    unittest.main()